@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from lib.copier import LINK_MODES
+from lib.fixtures import generate_clroot
+from lib.manifest import DEFAULT_PAGE_MODE, PAGE_MODES
+
+# each scale is a number of handler modules; containers and pkg modules
+# scale with it
+DEFAULT_SCALES = [50, 200, 1000]
+STAGES = ["copy_packages", "build_next_structure", "codemod_scan"]
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_maxrss / 1024
+
+
+def run_stages(jobs, link_mode, copy_workers, page_mode) -> dict:
+    """
+    Runs the pipeline stages against the clroot and Leopard directories in
+    CL_HOME and LEOPARD_HOME, with the parse cache off so every run is cold.
+    Returns the wall time and peak RSS after each stage, along with the phase
+    breakdown and counters recorded by lib.instrument.
+
+    lib.paths reads the environment on import, so this runs in a fresh
+    process for each scale.
+    """
+    from lib.cache import configure_cache
+    from lib.codemods import collect_codemod_files
+    from lib.convert import build_next_structure
+    from lib.importgraph import ImportGraph
+    from lib.instrument import phase, write_trace
+    from lib.paths import LEOPARD_PKG_DIR
+    from lib.setup import copy_packages, prep_leopard
+
+    configure_cache(enabled=False, purge=False)
+    prep_leopard(dryrun=False)
+
+    results = {}
+
+    def timed(stage, fn):
+        start = time.perf_counter()
+        with phase(stage):
+            fn()
+        results[stage] = {
+            "seconds": round(time.perf_counter() - start, 3),
+            "peak_rss_mb": round(_peak_rss_mb(), 1),
+        }
+
+    def codemod_scan():
+        # the parts of run_codemods that don't need node: finding the files
+        # and building the import graph for the recursive deletions
+        collect_codemod_files()
+        graph = ImportGraph(LEOPARD_PKG_DIR).update()
+        seeds = [path for path in graph.imports if "/merchant/stores/" in path]
+        graph.dependents_closure(seeds)
+
+    timed(
+        "copy_packages",
+        lambda: copy_packages(dryrun=False, link_mode=link_mode, workers=copy_workers),
+    )
+    timed(
+        "build_next_structure",
+        lambda: build_next_structure(jobs=jobs, pageMode=page_mode),
+    )
+    timed("codemod_scan", codemod_scan)
+
+    tracePath = write_trace(os.path.join(os.environ["LEOPARD_HOME"], "trace.json"))
+    with open(tracePath, "r") as f:
+        trace = json.load(f)
+
+    return {
+        "stages": results,
+        "phases": trace["phases"],
+        "counters": trace["counters"],
+    }
+
+
+def benchmark_scale(scale, args) -> dict:
+    """
+    Generates a fixture clroot for the given scale in a temporary directory
+    and runs the stages over it in a child process.
+    """
+    workDir = tempfile.mkdtemp(prefix="leopard-bench-")
+    try:
+        clrootDir = os.path.join(workDir, "clroot")
+        leopardDir = os.path.join(workDir, "leopard")
+        os.makedirs(os.path.join(leopardDir, "src/pkg"))
+
+        start = time.perf_counter()
+        fixture = generate_clroot(
+            clrootDir,
+            handlers=scale,
+            containers_per_handler=args.containers_per_handler,
+            components=scale * args.components_per_handler,
+            imports_per_file=args.imports_per_file,
+            seed=args.seed,
+        )
+        fixture["seconds"] = round(time.perf_counter() - start, 3)
+        logging.warning(
+            "scale {scale}: generated {files} files ({containers} containers) in {seconds:.1f}s".format(
+                scale=scale, **fixture
+            )
+        )
+
+        command = [
+            sys.executable,
+            os.path.abspath(__file__),
+            "--run-stages",
+            f"--jobs={args.jobs}",
+            f"--link-mode={args.link_mode}",
+            f"--page-mode={args.page_mode}",
+        ]
+        if args.copy_workers is not None:
+            command.append(f"--copy-workers={args.copy_workers}")
+        result = subprocess.run(
+            command,
+            env=dict(os.environ, CL_HOME=clrootDir, LEOPARD_HOME=leopardDir),
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdout=subprocess.PIPE,
+            stderr=None if args.verbose else subprocess.DEVNULL,
+            check=True,
+            text=True,
+        )
+        # the stage results are the last line, after anything the stages print
+        stages = json.loads(result.stdout.strip().splitlines()[-1])
+        return dict(stages, scale=scale, fixture=fixture)
+    finally:
+        if args.keep:
+            logging.warning(f"kept fixture in {workDir}")
+        else:
+            shutil.rmtree(workDir)
+
+
+def benchmark_extractors(scale, args) -> dict:
+    """
+    Generates a fixture clroot for the given scale and times extracting the
+    handlers from every handler file with ast against the token extractor,
+    checking they agree on every file both can read.
+    """
+    from lib.convert import _ast_handlers, _token_handlers
+    from lib.paths import CLROOT_HANDLERS_PATH
+
+    workDir = tempfile.mkdtemp(prefix="leopard-bench-")
+    try:
+        clrootDir = os.path.join(workDir, "clroot")
+        generate_clroot(
+            clrootDir,
+            handlers=scale,
+            containers_per_handler=args.containers_per_handler,
+            components=0,
+            imports_per_file=0,
+            seed=args.seed,
+        )
+        contents = []
+        for dirpath, _, filenames in os.walk(
+            os.path.join(clrootDir, CLROOT_HANDLERS_PATH)
+        ):
+            for filename in sorted(filenames):
+                with open(os.path.join(dirpath, filename), "rb") as f:
+                    contents.append(f.read())
+    finally:
+        shutil.rmtree(workDir)
+
+    def parse(source):
+        try:
+            return _ast_handlers(source)
+        except SyntaxError:
+            return None
+
+    start = time.perf_counter()
+    astRecords = [parse(source) for source in contents]
+    astSeconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    tokenRecords = [_token_handlers(source) for source in contents]
+    tokenSeconds = time.perf_counter() - start
+
+    return {
+        "scale": scale,
+        "files": len(contents),
+        "ast_seconds": round(astSeconds, 3),
+        "token_seconds": round(tokenSeconds, 3),
+        "ast_unreadable": astRecords.count(None),
+        "token_ambiguous": tokenRecords.count(None),
+        "mismatches": sum(
+            1
+            for astResult, tokenResult in zip(astRecords, tokenRecords)
+            if astResult is not None
+            and tokenResult is not None
+            and astResult != tokenResult
+        ),
+    }
+
+
+def log_results(results) -> None:
+    for result in results:
+        stages = ", ".join(
+            "{stage} {seconds:.2f}s ({peak_rss_mb:.0f}MB)".format(
+                stage=stage, **result["stages"][stage]
+            )
+            for stage in STAGES
+        )
+        logging.warning(
+            "scale {scale} ({containers} containers, {files} files): {stages}".format(
+                scale=result["scale"], stages=stages, **result["fixture"]
+            )
+        )
+
+
+def main(args) -> int:
+    if args.run_stages:
+        print(
+            json.dumps(
+                run_stages(
+                    args.jobs, args.link_mode, args.copy_workers, args.page_mode
+                )
+            )
+        )
+        return 0
+
+    if args.extractors:
+        results = [benchmark_extractors(scale, args) for scale in args.scales]
+        for result in results:
+            logging.warning(
+                "scale {scale} ({files} handler files): ast {ast_seconds:.2f}s ({ast_unreadable} unreadable), tokens {token_seconds:.2f}s ({token_ambiguous} ambiguous), {mismatches} mismatches".format(
+                    **result
+                )
+            )
+    else:
+        results = [benchmark_scale(scale, args) for scale in args.scales]
+        log_results(results)
+
+    output = args.output
+    if output is None:
+        output = "{dir}/lib/logs/{name}_{uid}.json".format(
+            dir=os.path.dirname(os.path.abspath(__file__)),
+            name="extractors" if args.extractors else "benchmark",
+            uid=round(time.time()),
+        )
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    logging.warning(f"wrote benchmark results to {output}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the conversion against synthetic clroot checkouts of increasing size. Runs offline; npm, git and jscodeshift are not needed.",
+    )
+    parser.add_argument(
+        "--scales",
+        help="number of handler modules in each generated clroot (default: %(default)s)",
+        type=int,
+        nargs="+",
+        default=DEFAULT_SCALES,
+    )
+    parser.add_argument(
+        "--containers-per-handler",
+        help="containers assigned in each handler module",
+        type=int,
+        default=3,
+    )
+    parser.add_argument(
+        "--components-per-handler",
+        help="pkg modules generated for each handler module",
+        type=int,
+        default=10,
+    )
+    parser.add_argument(
+        "--imports-per-file",
+        help="imports of other pkg modules in each generated module",
+        type=int,
+        default=3,
+    )
+    parser.add_argument(
+        "--seed", help="seed for the generated import graph", type=int, default=0
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="number of processes to parse handler files with",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--link-mode",
+        help="how copy_packages copies files",
+        choices=LINK_MODES,
+        default="copy",
+    )
+    parser.add_argument(
+        "--page-mode",
+        help="how build_next_structure writes pages",
+        choices=PAGE_MODES,
+        default=DEFAULT_PAGE_MODE,
+    )
+    parser.add_argument(
+        "--copy-workers",
+        help="number of threads to copy files with",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="where to write the results (default: lib/logs/benchmark_<timestamp>.json)",
+        default=None,
+    )
+    parser.add_argument(
+        "-k",
+        "--keep",
+        help="keep the generated fixtures instead of deleting them",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        help="show the pipeline's own logging",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--extractors",
+        help="instead of the pipeline stages, compare extracting handlers with ast and with the token extractor (written to lib/logs/extractors_<timestamp>.json by default)",
+        action="store_true",
+    )
+    parser.add_argument("--run-stages", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    raise SystemExit(main(args))
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+from typing import Any, Callable, Tuple
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+CACHE_DIR = "{dir}/cache".format(dir=os.path.dirname(os.path.abspath(__file__)))
+
+# the kinds of parsed files cached, each in a directory of its own. the rest
+# of lib/cache (snapshots, shard outputs, clroot exports...) is left to the
+# modules that write it
+PARSE_CACHE_KINDS = ("handlers", "routes")
+
+_cacheEnabled = True
+_cacheStats = {}
+
+
+def configure_cache(enabled=True, purge=False) -> None:
+    """
+    Sets up the on-disk parse cache for this run. `enabled=False` bypasses the
+    cache entirely (nothing is read or written) and `purge=True` deletes every
+    cached entry (see PARSE_CACHE_KINDS) before the run starts.
+    """
+    global _cacheEnabled
+    _cacheEnabled = enabled
+
+    if purge:
+        logging.warning("purging parse cache in {dir}".format(dir=CACHE_DIR))
+        for kind in PARSE_CACHE_KINDS:
+            path = os.path.join(CACHE_DIR, kind)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+
+
+def cache_enabled() -> bool:
+    return _cacheEnabled
+
+
+def content_hash(contents: bytes, version: int) -> str:
+    """
+    Returns the cache key for a file's contents as parsed by the given parser
+    version.
+    """
+    digest = hashlib.sha256()
+    digest.update("v{version}\0".format(version=version).encode())
+    digest.update(contents)
+    return digest.hexdigest()
+
+
+def _cache_path(kind: str, key: str) -> str:
+    return "{dir}/{kind}/{key}.json".format(dir=CACHE_DIR, kind=kind, key=key)
+
+
+def lookup_cached(kind: str, key: str) -> Tuple[bool, Any]:
+    """
+    Looks up the cached result of parsing the contents hashed to `key` (see
+    content_hash) with the given kind of parser. Returns a (found, value)
+    pair and counts the hit or miss.
+    """
+    stats = _cacheStats.setdefault(kind, {"hits": 0, "misses": 0})
+    if _cacheEnabled:
+        try:
+            with open(_cache_path(kind, key), "r") as f:
+                value = json.load(f)
+            stats["hits"] += 1
+            return (True, value)
+        except (OSError, ValueError):
+            pass
+
+    stats["misses"] += 1
+    return (False, None)
+
+
+def store_cached(kind: str, key: str, value: Any) -> None:
+    """
+    Stores the (json serializable) result of parsing the contents hashed to
+    `key` with the given kind of parser. Entries are written atomically, so
+    concurrent runs never see a partial entry.
+    """
+    if not _cacheEnabled:
+        return
+
+    path = _cache_path(kind, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmpPath = "{path}.{pid}.tmp".format(path=path, pid=os.getpid())
+    with open(tmpPath, "w") as f:
+        json.dump(value, f)
+    os.replace(tmpPath, path)
+
+
+def load_cached(
+    kind: str, version: int, contents: bytes, compute: Callable[[], Any]
+) -> Any:
+    """
+    Returns the cached result of parsing `contents` with the given kind of
+    parser, calling `compute` and storing its (json serializable) result on a
+    miss. Entries are keyed by content hash and parser version, so a file that
+    hasn't changed since the last run is never parsed again.
+    """
+    key = content_hash(contents, version)
+    found, value = lookup_cached(kind, key)
+    if not found:
+        value = compute()
+        store_cached(kind, key, value)
+
+    return value
+
+
+def log_cache_stats() -> None:
+    """
+    Logs out the parse cache hit and miss counts for this run.
+    """
+    for kind, stats in sorted(_cacheStats.items()):
+        logging.warning(
+            "parse cache ({kind}): {hits} hits, {misses} misses".format(
+                kind=kind, hits=stats["hits"], misses=stats["misses"]
+            )
+        )
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+from typing import List, Optional
+
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tarfile
+import time
+
+from lib import paths
+from lib.cache import CACHE_DIR
+from lib.instrument import count
+
+REFRESH_MODES = ["pull", "archive", "worktree"]
+EXPORT_DIR = "{dir}/clroot_export".format(dir=CACHE_DIR)
+WORKTREE_DIR = "{dir}/clroot_worktree".format(dir=CACHE_DIR)
+REVISION_PATH = "{dir}/clroot_revision.json".format(dir=CACHE_DIR)
+
+# paths per git archive call, to stay well under the argument length limit
+_ARCHIVE_CHUNK = 500
+_SHA_RE = re.compile(r"[0-9a-f]{7,40}")
+
+
+class GitException(Exception):
+    pass
+
+
+def clroot_read_paths() -> List[str]:
+    """
+    Returns the clroot paths (relative to the clroot root) the conversion
+    reads; nothing else has to be checked out or exported.
+    """
+    return [paths.CLROOT_PKG_PATH, paths.CLROOT_HANDLERS_PATH] + list(
+        paths.CLROOT_URI_SPEC_PATHS
+    )
+
+
+def clroot_tree_sha() -> str:
+    """
+    Returns a hash of the contents of every clroot file the conversion reads
+    (see clroot_read_paths), wherever they're read from. Unlike the revision
+    the last refresh recorded, it tells apart trees with local edits, or read
+    with --skip-refresh after a checkout, so runs on different machines can
+    check they converted the same files.
+    """
+    digest = hashlib.sha256()
+    for readPath in clroot_read_paths():
+        root = os.path.join(paths.CLROOT_SOURCE_DIR, readPath)
+        files = [root] if os.path.isfile(root) else []
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            files += [os.path.join(dirpath, filename) for filename in sorted(filenames)]
+        for path in files:
+            digest.update(os.path.relpath(path, paths.CLROOT_SOURCE_DIR).encode())
+            with open(path, "rb") as f:
+                digest.update(b"\0" + hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+
+def clroot_source_sha() -> Optional[str]:
+    """
+    Returns the clroot commit whose files this run reads, or None when they
+    may not match any commit: the clroot checkout itself is only trusted if
+    none of the files the conversion reads have uncommitted changes.
+    """
+    sourceDir = paths.CLROOT_SOURCE_DIR
+    if sourceDir != paths.CLROOT_DIR:
+        # exported or checked out by refresh_clroot, which recorded the commit
+        revision = read_clroot_revision()
+        if revision is not None and revision["sourceDir"] == sourceDir:
+            return revision["sha"]
+        return None
+
+    try:
+        status = run_git(["status", "--porcelain", "--"] + clroot_read_paths())
+        if status.strip():
+            logging.warning("clroot has uncommitted changes")
+            return None
+        return run_git(["rev-parse", "HEAD"]).strip()
+    except GitException as e:
+        logging.warning(f"couldn't determine the clroot commit: {e}")
+        return None
+
+
+def run_git(args: List[str], cwd: Optional[str] = None) -> str:
+    count("subprocesses spawned")
+    try:
+        return subprocess.check_output(
+            ["git"] + args, cwd=cwd or paths.CLROOT_DIR, text=True
+        )
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise GitException(
+            "git {command} failed with error {e}".format(command=args[0], e=e)
+        )
+
+
+def resolve_revision(ref: str, remote: str = "origin") -> str:
+    """
+    Returns the commit SHA for ref, fetching it from the remote (which only
+    updates clroot's remote refs, never its working tree) unless ref is a
+    commit that is already present.
+    """
+    if _SHA_RE.fullmatch(ref):
+        try:
+            return run_git(
+                ["rev-parse", "--verify", "--quiet", ref + "^{commit}"]
+            ).strip()
+        except GitException:
+            pass
+
+    logging.warning(f"fetching {ref} from {remote}")
+    run_git(["fetch", remote, ref])
+    return run_git(["rev-parse", "FETCH_HEAD^{commit}"]).strip()
+
+
+def read_clroot_revision() -> Optional[dict]:
+    """
+    Returns the clroot revision the last refresh used: its `sha`, the refresh
+    `mode`, the `sourceDir` the files were read from, and when it was taken.
+    """
+    try:
+        with open(REVISION_PATH, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def record_clroot_revision(mode: str, sha: str, sourceDir: str) -> None:
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmpPath = "{path}.{pid}.tmp".format(path=REVISION_PATH, pid=os.getpid())
+    with open(tmpPath, "w") as f:
+        json.dump(
+            {"mode": mode, "sha": sha, "sourceDir": sourceDir, "time": time.time()}, f
+        )
+    os.replace(tmpPath, REVISION_PATH)
+
+
+def _extract(sha: str, pathspecs: List[str], dest: str) -> None:
+    """
+    Extracts the given paths at the given commit into dest with git archive,
+    streaming the tar straight from git.
+    """
+    # the "data" filter only exists (and is only needed) on newer pythons
+    extractArgs = {"filter": "data"} if hasattr(tarfile, "data_filter") else {}
+    for i in range(0, len(pathspecs), _ARCHIVE_CHUNK):
+        command = ["git", "archive", "--format=tar", sha, "--"]
+        command += pathspecs[i : i + _ARCHIVE_CHUNK]
+        count("subprocesses spawned")
+        try:
+            process = subprocess.Popen(
+                command, cwd=paths.CLROOT_DIR, stdout=subprocess.PIPE
+            )
+        except OSError as e:
+            raise GitException(f"git archive failed with error {e}")
+        with process:
+            with tarfile.open(fileobj=process.stdout, mode="r|") as tar:
+                tar.extractall(dest, **extractArgs)
+        if process.returncode != 0:
+            raise GitException(
+                "git archive failed with exit status {code}".format(
+                    code=process.returncode
+                )
+            )
+
+
+def _remove_exported(relPath: str) -> None:
+    path = os.path.join(EXPORT_DIR, relPath)
+    if os.path.lexists(path):
+        os.remove(path)
+    # clear out directories left empty
+    parent = os.path.dirname(path)
+    while parent != EXPORT_DIR and os.path.isdir(parent) and not os.listdir(parent):
+        os.rmdir(parent)
+        parent = os.path.dirname(parent)
+
+
+def export_clroot(ref: str) -> str:
+    """
+    Exports the parts of clroot the conversion reads, at ref, into
+    lib/cache/clroot_export without touching clroot's working tree. When the
+    export already holds an earlier commit, only the files that changed since
+    are re-extracted (unchanged files keep their mtimes, so --sync skips
+    them). Returns the exported commit's SHA.
+    """
+    sha = resolve_revision(ref)
+    previous = read_clroot_revision()
+    readPaths = clroot_read_paths()
+
+    if (
+        previous is not None
+        and previous["mode"] == "archive"
+        and os.path.isdir(EXPORT_DIR)
+    ):
+        if previous["sha"] == sha:
+            logging.warning(f"clroot export already at {sha}")
+            return sha
+
+        try:
+            output = run_git(
+                ["diff", "--name-status", "--no-renames", "-z", previous["sha"], sha]
+                + ["--"]
+                + readPaths
+            )
+        except GitException as e:
+            logging.warning(f"re-exporting all of clroot, couldn't diff: {e}")
+        else:
+            fields = output.split("\0")[:-1]
+            changed = []
+            removed = 0
+            for status, relPath in zip(fields[0::2], fields[1::2]):
+                if status == "D":
+                    _remove_exported(relPath)
+                    removed += 1
+                else:
+                    changed.append(relPath)
+            _extract(sha, changed, EXPORT_DIR)
+            logging.warning(
+                "updated clroot export from {old} to {new}: {changed} files extracted, {removed} removed".format(
+                    old=previous["sha"][:10],
+                    new=sha[:10],
+                    changed=len(changed),
+                    removed=removed,
+                )
+            )
+            return sha
+
+    tmpDir = EXPORT_DIR + ".tmp"
+    if os.path.isdir(tmpDir):
+        shutil.rmtree(tmpDir)
+    os.makedirs(tmpDir)
+    logging.warning(f"exporting clroot at {sha} to {EXPORT_DIR}")
+    _extract(sha, readPaths, tmpDir)
+    if os.path.isdir(EXPORT_DIR):
+        shutil.rmtree(EXPORT_DIR)
+    os.rename(tmpDir, EXPORT_DIR)
+    return sha
+
+
+def checkout_clroot_worktree(ref: str) -> str:
+    """
+    Checks ref out into a dedicated sparse worktree of clroot at
+    lib/cache/clroot_worktree that only contains the paths the conversion
+    reads, creating the worktree if needed. The developer's own checkout is
+    never touched. Returns the checked out commit's SHA.
+    """
+    sha = resolve_revision(ref)
+
+    if os.path.isdir(WORKTREE_DIR):
+        # lib/cache is inside Leopard's repo, so a broken worktree would
+        # otherwise be taken for part of Leopard
+        try:
+            topLevel = run_git(["rev-parse", "--show-toplevel"], cwd=WORKTREE_DIR)
+        except GitException:
+            topLevel = ""
+        if os.path.realpath(topLevel.strip()) != os.path.realpath(WORKTREE_DIR):
+            logging.warning(f"removing broken worktree {WORKTREE_DIR}")
+            shutil.rmtree(WORKTREE_DIR)
+
+    if not os.path.isdir(WORKTREE_DIR):
+        logging.warning(f"creating sparse clroot worktree in {WORKTREE_DIR}")
+        run_git(["worktree", "prune"])
+        run_git(["worktree", "add", "--no-checkout", "--detach", WORKTREE_DIR, sha])
+        run_git(
+            ["sparse-checkout", "set", "--no-cone"]
+            + ["/" + path for path in clroot_read_paths()],
+            cwd=WORKTREE_DIR,
+        )
+
+    logging.warning(f"checking out {sha} in {WORKTREE_DIR}")
+    run_git(["checkout", "--force", "--detach", sha], cwd=WORKTREE_DIR)
+    return sha
@@ -1,56 +1,294 @@
 #!/usr/bin/env python3
 from __future__ import annotations
+from typing import Dict, List, Optional, Set
 
 import logging
 import os
+import re
 import subprocess
+import time
 
-from lib.paths import CLROOT_PKG_DIR, LEOPARD_DIR, LEOPARD_PKG_DIR
+from lib.copier import break_hardlinks
+from lib.importgraph import ImportGraph, scan_import_declarations
+from lib.instrument import count, phase
+from lib.paths import LEOPARD_DIR, LEOPARD_PKG_DIR
 from lib.utils import removeIfExists
 
+CODEMODS_DIR = f"{LEOPARD_DIR}/clroot_conversion/lib/codemods"
+CODEMOD_FILENAMES = f"{CODEMODS_DIR}/filenames.txt"
+# jscodeshift parser to use for each extension
+PARSERS = {".ts": "ts", ".tsx": "tsx"}
+LOADABLE_DIR = f"{LEOPARD_PKG_DIR}/toolkit/loadable"
+DEPRECATED_STORES = [
+    "ApolloStore",
+    "DeviceStore",
+    "EnvironmentStore",
+    "LocalizationStore",
+    "NavigationStore",
+    "PersistenceStore",
+    "ThemeStore",
+    "ToastStore",
+    "UserStore",
+]
 
-def run_codemod(codemod: str) -> None:
-    logging.warning("changing directory to {dir}".format(dir=LEOPARD_PKG_DIR))
-    os.chdir(LEOPARD_PKG_DIR)
-    logging.warning("now in {dir}".format(dir=os.getcwd()))
+_RESULT_RE = re.compile(r"^(\d+) (errors|unmodified|skipped|ok)$", re.MULTILINE)
+# a file the codemod failed on, e.g. ` ERR /path/to/file.ts Transformation error`
+_ERROR_LINE_RE = re.compile(r"^\s*ERR (.*)$", re.MULTILINE)
 
-    subprocess.check_call(
-        [
+
+class CodemodException(Exception):
+    pass
+
+
+def collect_codemod_files(root: str = LEOPARD_PKG_DIR) -> Dict[str, List[str]]:
+    """
+    Walks root once and returns every .ts and .tsx file under it, grouped by
+    the jscodeshift parser that handles it. Each list is ordered largest file
+    first: jscodeshift's workers pull files in small chunks, so handing out the
+    expensive files first keeps the workers evenly loaded to the end.
+    """
+    files = {parser: [] for parser in PARSERS.values()}
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            parser = PARSERS.get(os.path.splitext(filename)[1])
+            if parser is not None:
+                path = os.path.join(dirpath, filename)
+                files[parser].append((os.path.getsize(path), path))
+
+    return {
+        parser: [path for _, path in sorted(sized, key=lambda f: -f[0])]
+        for parser, sized in files.items()
+    }
+
+
+def run_codemod(
+    codemod: str, filesByParser: Dict[str, List[str]], cpus: Optional[int] = None
+) -> Dict[str, float]:
+    """
+    Runs the given codemod from lib/codemods over the given files with a single
+    jscodeshift invocation per parser, letting jscodeshift's `--cpus` worker
+    pool spread the files out. The file list is passed on stdin, so it isn't
+    limited by glob depth or argument length. Files hard linked to clroot
+    (--link-mode hardlink) are unlinked first, since jscodeshift rewrites
+    them in place.
+
+    Returns the jscodeshift result counts (ok is the number of changed files)
+    along with the time taken. Only the files it failed on are logged from
+    its output.
+    """
+    counts = {"ok": 0, "unmodified": 0, "skipped": 0, "errors": 0, "seconds": 0.0}
+    for parser, files in filesByParser.items():
+        files = [path for path in files if os.path.exists(path)]
+        if not files:
+            continue
+        unlinked = break_hardlinks(files)
+        if unlinked:
+            logging.warning(
+                f"copied {unlinked} hard linked {parser} files before running {codemod}"
+            )
+
+        command = [
             "npx",
             "jscodeshift",
             "-t",
-            f"{LEOPARD_DIR}/clroot_conversion/lib/codemods/{codemod}.ts",
-            "./**/*.ts",
-            "--parser=tsx",
+            f"{CODEMODS_DIR}/{codemod}.ts",
+            f"--parser={parser}",
+            "--stdin",
         ]
+        if cpus is not None:
+            command.append(f"--cpus={cpus}")
+
+        logging.warning(f"running {codemod} over {len(files)} {parser} files")
+        start = time.monotonic()
+        count("subprocesses spawned")
+        try:
+            result = subprocess.run(
+                command,
+                input="\n".join(files),
+                stdout=subprocess.PIPE,
+                check=True,
+                cwd=LEOPARD_DIR,
+                text=True,
+            )
+        except (OSError, subprocess.CalledProcessError) as e:
+            raise CodemodException(f"{codemod} failed with error {e}")
+        counts["seconds"] += time.monotonic() - start
+
+        for error in _ERROR_LINE_RE.findall(result.stdout):
+            logging.warning(f"{codemod}: {error}")
+        for number, kind in _RESULT_RE.findall(result.stdout):
+            counts[kind] += int(number)
+
+    return counts
+
+
+def log_codemod_stats(codemod: str, counts: Dict[str, float]) -> None:
+    logging.warning(
+        "{codemod}: {ok} changed, {unmodified} unchanged, {skipped} skipped, {errors} errored in {seconds:.1f}s".format(
+            codemod=codemod, **counts
+        )
+    )
+
+
+def _read_deleted_imports() -> List[str]:
+    """
+    Returns the files listed in filenames.txt (as `@pkg/path` imports) by the
+    codemods that delete files.
+    """
+    with open(CODEMOD_FILENAMES, "r") as f:
+        return [line.strip() for line in f if line.strip() not in ("", "---")]
+
+
+def _resolve_imports(
+    graph: ImportGraph, imports: List[str], importer: Optional[str] = None
+) -> List[str]:
+    paths = [graph.resolve(entry, importer=importer) for entry in imports]
+    return [path for path in paths if path is not None]
+
+
+def _group_by_parser(files: List[str]) -> Dict[str, List[str]]:
+    grouped = {parser: [] for parser in PARSERS.values()}
+    for path in files:
+        parser = PARSERS.get(os.path.splitext(path)[1])
+        if parser is not None:
+            grouped[parser].append(path)
+    return grouped
+
+
+def _removed_infra_paths() -> List[str]:
+    # note stores in clroot can have either the .ts or .tsx extension; we
+    # attempt to remove both to be safe
+    return [
+        f"{LEOPARD_PKG_DIR}/merchant/stores/{store}{extension}"
+        for store in DEPRECATED_STORES
+        for extension in (".ts", ".tsx")
+    ]
+
+
+def _is_infra_path(path: str, infraPaths: Set[str]) -> bool:
+    return path.startswith(LOADABLE_DIR + "/") or path in infraPaths
+
+
+def _delete_dependents(graph: ImportGraph, seeds: Set[str]) -> Set[str]:
+    """
+    Deletes every file that (transitively) imports one of the seeds, which
+    used to take repeated recursiveMods rounds over the whole tree. Like
+    those rounds, only import declarations are followed: a file that
+    re-exports or require()s a deleted file is left alone. Returns the
+    deleted files.
+    """
+    declarations = {}
+
+    def declares_import(dependent: str, target: str) -> bool:
+        if dependent not in declarations:
+            try:
+                specifiers = scan_import_declarations(dependent)
+            except FileNotFoundError:
+                # removed along with the loadables or stores
+                specifiers = []
+            declarations[dependent] = _resolve_imports(
+                graph, specifiers, importer=dependent
+            )
+        return target in declarations[dependent]
+
+    deleted = graph.dependents_closure(seeds, follow=declares_import) - seeds
+    for path in sorted(deleted):
+        removeIfExists(path, fn=os.remove)
+    count("files removed", len(deleted))
+    logging.warning(
+        "deleted {count} files importing removed files".format(count=len(deleted))
     )
+    return deleted
+
+
+def run_leopard_mods(
+    filesByParser: Dict[str, List[str]], cpus: Optional[int] = None
+) -> List[str]:
+    """
+    Runs leopardMods over the given files. Returns the files it wants
+    deleted, as `@pkg/path` imports; remove_deleted_files does the deleting.
+    """
+    open(CODEMOD_FILENAMES, "w").close()
+    with phase("leopardMods"):
+        counts = run_codemod("leopardMods", filesByParser, cpus=cpus)
+    log_codemod_stats("leopardMods", counts)
+    return _read_deleted_imports()
+
+
+def remove_deleted_files(deletedImports: List[str]) -> Set[str]:
+    """
+    Removes the files leopardMods wants deleted along with the loadable infra
+    and deprecated stores, and deletes every file that imports a file
+    leopardMods deleted. Returns every removed file.
 
+    The loadables and stores don't seed the deletions, the same as before
+    the recursiveMods rounds were replaced: leopardMods points the store
+    imports it knows about at @core/stores instead, and the importers it
+    leaves alone are kept (and fail the type check) rather than deleted.
+    """
+    # the graph has to be scanned before anything is removed, so imports of
+    # the removed files still resolve
+    with phase("import_graph"):
+        graph = ImportGraph(LEOPARD_PKG_DIR).update()
+    seeds = set(_resolve_imports(graph, deletedImports))
+    for path in sorted(seeds):
+        removeIfExists(path, fn=os.remove)
 
-def run_codemods() -> None:
     # remove infra for loadables
-    removeIfExists(f"{LEOPARD_PKG_DIR}/toolkit/loadable")
+    removed = {path for path in graph.imports if path.startswith(LOADABLE_DIR + "/")}
+    removeIfExists(LOADABLE_DIR)
 
     # remove deprecated stores
-    for store in [
-        "ApolloStore",
-        "DeviceStore",
-        "EnvironmentStore",
-        "LocalizationStore",
-        "NavigationStore",
-        "PersistenceStore",
-        "ThemeStore",
-        "ToastStore",
-        "UserStore",
-    ]:
-        # note stores in clroot can have either the .ts or .tsx extension; we
-        # attempt to remove both to be safe
-        path = f"{LEOPARD_PKG_DIR}/merchant/stores/{store}.ts"
-        removeIfExists(path, fn=os.remove)
-        path = f"{LEOPARD_PKG_DIR}/merchant/stores/{store}.tsx"
+    for path in _removed_infra_paths():
+        removed.add(path)
         removeIfExists(path, fn=os.remove)
 
-    # currently running codemods from python is not finding any files, will
-    # investigate and debug later
-    print(
-        f"\n\nplease run\nnpx jscodeshift -t {LEOPARD_DIR}/clroot_conversion/lib/codemods/runMods.ts {LEOPARD_DIR}/clroot_conversion/lib/codemods/placeholder.tsx --parser=tsx\n\n"
-    )
+    return removed | seeds | _delete_dependents(graph, seeds)
+
+
+def run_codemods(cpus: Optional[int] = None) -> Set[str]:
+    """
+    Runs leopardMods over every .ts/.tsx file in Leopard's pkg directory,
+    removes the loadable infra and deprecated stores, and deletes every file
+    that imports a file leopardMods deleted. Returns every removed file.
+    """
+    # leopardMods records the files it deletes in filenames.txt, which seeds
+    # the recursive deletions
+    deletedImports = run_leopard_mods(collect_codemod_files(), cpus=cpus)
+    return remove_deleted_files(deletedImports)
+
+
+def run_incremental_codemods(
+    files: List[str],
+    graph: ImportGraph,
+    removed: Set[str],
+    cpus: Optional[int] = None,
+) -> Set[str]:
+    """
+    Applies the codemods to just the given files, after they were copied into
+    Leopard again: runs leopardMods over them, removes any that the full run
+    removes, and deletes every file that now imports a file leopardMods
+    deleted. `graph` is updated in place and `removed` is the set returned by
+    run_codemods. Returns the updated set of removed files.
+    """
+    removed = set(removed)
+    infraPaths = set(_removed_infra_paths())
+
+    open(CODEMOD_FILENAMES, "w").close()
+    counts = run_codemod("leopardMods", _group_by_parser(files), cpus=cpus)
+    log_codemod_stats("leopardMods", counts)
+
+    for path in files:
+        if _is_infra_path(path, infraPaths):
+            removed.add(path)
+            removeIfExists(path, fn=os.remove)
+
+    # removed files still have to resolve when their importers are scanned
+    graph.update(assumeExisting=removed)
+    deleted = _resolve_imports(graph, _read_deleted_imports())
+    for path in deleted:
+        removeIfExists(path, fn=os.remove)
+    removed.update(deleted)
+    seeds = {path for path in removed if not _is_infra_path(path, infraPaths)}
+    return removed | _delete_dependents(graph, seeds)
@@ -9,7 +9,6 @@ import {
 } from "jscodeshift";
 
 import * as fsPromises from "fs/promises";
-import { deleteFile } from "./runMods";
 
 /*
   import EnvironmentStore, { useEnvironmentStore } from "@merchant/stores/EnvironmentStore";
@@ -70,7 +69,7 @@ const deleteBucketForUserCalls = async (
   });
 
   // if (bucketForUserCalls.length != 0) {
-  //   await deleteFile(curPath);
+  //   await fsPromises.unlink(curPath);
   // }
 
   return;
@@ -98,7 +97,7 @@ const findToolkitAPIFiles = async (
         curPath.indexOf("."),
       );
 
-    // await deleteFile(curPath);
+    // await fsPromises.unlink(curPath);
 
     // await fsPromises.appendFile(
     //   `${process.env.LEOPARD_HOME}/clroot_conversion/lib/codemods/filenames.txt`,
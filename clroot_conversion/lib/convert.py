@@ -3,23 +3,55 @@ from __future__ import annotations
 
 import logging
 import ast
-import json
+import io
+import mmap
 import os
 import re
 import time
-from string import Template
+import tokenize
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Dict, List, NamedTuple, Optional, Tuple
 
-from lib.paths import (
-    CLROOT_DIR,
-    CLROOT_HANDLERS_DIR,
-    LEOPARD_PAGES_DIR,
-    LEOPARD_PKG_DIR,
+from lib.cache import content_hash, load_cached, lookup_cached, store_cached
+from lib.clroot import clroot_source_sha, clroot_tree_sha
+from lib.instrument import add_counts, count, phase, run_counted
+from lib.manifest import (
+    DEFAULT_PAGE_MODE,
+    MANIFEST_PAGE_ROUTE,
+    ROUTE_MANIFEST_PATH,
+    ManifestEntry,
+    find_container_modules,
+    render_manifest_page,
+    render_route_manifest,
 )
+from lib import paths
+from lib.paths import LEOPARD_PAGES_DIR, LEOPARD_PKG_DIR
+from lib.routes import RouteTable
+from lib.runlog import RunLog
+from lib.shard import Shard
+from lib.templates import render_template
 
-_parseHandlerPath_packageName = None
-_parseHandlerPath_initialQuery = None
-_parseHandlerPath_handlerName = None
-handlerToRouteMapping = {}
+# bump these whenever the extracted output changes, to invalidate the parse cache
+HANDLER_PARSER_VERSION = 3
+ROUTE_PARSER_VERSION = 2
+
+_handlerRecordCache = {}
+
+_CONTAINER_KEYWORD_RE = re.compile(
+    r"""\bcontainer\s*=\s*[uU]?[rR]?["']([^"'\\]+)["']"""
+)
+
+# handler files bigger than this are never read into memory whole; only the
+# top level statements around their container= keywords are parsed
+LARGE_HANDLER_FILE_BYTES = 256 * 1024
+
+# byte patterns a file has to contain to be worth parsing
+_CONTAINER_MARKER_RE = re.compile(rb"\bcontainer\s*=")
+_URLSPEC_MARKER = b"URLSpec"
+# lines that continue the statement before them: indented or blank lines,
+# comments, closing brackets and the clauses of compound statements
+_CONTINUATION_RE = re.compile(rb"[ \t\r\n#)\]}]|(?:else|elif|except|finally)\b")
 
 
 class HandlerPathError(Exception):
@@ -57,173 +89,696 @@ def find_container_names(containerEntryPath):
     return containerNames
 
 
-def find_handler_path(containerName, handlersRoot):
+class HandlerRecord(NamedTuple):
+    """
+    A single `X = Handler(container=...)` assignment found in a handler file.
+    Any problems found while reading the assignment are kept in `errors`, in
+    the order parse_handler_path should report them.
     """
-    Given a container name and the path to the root of the clroot handlers
-    directory, this function finds the path of the file contianing the handler
-    for the given container.
 
-    It throws an error if a unique path cannot be determined.
+    handlerName: Optional[str]
+    containerName: str
+    packageName: Optional[str]
+    initialQuery: Optional[str]
+    errors: Tuple[str, ...]
+
+
+class _Ambiguous(Exception):
+    pass
+
+
+# token types that never matter to the handler assignments
+_SKIPPED_TOKENS = (
+    tokenize.COMMENT,
+    tokenize.NL,
+    tokenize.INDENT,
+    tokenize.DEDENT,
+    tokenize.ENCODING,
+    tokenize.ENDMARKER,
+)
+_CONSTANT_NAMES = {"True": True, "False": False, "None": None}
+
+
+def _split_tokens(tokens: List[tokenize.TokenInfo], separator: str) -> List[list]:
     """
-    resp = os.popen(f"grep -rl '\"{containerName}\"' {handlersRoot}").readlines()
-    resp = [line.strip("\n") for line in resp]
-    if len(resp) > 1:
-        raise HandlerPathError(
-            containerName=containerName, message="MORE THAN ONE FILE IDENTIFIED"
-        )
-    if len(resp) < 1:
-        raise HandlerPathError(
-            containerName=containerName, message="NO FILES IDENTIFIED"
-        )
+    Splits tokens on the given operator where it's outside any brackets.
+    """
+    parts = [[]]
+    depth = 0
+    for token in tokens:
+        if token.type == tokenize.OP:
+            if token.string in "([{":
+                depth += 1
+            elif token.string in ")]}":
+                depth -= 1
+            elif depth == 0 and token.string == separator:
+                parts.append([])
+                continue
+        parts[-1].append(token)
+    return parts
 
-    return resp[0]
 
+def _closing_bracket(tokens: List[tokenize.TokenInfo], opening: int) -> int:
+    """
+    Returns the index of the bracket closing the one at `opening`.
+    """
+    depth = 0
+    for index in range(opening, len(tokens)):
+        if tokens[index].type != tokenize.OP:
+            continue
+        if tokens[index].string in "([{":
+            depth += 1
+        elif tokens[index].string in ")]}":
+            depth -= 1
+            if depth == 0:
+                return index
+    return -1
 
-def parse_handler_path(
-    containerName: str, handlerPath: str
-) -> annotations.Tuple[str, str, str]:
+
+def _token_constant(tokens: List[tokenize.TokenInfo]) -> Tuple[bool, object]:
     """
-    Given a container name and the path to that containers handler file, this
-    function parses the python file and returns the container's package name and
-    initial GQL query.
+    Returns (True, value) if the tokens are a constant the way ast sees one:
+    a string (including implicitly concatenated ones), number, True, False
+    or None. Returns (False, None) for anything else.
     """
+    if len(tokens) == 1 and tokens[0].type == tokenize.NAME:
+        if tokens[0].string in _CONSTANT_NAMES:
+            return (True, _CONSTANT_NAMES[tokens[0].string])
+        return (False, None)
+    if len(tokens) == 1 and tokens[0].type == tokenize.NUMBER:
+        try:
+            return (True, ast.literal_eval(tokens[0].string))
+        except (SyntaxError, ValueError):
+            raise _Ambiguous()
+    if tokens and all(token.type == tokenize.STRING for token in tokens):
+        try:
+            values = [ast.literal_eval(token.string) for token in tokens]
+        except (SyntaxError, ValueError):
+            # e.g. f-strings, which ast doesn't treat as constants either way
+            raise _Ambiguous()
+        if len({type(value) for value in values}) != 1:
+            raise _Ambiguous()
+        return (True, values[0][:0].join(values))
+    if (
+        len(tokens) == 2
+        and tokens[0].type == tokenize.NAME
+        and tokens[1].type == tokenize.STRING
+    ):
+        # a string prefix python 3 doesn't know, like python 2's ur""
+        raise _Ambiguous()
+    return (False, None)
+
+
+def _statement_handler(parts: List[list]) -> Optional[HandlerRecord]:
+    """
+    Reads a handler record from a simple assignment's tokens, split on its
+    "="s, if it assigns a call with a container= keyword.
+    """
+    targets, value = parts[:-1], parts[-1]
+
+    # the value has to be a call of a (dotted) name, like ast.Call
+    if value and value[0].type != tokenize.NAME and value[0].string != "(":
+        # a literal, e.g. a list of handlers
+        return None
+    position = 0
+    while (
+        position + 1 < len(value)
+        and value[position].type == tokenize.NAME
+        and value[position + 1].string == "."
+    ):
+        position += 2
+    if not (
+        position + 1 < len(value)
+        and value[position].type == tokenize.NAME
+        and value[position + 1].string == "("
+        and _closing_bracket(value, position + 1) == len(value) - 1
+    ):
+        raise _Ambiguous()
+
+    containerName = None
+    packageName = None
+    packageNameError = False
+    initialQuery = None
+    initialQueryError = False
+    seen = set()
+    for argument in _split_tokens(value[position + 2 : -1], ","):
+        if (
+            len(argument) < 3
+            or argument[0].type != tokenize.NAME
+            or argument[1].string != "="
+        ):
+            continue
+        keyword = argument[0].string
+        if keyword in seen:
+            raise _Ambiguous()
+        seen.add(keyword)
+
+        if keyword == "container":
+            isConstant, constant = _token_constant(argument[2:])
+            if isConstant and isinstance(constant, str):
+                containerName = constant
+        elif keyword == "package":
+            isConstant, constant = _token_constant(argument[2:])
+            if isConstant:
+                packageName = constant
+            else:
+                packageNameError = True
+        elif keyword == "initial_query":
+            isConstant, constant = _token_constant(argument[2:])
+            if isConstant:
+                initialQuery = constant
+            else:
+                initialQueryError = True
+
+    if containerName is None:
+        return None
+
+    handlerName = None
+    errors = []
+    if (
+        len(targets) == 1
+        and len(targets[0]) == 1
+        and targets[0][0].type == tokenize.NAME
+    ):
+        handlerName = targets[0][0].string
+    elif any(token.string == "(" for target in targets for token in target):
+        # could be a parenthesized name
+        raise _Ambiguous()
+    else:
+        errors.append("HANDLER NAME IMPROPERLY FORMATTED")
+    if packageNameError:
+        errors.append("PACKAGE NAME IMPROPERLY FORMATTED")
+    if initialQueryError:
+        errors.append("INITIAL QUERY IMPROPERLY FORMATTED")
+
+    return HandlerRecord(
+        handlerName=handlerName,
+        containerName=containerName,
+        packageName=packageName,
+        initialQuery=initialQuery,
+        errors=tuple(errors),
+    )
+
+
+def _token_handlers(contents: bytes) -> Optional[List[HandlerRecord]]:
+    """
+    Finds the handler assignments in a handler file with a single pass over
+    its tokens, giving the same records as _ast_handlers would. Tokenizing
+    doesn't care about most of the differences between python 2 and 3, so
+    this also reads python 2 handler files, which don't parse.
+
+    Only logical lines with a container= keyword are looked at closely.
+    Returns None when one of them isn't plainly an assignment of a call
+    (e.g. a one line `if`, or a parenthesized call), where it can't tell
+    what ast would make of it.
+    """
+    records = []
+    line = []
+    candidate = False
+    try:
+        for token in tokenize.tokenize(io.BytesIO(contents).readline):
+            if token.type in _SKIPPED_TOKENS:
+                continue
+            if token.type != tokenize.NEWLINE:
+                if (
+                    token.string == "="
+                    and line
+                    and line[-1].type == tokenize.NAME
+                    and line[-1].string == "container"
+                ):
+                    candidate = True
+                line.append(token)
+                continue
+
+            if candidate:
+                if any(token.type == tokenize.ERRORTOKEN for token in line):
+                    raise _Ambiguous()
+                statements = (
+                    _split_tokens(line, ";")
+                    if any(token.string == ";" for token in line)
+                    else [line]
+                )
+                for statement in statements:
+                    parts = _split_tokens(statement, "=")
+                    if len(parts) < 2:
+                        # not an assignment, e.g. a def with a container=
+                        # default or a bare call
+                        continue
+                    if any(token.string == ":" for token in parts[0]):
+                        # an assignment after a compound statement's header
+                        # or a lambda, or an annotated one
+                        raise _Ambiguous()
+                    record = _statement_handler(parts)
+                    if record is not None:
+                        records.append(record)
+            line = []
+            candidate = False
+    except (_Ambiguous, tokenize.TokenError, SyntaxError):
+        return None
+    return records
 
-    class Visitor(ast.NodeVisitor):
-        def generic_visit(self, node):
-            ast.NodeVisitor.generic_visit(self, node)
 
+def _ast_handlers(contents: bytes) -> List[HandlerRecord]:
+    """
+    Parses the given handler file and returns a record for every handler
+    assignment in it. Raises if the file doesn't parse as python 3.
+    """
+    records = []
+
+    class Visitor(ast.NodeVisitor):
         def visit_Assign(self, node):
             if isinstance(node.value, ast.Call):
-                isHandler = False
                 # TODO [lliepert]: some handlers don't have package defined; parse from TS instead
-                handlerName = None
+                containerName = None
                 packageName = None
                 packageNameError = False
                 initialQuery = None
                 initialQueryError = False
                 for k in node.value.keywords:
-                    print("k", ast.dump(k))
-                    try:
-                        if k.arg == "container" and k.value.value == containerName:
-                            isHandler = True
-
-                        elif k.arg == "package":
-                            if isinstance(k.value, ast.Constant):
-                                packageName = k.value.value
-                            else:
-                                packageNameError = True
-
-                        if k.arg == "initial_query":
-                            if isinstance(k.value, ast.Constant):
-                                initialQuery = k.value.value
-                            else:
-                                initialQueryError = True
-                    except Exception as e:
-                        raise ParsingError(
-                            containerName=containerName, handlerPath=handlerPath, message=e
-                        )
+                    if k.arg == "container":
+                        if isinstance(k.value, ast.Constant) and isinstance(
+                            k.value.value, str
+                        ):
+                            containerName = k.value.value
+
+                    elif k.arg == "package":
+                        if isinstance(k.value, ast.Constant):
+                            packageName = k.value.value
+                        else:
+                            packageNameError = True
 
-                if isHandler:
+                    if k.arg == "initial_query":
+                        if isinstance(k.value, ast.Constant):
+                            initialQuery = k.value.value
+                        else:
+                            initialQueryError = True
+
+                if containerName is not None:
+                    handlerName = None
+                    errors = []
                     if len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
                         handlerName = node.targets[0].id
                     else:
-                        raise ParsingError(
-                            containerName=containerName,
-                            handlerPath=handlerPath,
-                            message="HANDLER NAME IMPROPERLY FORMATTED",
-                        )
-
+                        errors.append("HANDLER NAME IMPROPERLY FORMATTED")
                     if packageNameError:
-                        raise ParsingError(
-                            containerName=containerName,
-                            handlerPath=handlerPath,
-                            message="PACKAGE NAME IMPROPERLY FORMATTED",
-                        )
+                        errors.append("PACKAGE NAME IMPROPERLY FORMATTED")
                     if initialQueryError:
-                        raise ParsingError(
+                        errors.append("INITIAL QUERY IMPROPERLY FORMATTED")
+
+                    records.append(
+                        HandlerRecord(
+                            handlerName=handlerName,
                             containerName=containerName,
-                            handlerPath=handlerPath,
-                            message="INITIAL QUERY IMPROPERLY FORMATTED",
+                            packageName=packageName,
+                            initialQuery=initialQuery,
+                            errors=tuple(errors),
                         )
+                    )
+            self.generic_visit(node)
+
+    Visitor().visit(ast.parse(contents.decode("utf-8")))
+    return records
+
+
+def _extract_handlers(handlerPath: str, contents: bytes) -> List[HandlerRecord]:
+    """
+    Returns a record for every handler assignment in the given handler file.
+    Files that don't parse (python 2 handlers) are read from their tokens
+    instead (see _token_handlers); ast.parse is faster than the pure python
+    tokenizer, so it goes first. Files that can't be read either way are
+    scanned with a regex, so their containers are still indexed; every record
+    from such a file carries the parse error.
+    """
+    try:
+        return _ast_handlers(contents)
+    except Exception as e:
+        records = _token_handlers(contents)
+        if records is not None:
+            count("handler files read from tokens")
+            return records
+        return [
+            HandlerRecord(
+                handlerName=None,
+                containerName=containerName,
+                packageName=None,
+                initialQuery=None,
+                errors=(str(e),),
+            )
+            for containerName in dict.fromkeys(
+                _CONTAINER_KEYWORD_RE.findall(
+                    contents.decode("utf-8", errors="replace")
+                )
+            )
+        ]
+
+
+def _map_file(path: str) -> Optional[mmap.mmap]:
+    """
+    Memory maps the file read-only, so it can be searched without reading it
+    into memory. Returns None for empty files, which can't be mapped.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _statement_span(mapped: mmap.mmap, start: int, end: int) -> Tuple[int, int]:
+    """
+    Widens [start, end) out to the whole top level statement(s) around it, by
+    lines: back to the nearest line that starts a statement, and forward to
+    the next one.
+    """
+    lineStart = mapped.rfind(b"\n", 0, start) + 1
+    while lineStart > 0 and _CONTINUATION_RE.match(mapped, lineStart):
+        lineStart = mapped.rfind(b"\n", 0, lineStart - 1) + 1
+
+    lineEnd = mapped.find(b"\n", end)
+    while lineEnd != -1 and _CONTINUATION_RE.match(mapped, lineEnd + 1):
+        lineEnd = mapped.find(b"\n", lineEnd + 1)
+    return (lineStart, len(mapped) if lineEnd == -1 else lineEnd + 1)
+
+
+def _handler_statements(mapped: mmap.mmap) -> bytes:
+    """
+    Returns just the top level statements of a mapped handler file that
+    contain container= keywords, as a module of their own. Only those
+    statements are ever copied out of the mapping.
+    """
+    spans = []
+    for match in _CONTAINER_MARKER_RE.finditer(mapped):
+        if spans and match.start() < spans[-1][1]:
+            continue
+        spans.append(_statement_span(mapped, match.start(), match.end()))
+    statements = []
+    for start, end in spans:
+        statement = mapped[start:end]
+        statements.append(statement if statement.endswith(b"\n") else statement + b"\n")
+    return b"".join(statements)
+
+
+def _handler_source(mapped: mmap.mmap) -> Tuple[bytes, bool]:
+    """
+    Returns what to parse for a mapped candidate handler file, and whether
+    it's only part of the file: its contents, or for files over
+    LARGE_HANDLER_FILE_BYTES just the statements declaring containers.
+    """
+    if len(mapped) <= LARGE_HANDLER_FILE_BYTES:
+        return (mapped[:], False)
+    return (_handler_statements(mapped), True)
 
-                    global _parseHandlerPath_packageName
-                    global _parseHandlerPath_initialQuery
-                    global _parseHandlerPath_handlerName
-                    _parseHandlerPath_packageName = packageName
-                    _parseHandlerPath_initialQuery = initialQuery
-                    _parseHandlerPath_handlerName = handlerName
-            ast.NodeVisitor.generic_visit(self, node)
 
-    with open(handlerPath, "r") as source:
+def _extract_handler_rows(
+    handlerPath: str, contents: bytes, partial: bool = False
+) -> List[list]:
+    """
+    Extracts the handler records from a file's contents as plain lists, which
+    is how they're stored in the parse cache and sent back from worker
+    processes.
+
+    With `partial`, contents are the statements _handler_source picked out
+    of a large file. They're only used if they parse on their own (a
+    statement boundary can be misjudged inside a multi-line string, say);
+    otherwise the whole file is read and parsed after all. Since the
+    statements are parsed apart from the rest of the file, python 2 syntax
+    elsewhere in a large file doesn't stop its handlers from being read.
+    """
+    if partial:
         try:
-            tree = ast.parse(source.read())
-        except Exception as e:
-            # TODO [lliepert]: this will skip files with handlers written in
-            # python 2 syntax that doesn't parse in python 3
-            raise ParsingError(
-                containerName=containerName, handlerPath=handlerPath, message=e
+            records = _ast_handlers(contents)
+        except (SyntaxError, ValueError):
+            count("large handler files parsed whole")
+            with open(handlerPath, "rb") as f:
+                contents = f.read()
+        else:
+            count("large handler files parsed in part")
+            count(
+                "large handler bytes skipped",
+                os.path.getsize(handlerPath) - len(contents),
             )
+            return [list(record) for record in records]
+    return [list(record) for record in _extract_handlers(handlerPath, contents)]
+
+
+def _records_from_rows(rows: List[list]) -> List[HandlerRecord]:
+    return [
+        HandlerRecord(
+            handlerName=handlerName,
+            containerName=containerName,
+            packageName=packageName,
+            initialQuery=initialQuery,
+            errors=tuple(errors),
+        )
+        for handlerName, containerName, packageName, initialQuery, errors in rows
+    ]
+
+
+def extract_all_handlers(
+    handlerPaths: List[str], jobs: int = 1
+) -> List[List[HandlerRecord]]:
+    """
+    Returns the handler records for each of the given files, in the same order.
+
+    Each file is memory mapped and searched for a `container=` keyword first;
+    most handler files declare no containers and are never read or parsed.
+    Records are memoised by path and mtime so a handler module shared by many
+    containers is only parsed once, and cached on disk by the file's content
+    hash across runs. Files that miss both are parsed over `jobs` worker
+    processes; since results are matched back up by position, the output
+    doesn't depend on how the work was scheduled.
+    """
+    results = {}
+    pending = []
+    prefilterCounts = {"candidates": 0, "skipped": 0}
+    for handlerPath in handlerPaths:
+        mtime = os.stat(handlerPath).st_mtime_ns
+        cached = _handlerRecordCache.get(handlerPath)
+        if cached is not None and cached[0] == mtime:
+            results[handlerPath] = cached[1]
+            continue
+
+        mapped = _map_file(handlerPath)
+        if mapped is None or not _CONTAINER_MARKER_RE.search(mapped):
+            count("handler files skipped by prefilter")
+            prefilterCounts["skipped"] += 1
+            if mapped is not None:
+                mapped.close()
+            _handlerRecordCache[handlerPath] = (mtime, [])
+            results[handlerPath] = []
+            continue
+        count("handler files passing prefilter")
+        prefilterCounts["candidates"] += 1
+
+        # the cache key hashes the mapping, so large files aren't copied.
+        # mappings hold a file descriptor each, so none is kept past here
+        key = content_hash(mapped, HANDLER_PARSER_VERSION)
+        found, rows = lookup_cached("handlers", key)
+        if found:
+            records = _records_from_rows(rows)
+            _handlerRecordCache[handlerPath] = (mtime, records)
+            results[handlerPath] = records
+        else:
+            pending.append((handlerPath, mtime, key) + _handler_source(mapped))
+        mapped.close()
+
+    if len(handlerPaths) > 1:
+        logging.warning(
+            "handler prefilter: {candidates} candidate files, {skipped} skipped without parsing".format(
+                **prefilterCounts
+            )
+        )
+
+    pendingPaths = [handlerPath for handlerPath, _, _, _, _ in pending]
+    pendingContents = [contents for _, _, _, contents, _ in pending]
+    pendingPartial = [partial for _, _, _, _, partial in pending]
+    if jobs > 1 and len(pending) > 1:
+        logging.warning(
+            "parsing {count} handler files with {jobs} processes".format(
+                count=len(pending), jobs=jobs
+            )
+        )
+        # the workers' counters come back with their rows
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            pendingRows = []
+            for rows, counts in executor.map(
+                run_counted,
+                repeat(_extract_handler_rows),
+                pendingPaths,
+                pendingContents,
+                pendingPartial,
+                chunksize=max(1, len(pending) // (jobs * 4)),
+            ):
+                add_counts(counts)
+                pendingRows.append(rows)
+    else:
+        pendingRows = [
+            _extract_handler_rows(handlerPath, contents, partial)
+            for handlerPath, contents, partial in zip(
+                pendingPaths, pendingContents, pendingPartial
+            )
+        ]
+
+    count("handler files parsed", len(pending))
+    for (handlerPath, mtime, key, _, _), rows in zip(pending, pendingRows):
+        store_cached("handlers", key, rows)
+        records = _records_from_rows(rows)
+        _handlerRecordCache[handlerPath] = (mtime, records)
+        results[handlerPath] = records
+
+    return [results[handlerPath] for handlerPath in handlerPaths]
+
+
+def extract_handlers(handlerPath: str) -> List[HandlerRecord]:
+    """
+    Returns the handler records for the given file. See extract_all_handlers.
+    """
+    return extract_all_handlers([handlerPath])[0]
 
-    visitor = Visitor()
-    visitor.visit(tree)
-    return (
-        _parseHandlerPath_packageName,
-        _parseHandlerPath_initialQuery,
-        _parseHandlerPath_handlerName,
-    )
+
+def build_handler_index(handlersRoot, jobs=1):
+    """
+    Given the path to the root of the clroot handlers directory, this function
+    walks the tree once, extracts the handlers from every handler file (over
+    `jobs` processes), and records each container they declare.
+
+    It returns a dict mapping container names to the sorted list of handler
+    files that declare them.
+    """
+    handlerPaths = []
+    for dirpath, dirnames, filenames in os.walk(handlersRoot):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.endswith(".py"):
+                handlerPaths.append(os.path.join(dirpath, filename))
+
+    handlerIndex = {}
+    for handlerPath, records in zip(
+        handlerPaths, extract_all_handlers(handlerPaths, jobs=jobs)
+    ):
+        for containerName in dict.fromkeys(record.containerName for record in records):
+            handlerIndex.setdefault(containerName, []).append(handlerPath)
+
+    return handlerIndex
+
+
+def find_handler_path(containerName, handlerIndex):
+    """
+    Given a container name and the index built by build_handler_index, this
+    function finds the path of the file contianing the handler for the given
+    container.
+
+    It throws an error if a unique path cannot be determined.
+    """
+    resp = handlerIndex.get(containerName, [])
+    if len(resp) > 1:
+        raise HandlerPathError(
+            containerName=containerName, message="MORE THAN ONE FILE IDENTIFIED"
+        )
+    if len(resp) < 1:
+        raise HandlerPathError(
+            containerName=containerName, message="NO FILES IDENTIFIED"
+        )
+
+    return resp[0]
+
+
+def parse_handler_path(
+    containerName: str, handlerPath: str
+) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    """
+    Given a container name and the path to that containers handler file, this
+    function looks up the container's handler in the file's extracted records
+    and returns the container's package name, initial GQL query, and handler
+    name. If the file declares the container more than once, the last
+    declaration wins.
+    """
+    record = None
+    for candidate in extract_handlers(handlerPath):
+        if candidate.containerName == containerName:
+            record = candidate
+
+    if record is None:
+        return (None, None, None)
+
+    if record.errors:
+        raise ParsingError(
+            containerName=containerName,
+            handlerPath=handlerPath,
+            message=record.errors[0],
+        )
+
+    return (record.packageName, record.initialQuery, record.handlerName)
 
 
-def create_route_subdirs(routeName):
+def create_route_subdirs(routeName, pagesDir=LEOPARD_PAGES_DIR):
     """
     Given a route name, this creates the required subdirectories needed to generate
     the container tsx file.
     """
     if len(routeName[1:].split("/")) != 1:
-        subdir = os.path.join(LEOPARD_PAGES_DIR, routeName[1 : routeName.rfind("/")])
+        subdir = os.path.join(pagesDir, routeName[1 : routeName.rfind("/")])
         if not os.path.isdir(subdir):
             os.makedirs(subdir)
 
 
-def parseRoutesFile(routesPath):
+def _string_value(node) -> Optional[str]:
     """
-    Given a file of handlers and routes, finds the URLSpec calls and maps handler
-    names and routes in the handlerToRouteMapping map.
+    Returns the value of a string constant, or of a `+` concatenation of string
+    constants, and None for anything else.
     """
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+        left = _string_value(node.left)
+        right = _string_value(node.right)
+        if left is not None and right is not None:
+            return left + right
+    return None
+
+
+def _extract_routes(routesPath: str, contents: bytes):
+    """
+    Given the contents of a file of handlers and routes, finds the URLSpec calls
+    and returns the (handler name, route) pairs they declare, along with the
+    messages for the URLSpecs that were skipped.
+    """
+    routes = []
+    skipped = []
 
     class Visitor(ast.NodeVisitor):
         def visit_Call(self, node):
-            global handlerToRouteMapping
-
             if isinstance(node.func, ast.Name) and node.func.id == "URLSpec":
                 handlerObject = node.args[1]
 
+                routeName = _string_value(node.args[0])
+
                 # multi arg path case (ex. r"/reauthentication-list/" + r"(new|awaitingMerchant|awaitingAdmin|approved|rejected)")
-                if isinstance(node.args[0], ast.BinOp):
-                    logging.warning(f"Multi-arg path: SKIPPED")
+                # is joined into a single route when every part is a string
+                if routeName is None:
+                    skipped.append("Multi-arg path: SKIPPED")
 
                 # redirect case (ex. redirect_to("/plus/orders/bulk-fulfill"))
                 elif (
                     isinstance(handlerObject, ast.Call)
                     and handlerObject.func.id == "redirect_to"
                 ):
-                    logging.warning(f"Redirect path: SKIPPED")
+                    skipped.append("Redirect path: SKIPPED")
 
                 # is an unknown function, (only ex. get_mock_s3_handler)
                 elif isinstance(handlerObject, ast.Call):
-                    logging.warning(f"Unknown function: SKIPPED")
+                    skipped.append("Unknown function: SKIPPED")
 
                 # attribute case (ex. app_oauth.RemoveAuthHandler)
                 elif isinstance(handlerObject, ast.Attribute):
-                    handlerToRouteMapping[handlerObject.attr] = node.args[0].value
+                    routes.append([handlerObject.attr, routeName])
 
                 # standard case
                 else:
-                    handlerToRouteMapping[handlerObject.id] = node.args[0].value
+                    routes.append([handlerObject.id, routeName])
 
             self.generic_visit(node)
 
-    with open(routesPath, "r") as source:
-        tree = ast.parse(source.read())
+    tree = ast.parse(contents)
 
     visitor = Visitor()
     try:
@@ -233,17 +788,85 @@ def parseRoutesFile(routesPath):
         raise e
         # raise e, None, sys.exc_info()[2]
 
+    return {"routes": routes, "skipped": skipped}
+
+
+def parseRoutesFile(routesPath, routeTable):
+    """
+    Given a file of handlers and routes, finds the URLSpec calls and adds each
+    handler's route to the given RouteTable. The extracted routes are cached on
+    disk by the file's content hash. Files without a URLSpec are skipped
+    without being read.
+    """
+    mapped = _map_file(routesPath)
+    if mapped is None or mapped.find(_URLSPEC_MARKER) == -1:
+        count("route files skipped by prefilter")
+        if mapped is not None:
+            mapped.close()
+        return 0
+    with mapped:
+        contents = mapped[:]
+
+    extracted = load_cached(
+        "routes",
+        ROUTE_PARSER_VERSION,
+        contents,
+        lambda: _extract_routes(routesPath, contents),
+    )
+    for message in extracted["skipped"]:
+        logging.warning(message)
+    for handlerName, routeName in extracted["routes"]:
+        routeTable.add(handlerName, routeName)
+
     return 0
 
 
-def generate_container_file(packageName, containerName, initialQuery, routeName):
+def write_if_changed(path, contents) -> str:
+    """
+    Writes contents to path unless the file already holds exactly that content.
+    Writes go through a temporary file and a rename, so a reader never sees a
+    partially written file. Returns "created", "updated", or "unchanged".
+    """
+    try:
+        with open(path, "r") as file:
+            if file.read() == contents:
+                return "unchanged"
+        status = "updated"
+    except FileNotFoundError:
+        status = "created"
+
+    tmpPath = "{path}.{pid}.tmp".format(path=path, pid=os.getpid())
+    with open(tmpPath, "w") as file:
+        file.write(contents)
+    os.replace(tmpPath, path)
+    count("pages written")
+    count("page bytes written", len(contents))
+    return status
+
+
+def generate_container_file(
+    packageName,
+    containerName,
+    initialQuery,
+    routeName,
+    templateName=None,
+    pagesDir=LEOPARD_PAGES_DIR,
+):
     """
-    given a package name, container name, initial query, and route name this
+    given a package name, container name, initial query, and page route this
     function generates the appropriate next.js page file,
     (from page-with-data.tsx.tmpl and page-with-data.tsx.tmpl located in the
-    same lib directory as this file) and saves it to the leopard pages directory,
+    same lib directory as this file, or the registered template named by
+    templateName) and saves it to the leopard pages directory (or pagesDir),
     using a sanitized version of the container name as the path
 
+    routeName is the Next.js page route (see lib/routes.py), so dynamic routes
+    are written to files like `product/[id].tsx`.
+
+    The page is rendered in memory and only written if it differs from the
+    existing file. Returns the page path and whether it was "created",
+    "updated", or "unchanged".
+
     TODO: we'll need to track the original URL when parsing the handlers file
     and use that here once we're ready for production, but at this time this
     method allows us to easily re-generate the page code while testing
@@ -251,96 +874,352 @@ def generate_container_file(packageName, containerName, initialQuery, routeName)
     logging.warning(
         "generating code for {containerName}".format(containerName=containerName)
     )
-    fileDir = os.path.dirname(os.path.abspath(__file__))
-
-    if initialQuery == None:
-        with open("{dir}/page-without-data.tsx.tmpl".format(dir=fileDir), "r") as file:
-            tsxTemplate = Template(file.read())
-    else:
-        with open("{dir}/page-with-data.tsx.tmpl".format(dir=fileDir), "r") as file:
-            tsxTemplate = Template(file.read())
+    if templateName is None:
+        templateName = "page-without-data" if initialQuery == None else "page-with-data"
 
-    renderedTsx = tsxTemplate.substitute(
+    renderedTsx = render_template(
+        templateName,
         {
             "packageName": packageName,
             "containerName": containerName,
             "initialQuery": initialQuery,
-        }
+        },
     )
 
-    # NOTE: files that have (.*) or id extensions are skipped for now
-    if not (".*" in routeName):
-        create_route_subdirs(routeName)
-        with open(f"{LEOPARD_PAGES_DIR}{routeName}.tsx", "w") as file:
-            file.write(renderedTsx)
+    create_route_subdirs(routeName, pagesDir=pagesDir)
+    pagePath = f"{pagesDir}{routeName}.tsx"
+    return (pagePath, write_if_changed(pagePath, renderedTsx))
 
 
-def build_next_structure():
+def prune_stale_pages(pagePaths, pagesDir=LEOPARD_PAGES_DIR) -> int:
     """
-    Builds the next.js pages structure from the previous clroot structure.
-    We search for containers from imported clroot code in Leopard, but go to
-    the clroot directory when parsing Python code.
+    Deletes every file in the leopard pages directory (or pagesDir) that
+    isn't one of the given generated pages (e.g. pages whose container or
+    route vanished from clroot), along with any directories that leaves
+    empty. Returns the number
+    of files deleted.
+    """
+    deleted = 0
+    if not os.path.isdir(pagesDir):
+        return deleted
 
-    (This allows us to selectively remove containers from Leopard that we
-    don't want to build pages for.)
+    for dirpath, _, filenames in os.walk(pagesDir, topdown=False):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            if path not in pagePaths:
+                logging.warning(f"removing stale page {path}")
+                os.remove(path)
+                deleted += 1
+        if dirpath != pagesDir and not os.listdir(dirpath):
+            os.rmdir(dirpath)
+
+    return deleted
+
+
+def scan_clroot(jobs=1) -> Tuple[RouteTable, dict]:
     """
-    DATA = {}
-    pagesGenerated = 0
+    Reads everything build_next_structure needs from clroot: the route table
+    from the uri_spec files and the index of containers to handler files
+    (parsed over `jobs` processes). This only reads clroot, so it can run
+    while the packages are being copied into Leopard.
+    """
+    routeTable = RouteTable()
+    with phase("parse_routes"):
+        for file in paths.CLROOT_URI_SPEC_PATHS:
+            parseRoutesFile(
+                ("{dir}/" + file).format(dir=paths.CLROOT_SOURCE_DIR), routeTable
+            )
+    with phase("verify_routes"):
+        count("routes failing verification", len(routeTable.verify()))
 
-    containerNames = find_container_names(
-        "{dir}/merchant/container/index.ts".format(dir=LEOPARD_PKG_DIR)
-    )
+    with phase("index_handlers"):
+        handlerIndex = build_handler_index(paths.CLROOT_HANDLERS_DIR, jobs=jobs)
 
-    handler_files = [
-        "sweeper/merchant_dashboard/core/uri_specs/api_and_page_handler.py",
-        "sweeper/merchant_dashboard/core/uri_specs/v1_api_specs.py",
-        "sweeper/merchant_dashboard/core/uri_specs/v2_api_specs.py",
-        "sweeper/merchant_dashboard/external/v3/core/uri_mapping.py",
-        "sweeper/merchant_dashboard/core/uri_specs/merch_comms_specs.py",
-    ]
+    return (routeTable, handlerIndex)
 
-    for file in handler_files:
-        parseRoutesFile(("{dir}/" + file).format(dir=CLROOT_DIR))
 
-    for containerName in containerNames:
-        try:
+class ContainerPage(NamedTuple):
+    """
+    The outcome of building one container's page. `handlerName` is None when
+    the container's handler couldn't be found or parsed, and `pagePath` is
+    None when no page was written; `entry` is the container's run log entry,
+    whose `outcome` says what happened (see lib.runlog).
+    """
+
+    handlerName: Optional[str]
+    pagePath: Optional[str]
+    status: Optional[str]
+    entry: dict
+
+
+def build_container_page(
+    containerName,
+    routeTable,
+    handlerIndex,
+    pagesDir=LEOPARD_PAGES_DIR,
+    pageMode=DEFAULT_PAGE_MODE,
+) -> ContainerPage:
+    """
+    Finds and parses the handler for a single container, looks up its route,
+    and writes its page into pagesDir. Problems are logged and reported as a
+    ContainerPage without a page path.
+
+    In the "manifest" page mode nothing is written: the container is served
+    by the catch-all page, from the route manifest build_next_structure
+    writes once every container is built, so its status is None.
+    """
+    start = time.perf_counter()
+
+    def entry(outcome, **fields):
+        fields["outcome"] = outcome
+        fields["seconds"] = round(time.perf_counter() - start, 4)
+        return fields
+
+    try:
+        with phase("find", container=containerName):
             handlerPath = find_handler_path(
                 containerName=containerName,
-                handlersRoot=CLROOT_HANDLERS_DIR,
+                handlerIndex=handlerIndex,
             )
+        with phase("parse", container=containerName):
             packageName, initialQuery, handlerName = parse_handler_path(
                 containerName=containerName, handlerPath=handlerPath
             )
-            try:
-                routeName = handlerToRouteMapping[handlerName]
-            except KeyError as e:
-                logging.warning(
-                    f"{handlerName}: KEY ERROR, handler not mapped to a route name"
-                )
+    except HandlerPathError as e:
+        logging.warning(f"{e.containerName}: {e.message}")
+        return ContainerPage(
+            None, None, None, entry("HandlerPathError", message=e.message)
+        )
+    except ParsingError as e:
+        logging.warning(f"{e.containerName} ({e.handlerPath}): {e.message}")
+        return ContainerPage(
+            None,
+            None,
+            None,
+            entry("ParsingError", handlerPath=e.handlerPath, message=e.message),
+        )
+
+    route = routeTable.route_for_handler(handlerName)
+    if route is None:
+        logging.warning(f"{handlerName}: KEY ERROR, handler not mapped to a route name")
+        return ContainerPage(
+            handlerName,
+            None,
+            None,
+            entry(
+                "unmapped",
+                handlerPath=handlerPath,
+                handlerName=handlerName,
+                message="handler not mapped to a route name",
+            ),
+        )
+    routeName = route.pattern
+    if route.pagePath is None:
+        logging.warning(f"{containerName} ({routeName}): ROUTE SKIPPED")
+        return ContainerPage(
+            handlerName,
+            None,
+            None,
+            entry(
+                "route_skipped",
+                handlerPath=handlerPath,
+                handlerName=handlerName,
+                routeName=routeName,
+                message="route has no page path",
+            ),
+        )
 
-            generate_container_file(
+    if pageMode == "manifest":
+        pagePath, status = (f"{pagesDir}{MANIFEST_PAGE_ROUTE}.tsx", None)
+    else:
+        with phase("render", container=containerName):
+            pagePath, status = generate_container_file(
                 packageName=packageName,
                 containerName=containerName,
                 initialQuery=initialQuery,
-                routeName=routeName,
+                routeName=route.pagePath,
+                pagesDir=pagesDir,
+            )
+
+    return ContainerPage(
+        handlerName,
+        pagePath,
+        status,
+        entry(
+            "page",
+            handlerPath=handlerPath,
+            handlerName=handlerName,
+            packageName=packageName,
+            initialQuery=initialQuery,
+            routeName=routeName,
+            pageRoute=route.pagePath,
+            status=status,
+        ),
+    )
+
+
+def write_route_manifest(
+    entries: List[ManifestEntry], pagesDir=LEOPARD_PAGES_DIR
+) -> Dict[str, str]:
+    """
+    Writes the route manifest and the catch-all page serving it into
+    pagesDir. Returns whether each file was "created", "updated", or
+    "unchanged", by path.
+    """
+    os.makedirs(os.path.dirname(ROUTE_MANIFEST_PATH), exist_ok=True)
+    os.makedirs(pagesDir, exist_ok=True)
+    pagePath = f"{pagesDir}{MANIFEST_PAGE_ROUTE}.tsx"
+    return {
+        ROUTE_MANIFEST_PATH: write_if_changed(
+            ROUTE_MANIFEST_PATH, render_route_manifest(entries)
+        ),
+        pagePath: write_if_changed(pagePath, render_manifest_page(pagesDir)),
+    }
+
+
+def remove_route_manifest() -> int:
+    """
+    Deletes the route manifest left by an earlier "manifest" page mode run,
+    returning the number of files deleted.
+    """
+    if not os.path.exists(ROUTE_MANIFEST_PATH):
+        return 0
+    logging.warning(f"removing route manifest {ROUTE_MANIFEST_PATH}")
+    os.remove(ROUTE_MANIFEST_PATH)
+    directory = os.path.dirname(ROUTE_MANIFEST_PATH)
+    if not os.listdir(directory):
+        os.rmdir(directory)
+    return 1
+
+
+def build_next_structure(
+    jobs=1,
+    clrootScan=None,
+    shard: Optional[Shard] = None,
+    pagesDir=LEOPARD_PAGES_DIR,
+    runLogPath=None,
+    pageMode=DEFAULT_PAGE_MODE,
+    containerIndexPath=None,
+) -> Dict[str, ContainerPage]:
+    """
+    Builds the next.js pages structure from the previous clroot structure.
+    We search for containers from imported clroot code in Leopard, but go to
+    the clroot directory when parsing Python code. Handler files are parsed
+    over `jobs` processes, unless the result of scan_clroot is passed in.
+    Returns the ContainerPage built for each container.
+
+    With a shard, only the containers in that shard are built (see
+    lib.shard), writing their pages into pagesDir and the run log to
+    runLogPath rather than Leopard and lib/logs.
+
+    With pageMode "manifest", instead of a page per container a single
+    catch-all page is written, along with a route manifest (see lib.manifest)
+    it lazily imports the containers from, so Next.js only compiles one page.
+    Where several containers claim a route, the last one wins, as it does
+    when their pages overwrite each other.
+
+    The containers are read from Leopard's container index, or from
+    containerIndexPath when the packages aren't copied yet (see
+    lib.reachable).
+
+    (This allows us to selectively remove containers from Leopard that we
+    don't want to build pages for.)
+    """
+    pages = {}
+    pagesGenerated = 0
+    pagePaths = set()
+    pageCounts = {"created": 0, "updated": 0, "unchanged": 0, "deleted": 0}
+
+    containerEntryPath = containerIndexPath
+    if containerEntryPath is None:
+        containerEntryPath = "{dir}/merchant/container/index.ts".format(
+            dir=LEOPARD_PKG_DIR
+        )
+    containerNames = find_container_names(containerEntryPath)
+    manifestEntries = {}
+    if pageMode == "manifest":
+        containerModules = find_container_modules(containerEntryPath)
+
+    if clrootScan is None:
+        clrootScan = scan_clroot(jobs=jobs)
+    routeTable, handlerIndex = clrootScan
+
+    # the commit of the files actually read, which the last refresh's
+    # revision isn't with --skip-refresh after a checkout
+    clrootSha = clroot_source_sha()
+    clrootTree = None
+    if shard is not None:
+        # merge_shards checks every shard read the same files
+        with phase("hash_clroot"):
+            clrootTree = clroot_tree_sha()
+    with RunLog(runLogPath) as runLog:
+        runLog.write(
+            "start",
+            containers=len(containerNames),
+            clrootSha=clrootSha,
+            clrootTree=clrootTree,
+            shard=str(shard) if shard is not None else None,
+        )
+        for index, containerName in enumerate(containerNames):
+            if shard is not None and not shard.owns(containerName):
+                continue
+            page = build_container_page(
+                containerName,
+                routeTable,
+                handlerIndex,
+                pagesDir=pagesDir,
+                pageMode=pageMode,
+            )
+            pages[containerName] = page
+            runLog.write(
+                "container", container=containerName, index=index, **page.entry
             )
+            if page.pagePath is None:
+                continue
 
-            DATA[containerName] = {
-                "handlerPath": handlerPath,
-                "packageName": packageName,
-                "initialQuery": initialQuery,
-                "routeName": routeName,
-            }
+            if pageMode == "manifest":
+                packageName = page.entry["packageName"]
+                manifestEntries[page.entry["pageRoute"]] = ManifestEntry(
+                    route=page.entry["pageRoute"],
+                    packageName=packageName,
+                    containerName=containerName,
+                    initialQuery=page.entry["initialQuery"],
+                    # the index only says where merchant's containers live
+                    module=containerModules.get(containerName)
+                    if packageName == "merchant"
+                    else None,
+                )
+            elif page.pagePath not in pagePaths:
+                pagePaths.add(page.pagePath)
+                pageCounts[page.status] += 1
             pagesGenerated += 1
-        except HandlerPathError as e:
-            logging.warning(f"{e.containerName}: {e.message}")
-        except ParsingError as e:
-            logging.warning(f"{e.containerName} ({e.handlerPath}): {e.message}")
 
-    log_filename = "{dir}/logs/log_{uid}.json".format(
-        dir=os.path.dirname(os.path.abspath(__file__)), uid=round(time.time())
+        if pageMode == "manifest":
+            with phase("render_manifest"):
+                statuses = write_route_manifest(
+                    list(manifestEntries.values()), pagesDir=pagesDir
+                )
+            for path, status in statuses.items():
+                pagePaths.add(path)
+                pageCounts[status] += 1
+            logging.warning(
+                "wrote route manifest with {routes} routes to {path}".format(
+                    routes=len(manifestEntries), path=ROUTE_MANIFEST_PATH
+                )
+            )
+        elif shard is None:
+            # a shard only writes into its own pagesDir; merging it removes
+            # the manifest instead
+            pageCounts["deleted"] += remove_route_manifest()
+        pageCounts["deleted"] += prune_stale_pages(pagePaths, pagesDir=pagesDir)
+        runLog.write("finish", pages=pagesGenerated, **pageCounts)
+    logging.warning(f"wrote run log to {runLog.path}")
+
+    logging.warning(f"\nTOTAL PAGES GENERATED: {pagesGenerated}/{len(pages)}")
+    logging.warning(
+        "PAGES: {created} created, {updated} updated, {unchanged} unchanged, {deleted} deleted".format(
+            **pageCounts
+        )
     )
-    with open(log_filename, "w") as f:
-        f.write(json.dumps(DATA))
 
-    logging.warning(f"\nTOTAL PAGES GENERATED: {pagesGenerated}/{len(containerNames)}")
+    return pages
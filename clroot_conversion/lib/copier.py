@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+from typing import List, Optional, Tuple
+
+import errno
+import fcntl
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from lib.instrument import count
+
+LINK_MODES = ["copy", "hardlink", "reflink"]
+
+# linux ioctl for cloning a file's extents (copy-on-write), see ioctl_ficlone(2)
+_FICLONE = 0x40049409
+# files are handed to the thread pool in batches to keep per-task overhead low
+_BATCH_SIZE = 64
+_PROGRESS_INTERVAL = 5.0
+
+_copyFileRangeSupported = hasattr(os, "copy_file_range")
+_sendfileSupported = hasattr(os, "sendfile")
+
+
+def _copy_contents(src_fd, dst_fd, size) -> None:
+    """
+    Copies size bytes from src_fd to dst_fd, letting the kernel move the data
+    with copy_file_range or sendfile where they're supported and falling back
+    to a plain read/write loop otherwise. Like shutil, a method that copies
+    nothing at all is given up on for the next one, since some filesystems
+    (procfs, some FUSE and overlay setups) report 0 bytes instead of failing.
+    """
+    global _copyFileRangeSupported, _sendfileSupported
+
+    copied = 0
+    if _copyFileRangeSupported:
+        try:
+            while copied < size:
+                sent = os.copy_file_range(src_fd, dst_fd, size - copied)
+                if sent == 0:
+                    break
+                copied += sent
+            if copied:
+                # done, or src got shorter since its size was read
+                return
+        except OSError as e:
+            if copied or e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL):
+                raise
+            _copyFileRangeSupported = False
+
+    if _sendfileSupported:
+        try:
+            while copied < size:
+                sent = os.sendfile(dst_fd, src_fd, copied, size - copied)
+                if sent == 0:
+                    break
+                copied += sent
+            if copied:
+                # done, or src got shorter since its size was read
+                return
+        except OSError as e:
+            if copied or e.errno not in (errno.ENOSYS, errno.EINVAL):
+                raise
+            _sendfileSupported = False
+
+    while True:
+        chunk = os.read(src_fd, 1 << 20)
+        if not chunk:
+            return
+        os.write(dst_fd, chunk)
+
+
+def _reflink(src, dst) -> bool:
+    """
+    Attempts to clone src into dst. Returns False if the filesystem doesn't
+    support reflinks, in which case dst is left untouched.
+    """
+    with open(src, "rb") as src_file:
+        dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            fcntl.ioctl(dst_fd, _FICLONE, src_file.fileno())
+        except OSError:
+            os.close(dst_fd)
+            os.remove(dst)
+            return False
+        os.close(dst_fd)
+    shutil.copystat(src, dst)
+    return True
+
+
+def copy_file(src, dst, size, link_mode="copy") -> None:
+    """
+    Copies src to dst, preserving metadata like copy2. With link_mode
+    "hardlink" dst becomes a hard link to src, and with "reflink" it shares
+    src's extents copy-on-write; both fall back to a regular copy when the
+    filesystem can't do it.
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+
+    if link_mode == "hardlink":
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    elif link_mode == "reflink":
+        if _reflink(src, dst):
+            return
+
+    with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+        _copy_contents(src_file.fileno(), dst_file.fileno(), size)
+    shutil.copystat(src, dst)
+
+
+def _copy_batch(batch, link_mode) -> Tuple[int, int]:
+    copied_bytes = 0
+    for src, dst, size in batch:
+        copy_file(src, dst, size, link_mode=link_mode)
+        copied_bytes += size
+    return (len(batch), copied_bytes)
+
+
+def copy_files(
+    files: List[Tuple[str, str, int]],
+    link_mode="copy",
+    workers: Optional[int] = None,
+    label="files",
+) -> dict:
+    """
+    Copies each (src, dst, size) in files over a bounded thread pool, logging
+    a progress summary every few seconds instead of a line per file.
+    Destination directories are created up front. Returns the number of files
+    and bytes copied and the time it took.
+    """
+    start = time.monotonic()
+    for dst_dir in sorted({os.path.dirname(dst) for _, dst, _ in files}):
+        os.makedirs(dst_dir, exist_ok=True)
+
+    batches = [files[i : i + _BATCH_SIZE] for i in range(0, len(files), _BATCH_SIZE)]
+    copied_files = 0
+    copied_bytes = 0
+    last_progress = start
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(_copy_batch, batch, link_mode) for batch in batches
+        ]
+        for future in as_completed(futures):
+            batch_files, batch_bytes = future.result()
+            copied_files += batch_files
+            copied_bytes += batch_bytes
+            now = time.monotonic()
+            if now - last_progress >= _PROGRESS_INTERVAL:
+                logging.warning(
+                    "copying {label}: {done}/{total} files".format(
+                        label=label, done=copied_files, total=len(files)
+                    )
+                )
+                last_progress = now
+
+    count("files copied", copied_files)
+    count("bytes copied", copied_bytes)
+    return {
+        "files": copied_files,
+        "bytes": copied_bytes,
+        "seconds": time.monotonic() - start,
+    }
+
+
+def break_hardlinks(paths: List[str], workers: Optional[int] = None) -> int:
+    """
+    Gives each of the given files that's hard linked (e.g. copied with
+    link_mode "hardlink") a copy of its own, so writing to it in place no
+    longer changes the other links. Returns the number of files unlinked.
+    """
+    linked = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        if stat.st_nlink > 1:
+            linked.append((path, f"{path}.unlinked", stat.st_size))
+    if not linked:
+        return 0
+
+    copy_files(linked, workers=workers, label="hard linked files")
+    for path, unlinked_path, _ in linked:
+        os.replace(unlinked_path, path)
+    count("hard links broken", len(linked))
+    return len(linked)
+
+
+def log_copy_stats(label, stats) -> None:
+    """
+    Logs out the file count, size, and throughput of a copy_files call.
+    """
+    seconds = max(stats["seconds"], 1e-6)
+    megabytes = stats["bytes"] / (1 << 20)
+    logging.warning(
+        "copied {label}: {files} files, {mb:.1f} MB in {seconds:.2f}s ({fps:.0f} files/s, {mbps:.1f} MB/s)".format(
+            label=label,
+            files=stats["files"],
+            mb=megabytes,
+            seconds=stats["seconds"],
+            fps=stats["files"] / seconds,
+            mbps=megabytes / seconds,
+        )
+    )
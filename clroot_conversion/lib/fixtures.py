@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+from typing import Dict, List
+
+import os
+import random
+
+# stores removed by run_codemods; some generated files import them so the
+# recursive deletions have something to do
+DEPRECATED_STORES = ["ApolloStore", "NavigationStore", "ThemeStore", "UserStore"]
+
+URI_SPEC_FILES = [
+    "core/uri_specs/api_and_page_handler.py",
+    "core/uri_specs/v1_api_specs.py",
+    "core/uri_specs/v2_api_specs.py",
+    "external/v3/core/uri_mapping.py",
+    "core/uri_specs/merch_comms_specs.py",
+]
+
+HANDLERS_PER_DIR = 20
+
+
+def _write(path: str, contents: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(contents)
+
+
+def _handler_module(names: List[str], py2: bool) -> str:
+    lines = ["from sweeper.merchant_dashboard.handlers.base import Handler", ""]
+    if py2:
+        # python 2 syntax, which only the token extractor reads
+        lines += ['print "loaded"', ""]
+    for i, name in enumerate(names):
+        if i % 2 == 0:
+            query = "{{ currentUser {{ {field} {{ id }} }} }}".format(
+                field=name[0].lower() + name[1:]
+            )
+            lines.append(
+                '{name}Handler = Handler(container="{name}Container", package="merchant", initial_query="""{query}""")'.format(
+                    name=name, query=query
+                )
+            )
+        else:
+            lines.append(
+                '{name}Handler = Handler(container="{name}Container", package="merchant")'.format(
+                    name=name
+                )
+            )
+    return "\n".join(lines) + "\n"
+
+
+def _route_spec(name: str, i: int) -> str:
+    slug = "page-{i}".format(i=i)
+    kind = i % 6
+    if kind == 1:
+        pattern = 'r"/{slug}/" + r"(?P<id>[^/]+)"'.format(slug=slug)
+    elif kind == 2:
+        pattern = 'r"/{slug}/(\\d+)"'.format(slug=slug)
+    elif kind == 3:
+        pattern = 'r"/{slug}/files/(.*)"'.format(slug=slug)
+    elif kind == 4:
+        # groups mixed with literal text can't be expressed as a page
+        pattern = 'r"/{slug}/v(\\d+)"'.format(slug=slug)
+    else:
+        pattern = 'r"/{slug}"'.format(slug=slug)
+    return "    URLSpec({pattern}, {name}Handler),".format(pattern=pattern, name=name)
+
+
+def _component(name: str, imports: List[str], stores: List[str], padding: int) -> str:
+    lines = ['import React from "react";']
+    for i, specifier in enumerate(imports):
+        lines.append(
+            'import Dep{i} from "{specifier}";'.format(i=i, specifier=specifier)
+        )
+    for store in stores:
+        lines.append(
+            'import {{ use{store} }} from "@merchant/stores/{store}";'.format(
+                store=store
+            )
+        )
+    lines.append("")
+    lines.append("const {name} = () => {{".format(name=name))
+    for i in range(padding):
+        lines.append("  const value{i} = {i} * 2;".format(i=i))
+    lines.append("  return <div>{name}</div>;".format(name=name))
+    lines.append("};")
+    lines.append("")
+    lines.append("export default {name};".format(name=name))
+    return "\n".join(lines) + "\n"
+
+
+def generate_clroot(
+    root: str,
+    handlers: int = 100,
+    containers_per_handler: int = 3,
+    components: int = 500,
+    imports_per_file: int = 3,
+    seed: int = 0,
+) -> Dict[str, int]:
+    """
+    Writes a synthetic clroot checkout under root, shaped like the parts of
+    clroot the conversion reads:
+
+    - `handlers` handler modules (spread over sub packages) each assigning
+      `containers_per_handler` Handler(container=...) objects, every tenth one
+      with Python 2 syntax
+    - uri_spec files with a URLSpec for each handler, including string
+      concatenations, dynamic segments, catch-alls, unmappable patterns and
+      redirect_to/mock handlers that have to be skipped
+    - static/js/pkg with the assets, merchant, toolkit and schema packages:
+      a merchant/container/index.ts exporting every container, plus
+      `components` toolkit/merchant modules that each import up to
+      `imports_per_file` earlier modules, and some deprecated stores
+
+    The same arguments always produce the same tree. Returns the number of
+    files, handlers, containers and components written.
+    """
+    rng = random.Random(seed)
+    dashboardDir = os.path.join(root, "sweeper/merchant_dashboard")
+    handlersDir = os.path.join(dashboardDir, "handlers")
+    pkgDir = os.path.join(dashboardDir, "static/js/pkg")
+    files = 0
+
+    containerNames = []
+    for i in range(handlers):
+        names = [
+            "Page{i}x{j}".format(i=i, j=j) for j in range(containers_per_handler)
+        ]
+        containerNames += names
+        handlerPath = os.path.join(
+            handlersDir,
+            "group{group}".format(group=i // HANDLERS_PER_DIR),
+            "handler_{i}.py".format(i=i),
+        )
+        _write(handlerPath, _handler_module(names, py2=i % 10 == 9))
+        files += 1
+    for dirpath, _, _ in os.walk(handlersDir):
+        _write(os.path.join(dirpath, "__init__.py"), "")
+        files += 1
+
+    # most routes go in api_and_page_handler.py, as in clroot
+    specs = {specFile: [] for specFile in URI_SPEC_FILES}
+    for i, name in enumerate(containerNames):
+        specFile = URI_SPEC_FILES[0] if i % 4 else rng.choice(URI_SPEC_FILES)
+        specs[specFile].append(_route_spec(name, i))
+    for i, specFile in enumerate(URI_SPEC_FILES):
+        lines = ["from sweeper.merchant_dashboard.handlers import *", "", "urls = ["]
+        lines += specs[specFile]
+        lines.append(
+            '    URLSpec(r"/legacy-{i}", redirect_to("/page-0")),'.format(i=i)
+        )
+        lines.append('    URLSpec(r"/mock-{i}", get_mock_s3_handler()),'.format(i=i))
+        lines.append("]")
+        _write(os.path.join(dashboardDir, specFile), "\n".join(lines) + "\n")
+        files += 1
+
+    # modules only import earlier ones, so the import graph is a DAG
+    modules = []
+    for i in range(components):
+        package = "toolkit" if i % 5 == 0 else "merchant/component"
+        name = "Module{i}".format(i=i)
+        imports = []
+        if modules:
+            imports = rng.sample(modules, min(imports_per_file, len(modules)))
+        stores = [rng.choice(DEPRECATED_STORES)] if i % 25 == 24 else []
+        extension = ".ts" if package == "toolkit" else ".tsx"
+        _write(
+            os.path.join(pkgDir, package, name + extension),
+            _component(name, imports, stores, padding=rng.randint(5, 50)),
+        )
+        modules.append("@{package}/{name}".format(package=package, name=name))
+        files += 1
+
+    for store in DEPRECATED_STORES:
+        _write(
+            os.path.join(pkgDir, "merchant/stores", store + ".ts"),
+            "export const use{store} = () => ({{}});\n".format(store=store),
+        )
+        files += 1
+
+    indexLines = []
+    for i, containerName in enumerate(containerNames):
+        indexLines.append(
+            'export {{ default as {name}Container }} from "@merchant/container/{name}";'.format(
+                name=containerName
+            )
+        )
+        imports = rng.sample(modules, min(imports_per_file, len(modules)))
+        _write(
+            os.path.join(pkgDir, "merchant/container", containerName + ".tsx"),
+            _component(containerName, imports, [], padding=10),
+        )
+        files += 1
+    _write(
+        os.path.join(pkgDir, "merchant/container/index.ts"),
+        "\n".join(indexLines) + "\n",
+    )
+    files += 1
+
+    for i in range(max(1, components // 50)):
+        _write(
+            os.path.join(pkgDir, "assets/img", "icon{i}.svg".format(i=i)),
+            '<svg xmlns="http://www.w3.org/2000/svg"><rect width="{i}"/></svg>\n'.format(
+                i=i
+            ),
+        )
+        files += 1
+    _write(
+        os.path.join(pkgDir, "schema/index.ts"),
+        "".join(
+            "export type Page{i}Schema = {{ id: string }};\n".format(i=i)
+            for i in range(handlers)
+        ),
+    )
+    files += 1
+
+    return {
+        "files": files,
+        "handlers": handlers,
+        "containers": len(containerNames),
+        "components": components,
+    }
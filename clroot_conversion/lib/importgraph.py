@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+import hashlib
+import json
+import logging
+import os
+import re
+from collections import deque
+
+from lib.cache import CACHE_DIR, cache_enabled
+
+# bump this whenever the scanned output changes, to invalidate saved graphs
+SCANNER_VERSION = 1
+
+CODE_EXTENSIONS = (".ts", ".tsx", ".js", ".jsx")
+# extensions tried, in order, when resolving an import without one
+RESOLVE_SUFFIXES = (".ts", ".tsx", ".d.ts", ".js", ".jsx")
+
+# `import x from "y"`, `export { x } from "y"`, `import "y"`, `import("y")`
+# and `require("y")`; multi-line imports are matched by their `from "y"` tail
+_IMPORT_RE = re.compile(
+    r"""(?:\bfrom|\bimport|\brequire\s*\(|\bimport\s*\()\s*["']([^"'\n]+)["']"""
+)
+
+# only import declarations, `import x from "y"` and `import "y"`: not
+# re-exports, `require("y")`, `import("y")` or `import x = require("y")`
+_IMPORT_DECLARATION_RE = re.compile(
+    r"""\bimport\s+(?:[^;"'()]*?\sfrom\s*)?["']([^"'\n]+)["']"""
+)
+
+
+def scan_imports(path: str) -> List[str]:
+    """
+    Returns the module specifiers imported, re-exported, or required by the
+    given .ts/.tsx file, in order of appearance.
+    """
+    with open(path, "r", errors="replace") as f:
+        return list(dict.fromkeys(_IMPORT_RE.findall(f.read())))
+
+
+def scan_import_declarations(path: str) -> List[str]:
+    """
+    Returns the module specifiers of the given file's import declarations,
+    leaving out the other ways scan_imports finds of importing a module.
+    """
+    with open(path, "r", errors="replace") as f:
+        return list(dict.fromkeys(_IMPORT_DECLARATION_RE.findall(f.read())))
+
+
+class ImportGraph:
+    """
+    The import graph of every .ts/.tsx file under a package root (e.g. Leopard's
+    src/pkg or clroot's static/js/pkg). Relative imports are resolved against
+    the importing file and `@pkg/...` aliases against the root, so
+    `@merchant/component/Foo` is `<root>/merchant/component/Foo.tsx`.
+
+    Each file's import specifiers are saved along with its mtime and size, so
+    update() only rescans files that changed since the last run. Specifiers
+    are resolved against the current file list whenever the graph is built,
+    so added or removed targets are picked up without a rescan.
+    """
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        self.cachePath = "{dir}/importgraph/{key}.json".format(
+            dir=CACHE_DIR, key=hashlib.sha1(self.root.encode()).hexdigest()
+        )
+        self._specifiers: Dict[str, List] = {}
+        self._allFiles: Set[str] = set()
+        self.imports: Dict[str, List[str]] = {}
+        self.dependents: Dict[str, List[str]] = {}
+
+    def _load(self) -> None:
+        if not cache_enabled():
+            return
+        try:
+            with open(self.cachePath, "r") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        if saved.get("version") == SCANNER_VERSION:
+            self._specifiers = saved["files"]
+
+    def _save(self) -> None:
+        if not cache_enabled():
+            return
+        os.makedirs(os.path.dirname(self.cachePath), exist_ok=True)
+        tmpPath = "{path}.{pid}.tmp".format(path=self.cachePath, pid=os.getpid())
+        with open(tmpPath, "w") as f:
+            json.dump({"version": SCANNER_VERSION, "files": self._specifiers}, f)
+        os.replace(tmpPath, self.cachePath)
+
+    def update(self, assumeExisting: Iterable[str] = ()) -> "ImportGraph":
+        """
+        Rescans every file that was added or changed since the graph was last
+        saved, drops deleted files, rebuilds the resolved graph, and saves it.
+        Imports of the `assumeExisting` files are resolved as if they were
+        still there, so the importers of files that were removed can be found.
+        """
+        if not self._specifiers:
+            self._load()
+
+        scanned = 0
+        reused = 0
+        specifiers = {}
+        self._allFiles = set()
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                path = os.path.join(dirpath, filename)
+                self._allFiles.add(path)
+                if not filename.endswith(CODE_EXTENSIONS):
+                    continue
+
+                stat = os.stat(path)
+                signature = [stat.st_mtime_ns, stat.st_size]
+                saved = self._specifiers.get(path)
+                if saved is not None and saved[0] == signature:
+                    specifiers[path] = saved
+                    reused += 1
+                else:
+                    specifiers[path] = [signature, scan_imports(path)]
+                    scanned += 1
+
+        self._specifiers = specifiers
+        self._allFiles.update(assumeExisting)
+        self._build()
+        self._save()
+        logging.warning(
+            "import graph for {root}: {scanned} files scanned, {reused} unchanged".format(
+                root=self.root, scanned=scanned, reused=reused
+            )
+        )
+        return self
+
+    def _build(self) -> None:
+        self.imports = {}
+        self.dependents = {path: [] for path in self._specifiers}
+        for path, (_, fileSpecifiers) in self._specifiers.items():
+            targets = []
+            for specifier in fileSpecifiers:
+                target = self.resolve(specifier, importer=path)
+                if target is not None and target not in targets:
+                    targets.append(target)
+                    self.dependents.setdefault(target, []).append(path)
+            self.imports[path] = targets
+
+    def resolve(self, specifier: str, importer: Optional[str] = None) -> Optional[str]:
+        """
+        Resolves an import specifier to a file under the root, or returns None
+        for packages outside it (npm packages, @core, ...). Relative specifiers
+        need the importing file's path.
+        """
+        if specifier.startswith("./") or specifier.startswith("../"):
+            if importer is None:
+                return None
+            base = os.path.normpath(os.path.join(os.path.dirname(importer), specifier))
+        elif specifier.startswith("@"):
+            base = os.path.join(self.root, specifier[1:])
+            if not os.path.normpath(base).startswith(self.root + os.sep):
+                return None
+        else:
+            return None
+
+        candidates = [base]
+        candidates += [base + suffix for suffix in RESOLVE_SUFFIXES]
+        candidates += [os.path.join(base, "index" + s) for s in RESOLVE_SUFFIXES]
+        for candidate in candidates:
+            if candidate in self._allFiles:
+                return candidate
+        return None
+
+    def dependents_closure(
+        self,
+        seeds: Iterable[str],
+        follow: Optional[Callable[[str, str], bool]] = None,
+    ) -> Set[str]:
+        """
+        Returns every file that transitively imports one of the seed files,
+        found with a single breadth first search over the reverse graph. The
+        seeds themselves are not included unless they import another seed.
+        With `follow`, only the edges for which follow(dependent, target) is
+        true are taken.
+        """
+        closure = set()
+        queue = deque(seeds)
+        while queue:
+            target = queue.popleft()
+            for dependent in self.dependents.get(target, []):
+                if dependent in closure:
+                    continue
+                if follow is not None and not follow(dependent, target):
+                    continue
+                closure.add(dependent)
+                queue.append(dependent)
+        return closure
+
+    def reachable_from(self, seeds: Iterable[str]) -> Set[str]:
+        """
+        Returns the seed files and every file they transitively import.
+        """
+        reached = set(seeds)
+        queue = deque(reached)
+        while queue:
+            for target in self.imports.get(queue.popleft(), []):
+                if target not in reached:
+                    reached.add(target)
+                    queue.append(target)
+        return reached
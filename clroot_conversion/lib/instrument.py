@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import cProfile
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+LOGS_DIR = "{dir}/logs".format(dir=os.path.dirname(os.path.abspath(__file__)))
+
+_startTime = time.perf_counter()
+_events = []
+_counters: Dict[str, int] = {}
+_summary: Dict[str, Dict[str, float]] = {}
+_lock = threading.Lock()
+_local = threading.local()
+_profiledPhase: Optional[str] = None
+# the phases open in each thread, so a phase knows if another thread's phase
+# ran alongside it
+_openPhases: Dict[int, List[dict]] = {}
+
+
+def _reset_after_fork() -> None:
+    # a forked child (e.g. a ProcessPoolExecutor worker) only has the thread
+    # that forked it, so a lock another thread held at the time would never
+    # be released, and that thread's phases would never close
+    global _lock
+    _lock = threading.Lock()
+    _openPhases.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def configure_instrumentation(profile_phase: Optional[str] = None) -> None:
+    """
+    Sets the (top level) phase to run under cProfile, if any. Its stats are
+    dumped to lib/logs when the phase finishes.
+    """
+    global _profiledPhase
+    _profiledPhase = profile_phase
+
+
+def _process_cpu_time() -> float:
+    # every thread of this process, plus finished child processes (worker
+    # pools, npx, yarn, git)
+    times = os.times()
+    return time.process_time() + times.children_user + times.children_system
+
+
+def _open_phase(stack: List[str]) -> dict:
+    """
+    Registers a phase starting in this thread. Phases open in other threads
+    at the same time, and this one, are marked as overlapping, since the
+    process-wide CPU time they see is partly the other phases'.
+    """
+    opened = {"overlapped": False}
+    thread = threading.get_ident()
+    with _lock:
+        others = [
+            other
+            for otherThread, phases in _openPhases.items()
+            if otherThread != thread
+            for other in phases
+        ]
+        for other in others:
+            other["overlapped"] = True
+        opened["overlapped"] = bool(others)
+        _openPhases.setdefault(thread, []).append(opened)
+    return opened
+
+
+def _close_phase(opened: dict) -> bool:
+    """
+    Unregisters a phase, returning whether it overlapped another thread's.
+    """
+    thread = threading.get_ident()
+    with _lock:
+        phases = _openPhases[thread]
+        # by identity: the records of other open phases can compare equal
+        phases[:] = [other for other in phases if other is not opened]
+        if not phases:
+            del _openPhases[thread]
+    return opened["overlapped"]
+
+
+@contextmanager
+def phase(name: str, **args):
+    """
+    Records the wall and CPU time spent in the block as a trace event. Phases
+    nest: a phase started inside another is recorded as one of its sub-steps
+    (e.g. build_next_structure/parse), and the summary aggregates every run of
+    the same step. Keyword arguments (e.g. container=...) are attached to the
+    trace event.
+
+    The CPU time is the phase's own thread's. The process-wide CPU time,
+    which adds worker threads and processes and subprocesses, is recorded
+    too, unless a phase ran in another thread at the same time, since it
+    can't be told apart from that phase's.
+    """
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    stack.append(name)
+    path = "/".join(stack)
+
+    profiler = None
+    if _profiledPhase is not None and path == _profiledPhase:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    opened = _open_phase(stack)
+    wallStart = time.perf_counter()
+    cpuStart = time.thread_time()
+    processCpuStart = _process_cpu_time()
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - wallStart
+        cpu = time.thread_time() - cpuStart
+        processCpu = _process_cpu_time() - processCpuStart
+        if _close_phase(opened):
+            processCpu = None
+        stack.pop()
+
+        if profiler is not None:
+            profiler.disable()
+            profilePath = "{dir}/profile_{name}_{uid}.prof".format(
+                dir=LOGS_DIR, name=name, uid=round(time.time())
+            )
+            profiler.dump_stats(profilePath)
+            logging.warning(f"wrote cProfile stats for {name} to {profilePath}")
+
+        with _lock:
+            _events.append(
+                {
+                    "name": name,
+                    "cat": "phase" if len(stack) == 0 else "step",
+                    "ph": "X",
+                    "ts": round((wallStart - _startTime) * 1e6),
+                    "dur": round(wall * 1e6),
+                    "pid": os.getpid(),
+                    "tid": threading.get_ident(),
+                    "args": dict(
+                        args,
+                        path=path,
+                        cpu_ms=round(cpu * 1e3, 3),
+                        process_cpu_ms=None
+                        if processCpu is None
+                        else round(processCpu * 1e3, 3),
+                    ),
+                }
+            )
+            totals = _summary.setdefault(
+                path,
+                {
+                    "count": 0,
+                    "wall": 0.0,
+                    "cpu": 0.0,
+                    "processCpu": 0.0,
+                    "overlapped": 0,
+                },
+            )
+            totals["count"] += 1
+            totals["wall"] += wall
+            totals["cpu"] += cpu
+            if processCpu is None:
+                totals["overlapped"] += 1
+            else:
+                totals["processCpu"] += processCpu
+
+
+def count(name: str, value: int = 1) -> None:
+    """
+    Adds value to the named run counter (files copied, bytes copied,
+    subprocesses spawned, ...).
+    """
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def run_counted(fn: Callable, *args) -> Tuple[Any, Dict[str, int]]:
+    """
+    Calls fn and returns its result along with what it added to the run
+    counters. Counters counted in worker processes are otherwise lost, so
+    functions run in a process pool are wrapped with this and the parent adds
+    the counts up with add_counts.
+    """
+    with _lock:
+        before = dict(_counters)
+    result = fn(*args)
+    with _lock:
+        added = {
+            name: value - before.get(name, 0)
+            for name, value in _counters.items()
+            if value != before.get(name, 0)
+        }
+    return (result, added)
+
+
+def add_counts(counts: Dict[str, int]) -> None:
+    for name, value in counts.items():
+        count(name, value)
+
+
+def write_trace(path: Optional[str] = None) -> Optional[str]:
+    """
+    Writes the recorded phases and counters to a JSON file in the Chrome trace
+    event format (loadable in chrome://tracing or Perfetto), with the per-phase
+    totals and counters alongside the events. Defaults to
+    lib/logs/trace_<timestamp>.json. Returns the path written, if any.
+    """
+    if not _events and not _counters:
+        return None
+
+    if path is None:
+        path = "{dir}/trace_{uid}.json".format(dir=LOGS_DIR, uid=round(time.time()))
+    with _lock:
+        trace = {
+            "traceEvents": sorted(_events, key=lambda event: event["ts"]),
+            "displayTimeUnit": "ms",
+            "phases": {
+                name: {
+                    "count": totals["count"],
+                    "wall_s": round(totals["wall"], 6),
+                    "cpu_s": round(totals["cpu"], 6),
+                    # only over the runs that didn't overlap another thread's
+                    "process_cpu_s": round(totals["processCpu"], 6),
+                    "overlapped": totals["overlapped"],
+                }
+                for name, totals in _summary.items()
+            },
+            "run": {
+                "wall_s": round(time.perf_counter() - _startTime, 6),
+                "cpu_s": round(_process_cpu_time(), 6),
+            },
+            "counters": dict(_counters),
+        }
+    with open(path, "w") as f:
+        json.dump(trace, f)
+    return path
+
+
+def log_phase_summary() -> None:
+    """
+    Logs out the wall and CPU time of every top level phase and of the whole
+    run, and the run counters. Phases that overlapped another thread's only
+    have their own thread's CPU time; the whole run's includes everything.
+    """
+    for name, totals in _summary.items():
+        if "/" in name:
+            continue
+        if totals["overlapped"]:
+            processCpu = "overlapped other phases"
+        else:
+            processCpu = "{cpu:.2f}s with workers and subprocesses".format(
+                cpu=totals["processCpu"]
+            )
+        logging.warning(
+            "{name}: {wall:.2f}s wall, {cpu:.2f}s cpu in its thread ({processCpu})".format(
+                name=name, wall=totals["wall"], cpu=totals["cpu"], processCpu=processCpu
+            )
+        )
+    logging.warning(
+        "run: {wall:.2f}s wall, {cpu:.2f}s cpu".format(
+            wall=time.perf_counter() - _startTime, cpu=_process_cpu_time()
+        )
+    )
+    for name, value in sorted(_counters.items()):
+        logging.warning(f"{name}: {value}")
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+
+import json
+import os
+import re
+
+from lib.paths import LEOPARD_GENERATED_DIR
+from lib.templates import register_template, render_template
+
+# how build_next_structure writes pages: one .tsx per container, or a single
+# catch-all page that looks containers up in a generated route manifest
+PAGE_MODES = ("files", "manifest")
+DEFAULT_PAGE_MODE = "files"
+
+ROUTE_MANIFEST_PATH = "{dir}/routeManifest.ts".format(dir=LEOPARD_GENERATED_DIR)
+# the page route of the catch-all page, relative to the pages directory
+MANIFEST_PAGE_ROUTE = "/[[...route]]"
+
+_CONTAINER_EXPORT_RE = re.compile(
+    r"""export\s*\{\s*default\s+as\s+(\w+)\s*\}\s*from\s*["']([^"']+)["']"""
+)
+
+
+class ManifestEntry(NamedTuple):
+    """
+    A route in the manifest and the container its page renders. `module` is
+    the module the container is the default export of, when the container
+    index says; otherwise it's imported by name from its package's container
+    index.
+    """
+
+    route: str
+    packageName: str
+    containerName: str
+    initialQuery: Optional[str]
+    module: Optional[str]
+
+
+def find_container_modules(containerEntryPath: str) -> Dict[str, str]:
+    """
+    Returns the module each container in the given container index.ts is
+    re-exported from, so the manifest can import containers one at a time
+    instead of through the index, which would load all of them.
+
+    Relative re-exports are turned into `@pkg/...` aliases, which mean the
+    same module from any importer. The index lives at
+    <pkg root>/<package>/container/index.ts, so a module outside the pkg
+    root can't be aliased and its container is left out, to be imported
+    through the index.
+    """
+    with open(containerEntryPath, "r") as f:
+        exports = _CONTAINER_EXPORT_RE.findall(f.read())
+
+    indexDir = os.path.dirname(containerEntryPath)
+    pkgRoot = os.path.dirname(os.path.dirname(indexDir))
+    modules = {}
+    for containerName, module in exports:
+        if module.startswith("./") or module.startswith("../"):
+            module = os.path.relpath(os.path.join(indexDir, module), pkgRoot)
+            if module.startswith(".."):
+                continue
+            module = "@" + module.replace(os.sep, "/")
+        modules[containerName] = module
+    return modules
+
+
+def _route_precedence(route: str) -> Tuple[Tuple[int, ...], str]:
+    """
+    Sorts routes the way Next.js prefers them for a URL: segment by segment,
+    static before dynamic before catch-all before optional catch-all.
+    """
+    ranks = []
+    for segment in route[1:].split("/"):
+        if segment.startswith("[[..."):
+            ranks.append(3)
+        elif segment.startswith("[..."):
+            ranks.append(2)
+        elif segment.startswith("["):
+            ranks.append(1)
+        else:
+            ranks.append(0)
+    return (tuple(ranks), route)
+
+
+def _render_entry(entry: ManifestEntry) -> str:
+    if entry.module is not None:
+        load = "() => import({module}).then((m) => m.default)".format(
+            module=json.dumps(entry.module)
+        )
+    else:
+        load = "() => import({module}).then((m) => m.{name})".format(
+            module=json.dumps(f"@{entry.packageName}/container"),
+            name=entry.containerName,
+        )
+    return "  {{ route: {route}, packageName: {packageName}, containerName: {containerName}, initialQuery: {initialQuery}, load: {load} }},".format(
+        route=json.dumps(entry.route),
+        packageName=json.dumps(entry.packageName),
+        containerName=json.dumps(entry.containerName),
+        initialQuery=json.dumps(entry.initialQuery),
+        load=load,
+    )
+
+
+def render_route_manifest(entries: Iterable[ManifestEntry]) -> str:
+    """
+    Renders the route manifest module, with the entries in match order.
+    """
+    return render_template(
+        "route-manifest",
+        {
+            "routes": "\n".join(
+                _render_entry(entry)
+                for entry in sorted(
+                    entries, key=lambda entry: _route_precedence(entry.route)
+                )
+            )
+        },
+    )
+
+
+def render_manifest_page(pagesDir: str) -> str:
+    """
+    Renders the catch-all page for pagesDir, importing the route manifest.
+    """
+    manifestModule = os.path.relpath(
+        os.path.splitext(ROUTE_MANIFEST_PATH)[0], pagesDir
+    )
+    if not manifestModule.startswith("."):
+        manifestModule = "./" + manifestModule
+    return render_template("page-manifest", {"manifestModule": manifestModule})
+
+
+register_template(
+    "route-manifest",
+    "route-manifest.ts.tmpl",
+    placeholders=("routes",),
+    required=("routes",),
+)
+register_template(
+    "page-manifest",
+    "page-manifest.tsx.tmpl",
+    placeholders=("manifestModule",),
+    required=("manifestModule",),
+)
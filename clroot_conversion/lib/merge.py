@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+from typing import Dict, List, Set
+
+import json
+import logging
+import os
+
+from lib.clroot import clroot_tree_sha
+from lib.codemods import collect_codemod_files, remove_deleted_files
+from lib.convert import (
+    create_route_subdirs,
+    prune_stale_pages,
+    remove_route_manifest,
+    write_if_changed,
+)
+from lib.copier import copy_file
+from lib.instrument import phase
+from lib.paths import LEOPARD_PAGES_DIR, LEOPARD_PKG_DIR
+from lib.runlog import PAGE_OUTCOMES, RunLog, iter_events
+from lib.shard import (
+    SHARD_CODEMODS,
+    SHARD_PAGES_DIR,
+    SHARD_PKG_DIR,
+    SHARD_RESULTS,
+    ShardException,
+    read_shard_manifest,
+)
+
+
+def _check_shards(shardDirs: List[str]) -> None:
+    """
+    Checks that shardDirs hold the finished output of every shard of a
+    single split, each exactly once.
+    """
+    seen = {}
+    counts = set()
+    for shardDir in shardDirs:
+        manifest = read_shard_manifest(shardDir)
+        if manifest is None:
+            raise ShardException(f"{shardDir} is not a shard output directory")
+        if not os.path.exists(os.path.join(shardDir, SHARD_CODEMODS)):
+            raise ShardException(f"{shardDir} has no codemod results, did it finish?")
+        index = manifest["shard"]
+        if index in seen:
+            raise ShardException(
+                f"{seen[index]} and {shardDir} both hold shard {index}"
+            )
+        seen[index] = shardDir
+        counts.add(manifest["shards"])
+
+    if len(counts) != 1:
+        raise ShardException(
+            "shards were split {counts} ways".format(
+                counts=" and ".join(str(count) for count in sorted(counts))
+            )
+        )
+    missing = sorted(set(range(counts.pop())) - set(seen))
+    if missing:
+        raise ShardException(
+            "missing shards {missing}".format(
+                missing=", ".join(str(index) for index in missing)
+            )
+        )
+
+
+def _merge_pages(shardDirs: List[str], clrootTree: str) -> None:
+    """
+    Writes every shard's pages into Leopard and combines their results into a
+    single run log, once it's checked that every shard read the clroot files
+    hashed to clrootTree (see clroot_tree_sha). Containers are replayed in
+    the order an unsharded run builds them, so when several claim the same
+    route the page of the last one wins, as it would unsharded.
+    """
+    starts = []
+    finished = set()
+    entries = []
+    for shardDir in shardDirs:
+        for event in iter_events(os.path.join(shardDir, SHARD_RESULTS)):
+            if event["event"] == "start":
+                starts.append(event)
+            elif event["event"] == "finish":
+                finished.add(shardDir)
+            elif event["event"] == "container":
+                entries.append((event["index"], shardDir, event))
+    unfinished = sorted(set(shardDirs) - finished)
+    if unfinished:
+        raise ShardException(
+            "shards in {dirs} did not finish building pages".format(
+                dirs=", ".join(unfinished)
+            )
+        )
+
+    trees = {start.get("clrootTree") for start in starts}
+    if None in trees:
+        raise ShardException(
+            "shards didn't record the clroot files they read, rebuild them"
+        )
+    containers = {start["containers"] for start in starts}
+    if len(trees) != 1 or len(containers) != 1:
+        raise ShardException("shards were built from different clroot files")
+    # the packages merged into were copied by this run
+    if trees.pop() != clrootTree:
+        raise ShardException(
+            "shards were built from different clroot files than this run's"
+        )
+    shas = {start["clrootSha"] for start in starts}
+    total = containers.pop()
+    entries.sort(key=lambda entry: entry[0])
+    if [entry[0] for entry in entries] != list(range(total)):
+        raise ShardException(
+            "shards built {built} of {total} containers".format(
+                built=len(entries), total=total
+            )
+        )
+
+    # route -> the containers building a page for it, in build order
+    claims: Dict[str, List[tuple]] = {}
+    for _, shardDir, event in entries:
+        if event["outcome"] in PAGE_OUTCOMES:
+            claims.setdefault(event["pageRoute"], []).append(
+                (event["container"], shardDir)
+            )
+
+    pageCounts = {"created": 0, "updated": 0, "unchanged": 0, "deleted": 0}
+    statuses = {}
+    collisions = 0
+    for route, claimants in sorted(claims.items()):
+        containerName, shardDir = claimants[-1]
+        if len(claimants) > 1:
+            collisions += 1
+            logging.warning(
+                "route collision on {route}{between} ({containers}), keeping {winner}'s page".format(
+                    route=route,
+                    between=" between shards"
+                    if len({claimant[1] for claimant in claimants}) > 1
+                    else "",
+                    containers=", ".join(claimant[0] for claimant in claimants),
+                    winner=containerName,
+                )
+            )
+
+        with open(f"{shardDir}/{SHARD_PAGES_DIR}{route}.tsx", "r") as f:
+            contents = f.read()
+        create_route_subdirs(route)
+        statuses[route] = write_if_changed(f"{LEOPARD_PAGES_DIR}{route}.tsx", contents)
+        pageCounts[statuses[route]] += 1
+
+    # shards always build pages as files
+    pageCounts["deleted"] = remove_route_manifest() + prune_stale_pages(
+        {f"{LEOPARD_PAGES_DIR}{route}.tsx" for route in claims}
+    )
+
+    pagesGenerated = 0
+    with RunLog() as runLog:
+        runLog.write(
+            "start",
+            containers=total,
+            clrootSha=shas.pop() if len(shas) == 1 else None,
+            clrootTree=clrootTree,
+            shards=len(shardDirs),
+        )
+        for _, _, event in entries:
+            fields = {
+                key: value
+                for key, value in event.items()
+                if key not in ("event", "time")
+            }
+            if event["outcome"] in PAGE_OUTCOMES:
+                fields["status"] = statuses[event["pageRoute"]]
+                pagesGenerated += 1
+            runLog.write("container", **fields)
+        runLog.write(
+            "finish", pages=pagesGenerated, collisions=collisions, **pageCounts
+        )
+    logging.warning(f"wrote merged run log to {runLog.path}")
+
+    logging.warning(f"\nTOTAL PAGES GENERATED: {pagesGenerated}/{total}")
+    logging.warning(
+        "PAGES: {created} created, {updated} updated, {unchanged} unchanged, {deleted} deleted".format(
+            **pageCounts
+        )
+    )
+
+
+def _merge_codemods(shardDirs: List[str]) -> Set[str]:
+    """
+    Copies every shard's codemodded files into Leopard's pkg directory, then
+    does the deletions the shards left out, over the whole tree.
+    """
+    shardFiles = {}
+    deletedImports = []
+    for shardDir in shardDirs:
+        with open(os.path.join(shardDir, SHARD_CODEMODS), "r") as f:
+            results = json.load(f)
+        for relPath in results["files"]:
+            shardFiles[relPath] = shardDir
+        deletedImports += results["deletedImports"]
+
+    expected = {
+        os.path.relpath(path, LEOPARD_PKG_DIR)
+        for files in collect_codemod_files().values()
+        for path in files
+    }
+    if expected != set(shardFiles):
+        raise ShardException(
+            "Leopard's packages don't match the shards': {missing} files not in any shard, {extra} shard files not in Leopard".format(
+                missing=len(expected - set(shardFiles)),
+                extra=len(set(shardFiles) - expected),
+            )
+        )
+
+    for relPath, shardDir in shardFiles.items():
+        # copy_file replaces the file, so one hard linked to clroot isn't
+        # written through
+        src = os.path.join(shardDir, SHARD_PKG_DIR, relPath)
+        copy_file(src, os.path.join(LEOPARD_PKG_DIR, relPath), os.path.getsize(src))
+    logging.warning(
+        "merged {count} codemodded files from {shards} shards".format(
+            count=len(shardFiles), shards=len(shardDirs)
+        )
+    )
+
+    return remove_deleted_files(list(dict.fromkeys(deletedImports)))
+
+
+def merge_shards(shardDirs: List[str]) -> Set[str]:
+    """
+    Combines the output of `makeLeopard.py --shard` runs into Leopard, giving
+    the same pages and packages as an unsharded run. Leopard's packages have
+    to have been copied from the same clroot files the shards read first.
+    Returns the files removed by the codemods, like run_codemods.
+    """
+    _check_shards(shardDirs)
+    with phase("hash_clroot"):
+        clrootTree = clroot_tree_sha()
+    with phase("merge_pages"):
+        _merge_pages(shardDirs, clrootTree)
+    with phase("merge_codemods"):
+        return _merge_codemods(shardDirs)
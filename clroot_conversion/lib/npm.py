@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+from typing import Callable, Dict, List, Optional
+
+import json
+import logging
+import os
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from lib.cache import CACHE_DIR
+from lib.instrument import count
+
+# regularly updated @ContextLogic packages, kept at their latest versions
+NPM_PACKAGES = [
+    "@ContextLogic/lego",
+    "@ContextLogic/zeus",
+    "@ContextLogic/leopardstrings",
+]
+FRESHNESS_PATH = "{dir}/npm_versions.json".format(dir=CACHE_DIR)
+DEFAULT_TTL_HOURS = 6.0
+
+# maps each package name to the latest version published to the registry
+VersionResolver = Callable[[List[str]], Dict[str, str]]
+
+
+class NPMException(Exception):
+    pass
+
+
+def npm_view_resolver(registry: Optional[str] = None) -> VersionResolver:
+    """
+    Returns a resolver that looks up the latest versions with `npm view`,
+    against the given registry URL (e.g. a local stand-in registry) or npm's
+    configured one. The packages are looked up concurrently.
+    """
+
+    def resolve(pkg: str) -> str:
+        command = ["npm", "view", f"{pkg}@latest", "version", "--json"]
+        if registry is not None:
+            command.append(f"--registry={registry}")
+        count("subprocesses spawned")
+        try:
+            output = subprocess.check_output(command, text=True)
+            return json.loads(output)
+        except (OSError, subprocess.CalledProcessError, ValueError) as e:
+            raise NPMException(f"npm view {pkg} failed with error {e}")
+
+    def resolve_all(pkgs: List[str]) -> Dict[str, str]:
+        with ThreadPoolExecutor(max_workers=len(pkgs) or 1) as executor:
+            return dict(zip(pkgs, executor.map(resolve, pkgs)))
+
+    return resolve_all
+
+
+def installed_versions(leopardDir: str, pkgs: List[str]) -> Dict[str, str]:
+    """
+    Returns the version of each package installed in leopardDir's
+    node_modules, leaving out packages that aren't installed.
+    """
+    versions = {}
+    for pkg in pkgs:
+        try:
+            with open(f"{leopardDir}/node_modules/{pkg}/package.json", "r") as f:
+                versions[pkg] = json.load(f)["version"]
+        except (OSError, ValueError, KeyError):
+            pass
+    return versions
+
+
+def load_freshness(registry: Optional[str]) -> Optional[dict]:
+    """
+    Returns the versions recorded by the last check against the registry,
+    with the time of that check, or None if there isn't one.
+    """
+    try:
+        with open(FRESHNESS_PATH, "r") as f:
+            freshness = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if freshness.get("registry") != registry:
+        return None
+    return freshness
+
+
+def store_freshness(registry: Optional[str], versions: Dict[str, str]) -> None:
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmpPath = "{path}.{pid}.tmp".format(path=FRESHNESS_PATH, pid=os.getpid())
+    with open(tmpPath, "w") as f:
+        json.dump(
+            {"registry": registry, "checkedAt": time.time(), "versions": versions}, f
+        )
+    os.replace(tmpPath, FRESHNESS_PATH)
+
+
+def outdated_packages(
+    leopardDir: str,
+    pkgs: List[str],
+    ttl_hours: float = DEFAULT_TTL_HOURS,
+    registry: Optional[str] = None,
+    resolver: Optional[VersionResolver] = None,
+) -> Dict[str, str]:
+    """
+    Returns the latest version of every package whose installed version is
+    behind it. The registry is only asked when the last check is older than
+    `ttl_hours`, or a package isn't installed at the version it found;
+    otherwise the recorded versions are trusted and nothing is outdated.
+    """
+    installed = installed_versions(leopardDir, pkgs)
+    freshness = load_freshness(registry)
+    if (
+        freshness is not None
+        and time.time() - freshness["checkedAt"] < ttl_hours * 3600
+        and all(installed.get(pkg) == freshness["versions"].get(pkg) for pkg in pkgs)
+    ):
+        logging.warning(
+            "npm packages checked {minutes:.0f} minutes ago and up to date, skipping".format(
+                minutes=(time.time() - freshness["checkedAt"]) / 60
+            )
+        )
+        return {}
+
+    if resolver is None:
+        resolver = npm_view_resolver(registry)
+    latest = resolver(pkgs)
+    store_freshness(registry, latest)
+
+    outdated = {}
+    for pkg in pkgs:
+        if installed.get(pkg) == latest[pkg]:
+            logging.warning(f"{pkg} is up to date at {latest[pkg]}")
+        else:
+            logging.warning(
+                "{pkg}: {installed} -> {latest}".format(
+                    pkg=pkg,
+                    installed=installed.get(pkg, "not installed"),
+                    latest=latest[pkg],
+                )
+            )
+            outdated[pkg] = latest[pkg]
+    return outdated
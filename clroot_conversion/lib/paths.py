@@ -3,9 +3,42 @@ from __future__ import annotations
 
 import os
 
+# the parts of clroot the conversion reads, relative to the clroot root
+CLROOT_PKG_PATH = "sweeper/merchant_dashboard/static/js/pkg"
+CLROOT_HANDLERS_PATH = "sweeper/merchant_dashboard/handlers"
+CLROOT_URI_SPEC_PATHS = [
+    "sweeper/merchant_dashboard/core/uri_specs/api_and_page_handler.py",
+    "sweeper/merchant_dashboard/core/uri_specs/v1_api_specs.py",
+    "sweeper/merchant_dashboard/core/uri_specs/v2_api_specs.py",
+    "sweeper/merchant_dashboard/external/v3/core/uri_mapping.py",
+    "sweeper/merchant_dashboard/core/uri_specs/merch_comms_specs.py",
+]
+
 CLROOT_DIR = os.getenv("CL_HOME")
-CLROOT_PKG_DIR = "{dir}/sweeper/merchant_dashboard/static/js/pkg".format(dir=CLROOT_DIR)
-CLROOT_HANDLERS_DIR = "{dir}/sweeper/merchant_dashboard/handlers".format(dir=CLROOT_DIR)
+# where the clroot files are read from: the checkout itself, unless
+# refresh_clroot exported them elsewhere (see use_clroot_source)
+CLROOT_SOURCE_DIR = CLROOT_DIR
+CLROOT_PKG_DIR = "{dir}/{path}".format(dir=CLROOT_SOURCE_DIR, path=CLROOT_PKG_PATH)
+CLROOT_HANDLERS_DIR = "{dir}/{path}".format(
+    dir=CLROOT_SOURCE_DIR, path=CLROOT_HANDLERS_PATH
+)
 LEOPARD_DIR = os.getenv("LEOPARD_HOME")
 LEOPARD_PKG_DIR = "{dir}/src/pkg".format(dir=LEOPARD_DIR)
 LEOPARD_PAGES_DIR = "{dir}/src/pages/demo".format(dir=LEOPARD_DIR)
+# generated modules the demo pages import, outside the pages directory so
+# Next.js doesn't treat them as pages
+LEOPARD_GENERATED_DIR = "{dir}/src/generated/demo".format(dir=LEOPARD_DIR)
+
+
+def use_clroot_source(sourceDir: str) -> None:
+    """
+    Reads clroot's files from sourceDir (laid out like clroot) instead of the
+    checkout. Code that reads clroot has to look the CLROOT_*_DIR paths up on
+    this module when it runs, rather than importing them, to see the change.
+    """
+    global CLROOT_SOURCE_DIR, CLROOT_PKG_DIR, CLROOT_HANDLERS_DIR
+    CLROOT_SOURCE_DIR = sourceDir
+    CLROOT_PKG_DIR = "{dir}/{path}".format(dir=sourceDir, path=CLROOT_PKG_PATH)
+    CLROOT_HANDLERS_DIR = "{dir}/{path}".format(
+        dir=sourceDir, path=CLROOT_HANDLERS_PATH
+    )
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+from typing import Dict, Optional, Set
+
+import json
+import logging
+import os
+import time
+
+from lib import paths
+from lib.convert import ContainerPage
+from lib.importgraph import ImportGraph
+from lib.instrument import LOGS_DIR, count, phase
+from lib.manifest import find_container_modules
+from lib.paths import LEOPARD_PKG_DIR
+from lib.setup import copy_packages
+from lib.utils import removeIfExists
+
+# the container index, relative to a pkg directory
+CONTAINER_INDEX_PATH = "merchant/container/index.ts"
+
+
+def clroot_container_index() -> str:
+    return f"{paths.CLROOT_PKG_DIR}/{CONTAINER_INDEX_PATH}"
+
+
+def _paged_containers(pages: Dict[str, ContainerPage]) -> Dict[str, str]:
+    """
+    Returns the package of every container that got a page.
+    """
+    return {
+        containerName: page.entry["packageName"]
+        for containerName, page in pages.items()
+        if page.pagePath is not None
+    }
+
+
+def reachable_files(pages: Dict[str, ContainerPage]) -> Set[str]:
+    """
+    Returns the clroot pkg files the generated pages need: the modules of the
+    containers that got pages and everything they transitively import,
+    through relative imports and `@assets`/`@toolkit`/`@schema`/... aliases
+    alike, including imported non-code files like images. Every .d.ts file
+    is kept too, since ambient declarations are never imported.
+
+    Containers of packages other than merchant are imported through their
+    package's container index, as the pages do, so all of its containers
+    are kept.
+    """
+    pkgDir = paths.CLROOT_PKG_DIR
+    indexPath = clroot_container_index()
+    modules = find_container_modules(indexPath)
+    graph = ImportGraph(pkgDir).update()
+
+    seeds = {indexPath}
+    for containerName, packageName in sorted(_paged_containers(pages).items()):
+        if packageName == "merchant" and containerName in modules:
+            target = graph.resolve(modules[containerName], importer=indexPath)
+        else:
+            target = graph.resolve(f"@{packageName}/container")
+        if target is None:
+            logging.warning(f"{containerName}: couldn't find the container's module")
+            continue
+        seeds.add(target)
+
+    # the index only re-exports the paged containers once it's filtered
+    graph.imports[indexPath] = []
+    reached = graph.reachable_from(seeds)
+    reached.update(path for path in graph.imports if path.endswith(".d.ts"))
+    return reached
+
+
+def write_container_index(pages: Dict[str, ContainerPage]) -> int:
+    """
+    Writes Leopard's container index with only the containers that got pages
+    re-exported, since the rest aren't copied. Returns the number of
+    containers left out.
+    """
+    paged = _paged_containers(pages)
+    lines = []
+    dropped = 0
+    with open(clroot_container_index(), "r") as f:
+        for line in f.readlines():
+            # the same lines find_container_names reads containers from
+            parsedLine = line.split(" ")
+            if len(parsedLine) >= 5 and parsedLine[4] not in paged:
+                dropped += 1
+                continue
+            lines.append(line)
+
+    # the copied index may be hard linked to clroot's, so it's replaced
+    # rather than written through
+    indexPath = f"{LEOPARD_PKG_DIR}/{CONTAINER_INDEX_PATH}"
+    removeIfExists(indexPath, fn=os.remove)
+    with open(indexPath, "w") as f:
+        f.write("".join(lines))
+    return dropped
+
+
+def _write_report(excluded: Dict[str, Dict[str, int]]) -> str:
+    """
+    Writes the files left out of each package to lib/logs, returning the
+    report's path.
+    """
+    os.makedirs(LOGS_DIR, exist_ok=True)
+    reportPath = "{dir}/reachability_{uid}.json".format(
+        dir=LOGS_DIR, uid=round(time.time())
+    )
+    with open(reportPath, "w") as f:
+        json.dump(
+            {
+                pkg: {
+                    "files": len(files),
+                    "bytes": sum(files.values()),
+                    "excluded": sorted(files),
+                }
+                for pkg, files in excluded.items()
+            },
+            f,
+            indent=2,
+        )
+    return reportPath
+
+
+def copy_reachable_packages(
+    pages: Dict[str, ContainerPage], link_mode="copy", workers: Optional[int] = None
+) -> None:
+    """
+    Copies only the package files the generated pages need into Leopard (see
+    reachable_files), instead of the packages wholesale, and logs how much
+    was left out. The full list is written to lib/logs/reachability_*.json.
+    """
+    with phase("reachability"):
+        include = reachable_files(pages)
+
+    excluded = copy_packages(
+        dryrun=False, link_mode=link_mode, workers=workers, include=include
+    )
+    dropped = write_container_index(pages)
+
+    for pkg, files in excluded.items():
+        logging.warning(
+            "{pkg}: excluded {files} unreachable files ({size:.1f}MB)".format(
+                pkg=pkg, files=len(files), size=sum(files.values()) / 1024 / 1024
+            )
+        )
+    excludedFiles = sum(len(files) for files in excluded.values())
+    excludedBytes = sum(sum(files.values()) for files in excluded.values())
+    count("files excluded", excludedFiles)
+    count("bytes excluded", excludedBytes)
+    logging.warning(
+        "excluded {files} unreachable files ({size:.1f}MB) and {dropped} containers without pages, see {path}".format(
+            files=excludedFiles,
+            size=excludedBytes / 1024 / 1024,
+            dropped=dropped,
+            path=_write_report(excluded),
+        )
+    )
@@ -0,0 +1,553 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+from typing import Dict, List, NamedTuple, Optional, Pattern, Set, Tuple
+
+import logging
+import re
+
+try:
+    import re._parser as _sre_parse
+except ImportError:  # python < 3.11
+    import sre_parse as _sre_parse
+
+_REGEX_CHARS = set(".^$*+?{}[]|()\\")
+_CATCH_ALL_BODIES = {".*": True, ".+": False}
+_PARAM_NAME_RE = re.compile(r"[^A-Za-z0-9_]")
+# characters tried, in order, for a character class in an example URL
+_EXAMPLE_CHARS = "a1A-_."
+_CATEGORY_TESTS = {
+    "CATEGORY_DIGIT": lambda char: char.isdigit(),
+    "CATEGORY_NOT_DIGIT": lambda char: not char.isdigit(),
+    "CATEGORY_WORD": lambda char: char.isalnum() or char == "_",
+    "CATEGORY_NOT_WORD": lambda char: not (char.isalnum() or char == "_"),
+    "CATEGORY_SPACE": lambda char: char.isspace(),
+    "CATEGORY_NOT_SPACE": lambda char: not char.isspace(),
+}
+
+
+class Route(NamedTuple):
+    """
+    A URLSpec route and the Next.js page it maps to. `pagePath` uses Next's
+    dynamic segment syntax (`/product/[param1]`, `/files/[...path]`) and is
+    None when the route can't be expressed as a Next.js page.
+    """
+
+    handlerName: str
+    pattern: str
+    pagePath: Optional[str]
+    params: Tuple[str, ...]
+    regex: Optional[Pattern]
+
+
+class _TrieNode:
+    def __init__(self):
+        self.children: Dict[str, _TrieNode] = {}
+        self.dynamicName: Optional[str] = None
+        # whether the name came from a named group, rather than paramN
+        self.dynamicNamed = False
+        self.dynamic: Optional[_TrieNode] = None
+        self.catchAllName: Optional[str] = None
+        self.catchAllNamed = False
+        self.catchAllOptional = False
+        self.catchAll: List[Route] = []
+        self.routes: List[Route] = []
+
+
+def _subtree_routes(node: _TrieNode) -> List[List[Route]]:
+    """
+    Returns the route lists of node and every node below it.
+    """
+    routeLists = [node.routes, node.catchAll]
+    for child in node.children.values():
+        routeLists += _subtree_routes(child)
+    if node.dynamic is not None:
+        routeLists += _subtree_routes(node.dynamic)
+    return routeLists
+
+
+def _split_segments(pattern: str) -> List[str]:
+    """
+    Splits a route pattern on the `/`s that aren't inside a group or character
+    class, so `(?P<id>[^/]+)` stays a single segment.
+    """
+    segments = []
+    current = ""
+    depth = 0
+    inClass = False
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == "\\" and i + 1 < len(pattern):
+            current += pattern[i : i + 2]
+            i += 2
+            continue
+
+        if inClass:
+            inClass = char != "]"
+        elif char == "[":
+            inClass = True
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "/" and depth == 0:
+            segments.append(current)
+            current = ""
+            i += 1
+            continue
+
+        current += char
+        i += 1
+
+    segments.append(current)
+    return segments
+
+
+def _literal_segment(segment: str) -> Optional[str]:
+    """
+    Returns the literal text a segment matches, unescaping `\\.` and friends,
+    or None if the segment contains regex syntax. An unescaped `.` is taken
+    literally, since that's what routes like `/robots.txt` mean by it.
+    """
+    literal = ""
+    i = 0
+    while i < len(segment):
+        char = segment[i]
+        if char == "\\" and i + 1 < len(segment) and not segment[i + 1].isalnum():
+            literal += segment[i + 1]
+            i += 2
+            continue
+        if char in _REGEX_CHARS and char != ".":
+            return None
+        literal += char
+        i += 1
+    return literal
+
+
+def _group_segment(segment: str) -> Optional[Tuple[Optional[str], str, bool]]:
+    """
+    If the segment is exactly one group, returns its (name, body, capturing)
+    triple. Returns None for anything else, including optional or repeated
+    groups and groups mixed with literal text.
+    """
+    if not (segment.startswith("(") and segment.endswith(")")):
+        return None
+
+    depth = 0
+    inClass = False
+    i = 0
+    while i < len(segment):
+        char = segment[i]
+        if char == "\\":
+            i += 2
+            continue
+        if inClass:
+            inClass = char != "]"
+        elif char == "[":
+            inClass = True
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+            if depth == 0 and i != len(segment) - 1:
+                return None
+        i += 1
+
+    body = segment[1:-1]
+    named = re.match(r"\?P<([A-Za-z_][A-Za-z0-9_]*)>", body)
+    if named:
+        return (named.group(1), body[named.end() :], True)
+    if body.startswith("?:"):
+        return (None, body[2:], False)
+    if body.startswith("?"):
+        return None
+    return (None, body, True)
+
+
+def _example_char(test) -> str:
+    for char in _EXAMPLE_CHARS:
+        if test(char):
+            return char
+    raise ValueError("no example character")
+
+
+def _in_set(char: str, items) -> bool:
+    matched = False
+    negated = False
+    for op, av in items:
+        if op.name == "NEGATE":
+            negated = True
+        elif op.name == "LITERAL":
+            matched = matched or ord(char) == av
+        elif op.name == "RANGE":
+            matched = matched or av[0] <= ord(char) <= av[1]
+        elif op.name == "CATEGORY" and av.name in _CATEGORY_TESTS:
+            matched = matched or _CATEGORY_TESTS[av.name](char)
+        else:
+            raise ValueError(op.name)
+    return matched != negated
+
+
+def _example(parsed, repeated: bool = False) -> str:
+    """
+    Returns a string the parsed regex matches, taking the first alternative
+    of each branch and repeating each repeat once where it can. A lone `.`
+    matches a dot, as it does in literal segments (see _literal_segment).
+    Raises ValueError for lookarounds, backreferences and the like.
+    """
+    example = ""
+    for op, av in parsed:
+        if op.name == "LITERAL":
+            example += chr(av)
+        elif op.name == "NOT_LITERAL":
+            example += _example_char(lambda char: ord(char) != av)
+        elif op.name == "ANY":
+            example += _example_char(lambda char: True) if repeated else "."
+        elif op.name == "IN":
+            example += _example_char(lambda char: _in_set(char, av))
+        elif op.name in ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT"):
+            low, high, item = av
+            example += _example(item, True) * max(low, min(1, high))
+        elif op.name == "SUBPATTERN":
+            example += _example(av[-1], repeated)
+        elif op.name == "ATOMIC_GROUP":
+            example += _example(av, repeated)
+        elif op.name == "BRANCH":
+            example += _example(av[1][0], repeated)
+        elif op.name != "AT":
+            raise ValueError(op.name)
+    return example
+
+
+def example_url(route: Route) -> Optional[str]:
+    """
+    Returns a URL the route's regex matches, or None if one couldn't be made
+    up from it.
+    """
+    try:
+        url = _example(_sre_parse.parse(route.pattern))
+    except (ValueError, re.error):
+        return None
+    if len(url) > 1 and url.endswith("/"):
+        url = url[:-1]
+    if route.regex is None or route.regex.match(url) is None:
+        return None
+    return url
+
+
+def to_page_path(pattern: str) -> Tuple[Optional[str], Tuple[str, ...]]:
+    """
+    Converts a URLSpec route pattern into a Next.js page path, turning each
+    regex group that spans a whole segment into a dynamic segment (`[name]` for
+    named groups, `[paramN]` for the Nth unnamed one) and a trailing `.*`/`.+`
+    into a catch-all. A `.*` anywhere else becomes a dynamic segment, so its
+    page only serves the single-segment values. Returns (None, ()) for
+    patterns Next.js can't express, such as groups mixed with literal text
+    within a segment. An unescaped `.` within literal text is taken as a
+    literal dot.
+    """
+    path = pattern
+    if path.startswith("^"):
+        path = path[1:]
+    if path.endswith("$") and not path.endswith("\\$"):
+        path = path[:-1]
+    if path.endswith("/?"):
+        path = path[:-2]
+    if len(path) > 1 and path.endswith("/"):
+        path = path[:-1]
+    if not path.startswith("/"):
+        return (None, ())
+    if path == "/":
+        return ("/index", ())
+
+    pageSegments = []
+    params = []
+    groupIndex = 0
+    segments = _split_segments(path[1:])
+    for i, segment in enumerate(segments):
+        isLast = i == len(segments) - 1
+        literal = _literal_segment(segment)
+        if literal is not None:
+            if literal in ("", ".", ".."):
+                return (None, ())
+            pageSegments.append(literal)
+            continue
+
+        if segment in _CATCH_ALL_BODIES:
+            group = (None, segment, False)
+        else:
+            group = _group_segment(segment)
+        if group is None:
+            return (None, ())
+
+        name, body, capturing = group
+        if capturing:
+            groupIndex += 1
+        if name is None:
+            name = "param{index}".format(index=groupIndex) if capturing else "path"
+        name = _PARAM_NAME_RE.sub("_", name)
+        if name in params:
+            return (None, ())
+        params.append(name)
+
+        if body in _CATCH_ALL_BODIES and isLast:
+            if _CATCH_ALL_BODIES[body]:
+                pageSegments.append("[[...{name}]]".format(name=name))
+            else:
+                pageSegments.append("[...{name}]".format(name=name))
+        else:
+            pageSegments.append("[{name}]".format(name=name))
+
+    return ("/" + "/".join(pageSegments), tuple(params))
+
+
+class RouteTable:
+    """
+    Every URLSpec route found in the clroot uri_spec files, indexed by handler
+    name and by page path. Page paths are kept in a trie (one node per path
+    segment) that is built as routes are added, so dynamic segments at the
+    same level share a name, as Next.js requires, and a URL can be resolved
+    to its page by walking the trie.
+    """
+
+    def __init__(self):
+        self._byHandler: Dict[str, Route] = {}
+        self._root = _TrieNode()
+
+    def __len__(self):
+        return len(self._byHandler)
+
+    def add(self, handlerName: str, pattern: str) -> Route:
+        """
+        Adds a handler's route. If the handler is already mapped, the new route
+        replaces it for handler lookups, matching the old dict behaviour. A
+        route whose page another handler's route already has is kept without
+        a page path, so the earlier page isn't overwritten. Adding a route can
+        rename the dynamic segments of routes added before it (see _insert),
+        so page paths should only be read once every route is added.
+        """
+        try:
+            regex = re.compile(pattern if pattern.endswith("$") else pattern + "$")
+            pagePath, params = to_page_path(pattern)
+        except re.error:
+            regex = None
+            pagePath, params = (None, ())
+
+        node = None
+        if pagePath is None:
+            logging.warning(f"{pattern}: route can't be expressed as a page")
+        else:
+            node, pagePath, params = self._insert(
+                handlerName, pattern, pagePath, set(regex.groupindex)
+            )
+            if node is None:
+                pagePath, params = (None, ())
+
+        route = Route(
+            handlerName=handlerName,
+            pattern=pattern,
+            pagePath=pagePath,
+            params=params,
+            regex=regex,
+        )
+        if node is not None:
+            if "[..." in pagePath:
+                node.catchAll.append(route)
+            else:
+                node.routes.append(route)
+
+        self._byHandler[handlerName] = route
+        return route
+
+    def _insert(
+        self, handlerName: str, pattern: str, pagePath: str, named: Set[str]
+    ) -> Tuple[Optional[_TrieNode], str, Tuple[str, ...]]:
+        """
+        Walks the trie for pagePath, creating nodes as needed. Named groups
+        keep their name, and the unnamed (paramN) segments at their level are
+        renamed to it; unnamed segments take the name already used at their
+        level. Returns the node the route belongs on along with the (possibly
+        renamed) page path and params, or None for the node when the route
+        can't get a page (see _conflict).
+        """
+        conflict = self._conflict(handlerName, pagePath, named)
+        if conflict is not None:
+            logging.warning(f"{pattern}: {conflict}, skipping the route")
+            return (None, pagePath, ())
+
+        node = self._root
+        pageSegments = []
+        params = []
+        for depth, segment in enumerate(pagePath[1:].split("/")):
+            if segment.startswith("[[...") or segment.startswith("[..."):
+                name = segment.strip("[].")
+                if node.catchAllName is None:
+                    node.catchAllName = name
+                    node.catchAllNamed = name in named
+                    node.catchAllOptional = segment.startswith("[[")
+                elif name in named and name != node.catchAllName:
+                    self._rename([node.catchAll], depth, name)
+                    node.catchAllName = name
+                    node.catchAllNamed = True
+                template = "[[...{name}]]" if node.catchAllOptional else "[...{name}]"
+                pageSegments.append(template.format(name=node.catchAllName))
+                params.append(node.catchAllName)
+            elif segment.startswith("["):
+                name = segment[1:-1]
+                if node.dynamic is None:
+                    node.dynamicName = name
+                    node.dynamicNamed = name in named
+                    node.dynamic = _TrieNode()
+                elif name in named and name != node.dynamicName:
+                    self._rename(_subtree_routes(node.dynamic), depth, name)
+                    node.dynamicName = name
+                    node.dynamicNamed = True
+                pageSegments.append("[{name}]".format(name=node.dynamicName))
+                params.append(node.dynamicName)
+                node = node.dynamic
+            else:
+                node = node.children.setdefault(segment, _TrieNode())
+                pageSegments.append(segment)
+
+        return (node, "/" + "/".join(pageSegments), tuple(params))
+
+    def _conflict(
+        self, handlerName: str, pagePath: str, named: Set[str]
+    ) -> Optional[str]:
+        """
+        Returns why pagePath can't be added without changing the trie, if it
+        can't: a named group at a level another named group already named, or
+        a page another handler's route already has.
+        """
+        node = self._root
+        for segment in pagePath[1:].split("/"):
+            if segment.startswith("[[...") or segment.startswith("[..."):
+                name = segment.strip("[].")
+                if node.catchAllNamed and name in named and name != node.catchAllName:
+                    return f"[...{name}] conflicts with [...{node.catchAllName}] at the same level"
+                routes = node.catchAll
+                break
+            elif segment.startswith("["):
+                name = segment[1:-1]
+                if node.dynamicNamed and name in named and name != node.dynamicName:
+                    return f"[{name}] conflicts with [{node.dynamicName}] at the same level"
+                node = node.dynamic
+            else:
+                node = node.children.get(segment)
+            if node is None:
+                return None
+        else:
+            routes = node.routes
+
+        for other in routes:
+            if (
+                other.handlerName != handlerName
+                and self._byHandler.get(other.handlerName) is other
+            ):
+                return f"its page is already {other.handlerName}'s ({other.pattern})"
+        return None
+
+    def _rename(self, routeLists: List[List[Route]], depth: int, name: str) -> None:
+        """
+        Renames the dynamic segment at the given depth of every route in
+        routeLists, in place, for when a named group takes over the level.
+        """
+        for routes in routeLists:
+            for i, route in enumerate(routes):
+                segments = route.pagePath[1:].split("/")
+                paramIndex = len([s for s in segments[:depth] if s.startswith("[")])
+                oldName = route.params[paramIndex]
+                segments[depth] = segments[depth].replace(oldName, name, 1)
+                params = list(route.params)
+                params[paramIndex] = name
+                renamed = route._replace(
+                    pagePath="/" + "/".join(segments), params=tuple(params)
+                )
+                routes[i] = renamed
+                if self._byHandler.get(route.handlerName) is route:
+                    self._byHandler[route.handlerName] = renamed
+
+    def route_for_handler(self, handlerName: str) -> Optional[Route]:
+        return self._byHandler.get(handlerName)
+
+    def routes(self) -> List[Route]:
+        return list(self._byHandler.values())
+
+    def verify(self) -> List[Route]:
+        """
+        Checks that every page serves its own route: resolves an example URL
+        of each route with a page (see example_url) and logs the routes whose
+        URL another route's page serves instead, or no page at all. Returns
+        those routes.
+        """
+        unverified = []
+        for route in self._byHandler.values():
+            url = example_url(route) if route.pagePath is not None else None
+            if url is None:
+                continue
+            found = self.match(url)
+            if found is not None and found[0] is route:
+                continue
+            logging.warning(
+                "{pattern}: {url} is served by {page} instead of {pagePath}".format(
+                    pattern=route.pattern,
+                    url=url,
+                    page="no page" if found is None else found[0].pagePath,
+                    pagePath=route.pagePath,
+                )
+            )
+            unverified.append(route)
+        return unverified
+
+    def match(self, url: str) -> Optional[Tuple[Route, Dict[str, str]]]:
+        """
+        Resolves a concrete URL (e.g. `/product/123`) to the route whose page
+        serves it and the values of its dynamic segments. Candidates from the
+        trie are confirmed against the route's compiled regex. Static segments
+        win over dynamic ones, which win over catch-alls, as in Next.js.
+        """
+        path = url.split("?", 1)[0]
+        if len(path) > 1 and path.endswith("/"):
+            path = path[:-1]
+        segments = ["index"] if path == "/" else path[1:].split("/")
+        return self._match(self._root, segments, path, {})
+
+    def _is_current(self, route: Route, path: str) -> bool:
+        return (
+            self._byHandler.get(route.handlerName) is route
+            and route.regex.match(path) is not None
+        )
+
+    def _match(self, node, segments, path, params):
+        if not segments:
+            for route in node.routes:
+                if self._is_current(route, path):
+                    return (route, params)
+            if node.catchAllOptional:
+                return self._match_catch_all(node, segments, path, params)
+            return None
+
+        segment = segments[0]
+        child = node.children.get(segment)
+        if child is not None:
+            found = self._match(child, segments[1:], path, params)
+            if found:
+                return found
+
+        if node.dynamic is not None:
+            found = self._match(
+                node.dynamic,
+                segments[1:],
+                path,
+                dict(params, **{node.dynamicName: segment}),
+            )
+            if found:
+                return found
+
+        return self._match_catch_all(node, segments, path, params)
+
+    def _match_catch_all(self, node, segments, path, params):
+        for route in node.catchAll:
+            if self._is_current(route, path):
+                return (route, dict(params, **{node.catchAllName: "/".join(segments)}))
+        return None
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import glob
+import heapq
+import json
+import logging
+import os
+import time
+
+from lib.instrument import LOGS_DIR
+
+# container outcomes that produced a page
+PAGE_OUTCOMES = ("page",)
+
+
+class RunLog:
+    """
+    An append-only JSONL log of a conversion run in lib/logs/run_<ts>_<pid>.jsonl.
+    Every event is a JSON object on its own line with an `event` type and
+    the time it was written, and is flushed as soon as it's written, so a
+    run that crashes still leaves everything up to the crash behind.
+
+    Used as a context manager, an `aborted` event with the exception is
+    written if the block raises; otherwise the run writes its own `finish`
+    event.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        if path is None:
+            path = "{dir}/run_{uid}_{pid}.jsonl".format(
+                dir=LOGS_DIR, uid=round(time.time()), pid=os.getpid()
+            )
+        self.path = path
+        self._file = open(path, "a")
+
+    def write(self, event: str, **fields) -> None:
+        fields["event"] = event
+        fields["time"] = round(time.time(), 3)
+        self._file.write(json.dumps(fields) + "\n")
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self) -> RunLog:
+        return self
+
+    def __exit__(self, excType, exc, traceback) -> None:
+        if exc is not None:
+            self.write("aborted", error=type(exc).__name__, message=str(exc))
+        self.close()
+
+
+def list_runs() -> List[str]:
+    """
+    Returns the paths of the run logs in lib/logs, oldest first.
+    """
+    return sorted(
+        glob.glob("{dir}/run_*.jsonl".format(dir=LOGS_DIR)), key=os.path.getmtime
+    )
+
+
+def iter_events(path: str) -> Iterator[dict]:
+    """
+    Yields the events in a run log one line at a time. A line cut short by
+    a crash is skipped.
+    """
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                logging.warning(f"{path}: skipping truncated line")
+
+
+class ContainerOutcome(NamedTuple):
+    outcome: str
+    pageRoute: Optional[str]
+    seconds: float
+    message: Optional[str]
+
+
+class RunSummary(NamedTuple):
+    """
+    What a run did, without the per-container details: the `start` and
+    `finish` events (`finish` is None if the run never finished) and every
+    container's outcome.
+    """
+
+    path: str
+    start: Optional[dict]
+    finish: Optional[dict]
+    containers: Dict[str, ContainerOutcome]
+
+    def pages(self) -> Dict[str, str]:
+        return {
+            name: result.pageRoute
+            for name, result in self.containers.items()
+            if result.outcome in PAGE_OUTCOMES
+        }
+
+    def errors(self) -> Dict[str, ContainerOutcome]:
+        return {
+            name: result
+            for name, result in self.containers.items()
+            if result.outcome not in PAGE_OUTCOMES
+        }
+
+    def slowest(self, n: int) -> List[Tuple[str, float]]:
+        return heapq.nlargest(
+            n,
+            ((name, result.seconds) for name, result in self.containers.items()),
+            key=lambda item: item[1],
+        )
+
+
+def summarize_run(path: str) -> RunSummary:
+    """
+    Reads a run log into a RunSummary, streaming it line by line and keeping
+    only each container's outcome.
+    """
+    start = None
+    finish = None
+    containers = {}
+    for event in iter_events(path):
+        kind = event.get("event")
+        if kind == "start":
+            start = event
+        elif kind in ("finish", "aborted"):
+            finish = event
+        elif kind == "container":
+            containers[event["container"]] = ContainerOutcome(
+                outcome=event["outcome"],
+                pageRoute=event.get("pageRoute"),
+                seconds=event.get("seconds", 0.0),
+                message=event.get("message"),
+            )
+    return RunSummary(path, start, finish, containers)
+
+
+def log_run_summary(summary: RunSummary, slowest: int = 10) -> None:
+    start = summary.start or {}
+    finish = summary.finish
+    if finish is None:
+        status = "did not finish"
+    elif finish["event"] == "aborted":
+        status = "aborted with {error}: {message}".format(**finish)
+    else:
+        status = "finished in {seconds:.1f}s".format(
+            seconds=finish["time"] - start.get("time", finish["time"])
+        )
+    logging.warning(
+        "{path}: clroot {sha}, {status}".format(
+            path=summary.path,
+            sha=(start.get("clrootSha") or "unknown")[:10],
+            status=status,
+        )
+    )
+
+    outcomes = {}
+    for result in summary.containers.values():
+        outcomes[result.outcome] = outcomes.get(result.outcome, 0) + 1
+    logging.warning(
+        "{pages}/{total} containers got pages ({outcomes})".format(
+            pages=len(summary.pages()),
+            total=start.get("containers", len(summary.containers)),
+            outcomes=", ".join(
+                f"{number} {outcome}" for outcome, number in sorted(outcomes.items())
+            ),
+        )
+    )
+    for name, result in sorted(summary.errors().items()):
+        logging.warning(f"  {name}: {result.outcome}: {result.message}")
+    _log_slowest(summary, slowest)
+
+
+def _log_slowest(summary: RunSummary, n: int, baseline: RunSummary = None) -> None:
+    if n <= 0:
+        return
+    logging.warning(f"slowest containers in {summary.path}:")
+    for name, seconds in summary.slowest(n):
+        previous = baseline.containers.get(name) if baseline is not None else None
+        logging.warning(
+            "  {name}: {seconds:.3f}s{change}".format(
+                name=name,
+                seconds=seconds,
+                change=""
+                if previous is None
+                else " (was {seconds:.3f}s)".format(seconds=previous.seconds),
+            )
+        )
+
+
+def diff_runs(old: RunSummary, new: RunSummary, slowest: int = 10) -> dict:
+    """
+    Compares two runs and logs the pages gained, lost and moved, the errors
+    that are new, changed or fixed, and the slowest containers of the new
+    run. Returns the differences by kind, each mapping container names to
+    details.
+    """
+    oldPages = old.pages()
+    newPages = new.pages()
+    oldErrors = old.errors()
+    newErrors = new.errors()
+
+    diff = {
+        "pagesGained": {
+            name: route for name, route in newPages.items() if name not in oldPages
+        },
+        "pagesLost": {
+            name: route for name, route in oldPages.items() if name not in newPages
+        },
+        "pagesMoved": {
+            name: [oldPages[name], route]
+            for name, route in newPages.items()
+            if name in oldPages and oldPages[name] != route
+        },
+        "newErrors": {
+            name: f"{result.outcome}: {result.message}"
+            for name, result in newErrors.items()
+            if name not in oldErrors
+            or (oldErrors[name].outcome, oldErrors[name].message)
+            != (result.outcome, result.message)
+        },
+        "fixedErrors": {
+            name: f"{result.outcome}: {result.message}"
+            for name, result in oldErrors.items()
+            if name not in newErrors
+        },
+    }
+
+    logging.warning(f"comparing {old.path} -> {new.path}")
+    for kind, entries in diff.items():
+        logging.warning(f"{kind}: {len(entries)}")
+        for name, detail in sorted(entries.items()):
+            if isinstance(detail, list):
+                detail = " -> ".join(str(route) for route in detail)
+            logging.warning(f"  {name}: {detail}")
+    _log_slowest(new, slowest, baseline=old)
+
+    return diff
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from lib.instrument import phase
+
+
+class Task(NamedTuple):
+    """
+    A phase of the build. `inputs` and `outputs` name the things the phase
+    reads and produces (e.g. "clroot", "leopard_pkg"); a task only starts once
+    every task producing one of its inputs has finished. Inputs that no task
+    produces (because that phase was skipped) are taken to be ready already.
+
+    `fn` is called with the results of the finished tasks, by task name.
+    """
+
+    name: str
+    fn: Callable[[Dict[str, Any]], Any]
+    inputs: Tuple[str, ...] = ()
+    outputs: Tuple[str, ...] = ()
+
+
+class TaskTiming(NamedTuple):
+    name: str
+    start: float
+    end: float
+    dependencies: Tuple[str, ...]
+
+    @property
+    def seconds(self) -> float:
+        return self.end - self.start
+
+
+def _dependencies(tasks: List[Task]) -> Dict[str, Tuple[str, ...]]:
+    producers = {}
+    for task in tasks:
+        for output in task.outputs:
+            if output in producers:
+                raise ValueError(
+                    f"{output} is produced by both {producers[output]} and {task.name}"
+                )
+            producers[output] = task.name
+
+    return {
+        task.name: tuple(
+            dict.fromkeys(
+                producers[name] for name in task.inputs if name in producers
+            )
+        )
+        for task in tasks
+    }
+
+
+def run_tasks(
+    tasks: List[Task], workers: Optional[int] = None
+) -> Tuple[Dict[str, Any], Dict[str, TaskTiming]]:
+    """
+    Runs the tasks on a pool of `workers` threads (one per task by default),
+    starting each as soon as the tasks it depends on have finished. Ready
+    tasks are started in the order given, so with a single worker the tasks
+    run one after another in that order. The phases are I/O or subprocess
+    bound, or farm their CPU work out to processes themselves (e.g. handler
+    parsing with -j), so threads are enough to overlap them.
+
+    If a task raises, no further tasks are started; the tasks already running
+    are allowed to finish, and the first exception is re-raised as is (e.g.
+    GitException or NPMException).
+
+    Returns the result and timing of every task that ran, by task name.
+    """
+    dependencies = _dependencies(tasks)
+    remaining = list(tasks)
+    results = {}
+    timings = {}
+    starts = {}
+    failure = None
+    origin = time.perf_counter()
+
+    def run(task):
+        starts[task.name] = time.perf_counter() - origin
+        with phase(task.name):
+            return task.fn(dict(results))
+
+    with ThreadPoolExecutor(max_workers=workers or max(1, len(tasks))) as executor:
+        running = {}
+        while remaining or running:
+            if failure is None:
+                for task in list(remaining):
+                    if all(name in results for name in dependencies[task.name]):
+                        remaining.remove(task)
+                        running[executor.submit(run, task)] = task
+            elif not running:
+                break
+
+            if not running:
+                blocked = ", ".join(task.name for task in remaining)
+                raise ValueError(f"tasks can never start: {blocked}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                task = running.pop(future)
+                end = time.perf_counter() - origin
+                try:
+                    results[task.name] = future.result()
+                except Exception as e:
+                    logging.warning(f"{task.name} failed: {e}")
+                    if failure is None:
+                        failure = e
+                    continue
+                timings[task.name] = TaskTiming(
+                    name=task.name,
+                    start=starts[task.name],
+                    end=end,
+                    dependencies=dependencies[task.name],
+                )
+
+    if failure is not None:
+        raise failure
+
+    return (results, timings)
+
+
+def critical_path(timings: Dict[str, TaskTiming]) -> List[TaskTiming]:
+    """
+    Returns the chain of tasks that determined the total run time: the task
+    that finished last, preceded by whichever of its dependencies finished
+    last, and so on.
+    """
+    path = []
+    current = max(timings.values(), key=lambda timing: timing.end, default=None)
+    while current is not None:
+        path.append(current)
+        current = max(
+            (timings[name] for name in current.dependencies if name in timings),
+            key=lambda timing: timing.end,
+            default=None,
+        )
+    return list(reversed(path))
+
+
+def log_schedule(timings: Dict[str, TaskTiming]) -> None:
+    """
+    Logs out when each task ran, how much of the run was overlapped, and the
+    critical path.
+    """
+    if not timings:
+        return
+
+    for timing in sorted(timings.values(), key=lambda timing: timing.start):
+        logging.warning(
+            "{name}: {start:.1f}s - {end:.1f}s ({seconds:.1f}s)".format(
+                name=timing.name,
+                start=timing.start,
+                end=timing.end,
+                seconds=timing.seconds,
+            )
+        )
+
+    path = critical_path(timings)
+    logging.warning(
+        "phases took {total:.1f}s in total, finished in {wall:.1f}s".format(
+            total=sum(timing.seconds for timing in timings.values()),
+            wall=max(timing.end for timing in timings.values()),
+        )
+    )
+    logging.warning(
+        "critical path: {path}".format(
+            path=" -> ".join(
+                "{name} ({seconds:.1f}s)".format(
+                    name=timing.name, seconds=timing.seconds
+                )
+                for timing in path
+            )
+        )
+    )
@@ -1,147 +1,394 @@
 #!/usr/bin/env python3
 from __future__ import annotations
+from typing import Dict, Optional
 
+import hashlib
 import logging
 import os
-import shutil
 import subprocess
 
+from lib import paths
+from lib.clroot import (
+    EXPORT_DIR,
+    WORKTREE_DIR,
+    GitException,
+    checkout_clroot_worktree,
+    export_clroot,
+    record_clroot_revision,
+    run_git,
+)
+from lib.copier import copy_files, log_copy_stats
+from lib.instrument import count
+from lib.npm import (
+    DEFAULT_TTL_HOURS,
+    NPM_PACKAGES,
+    NPMException,
+    VersionResolver,
+    outdated_packages,
+)
 from lib.paths import (
     CLROOT_DIR,
-    CLROOT_PKG_DIR,
     LEOPARD_DIR,
+    LEOPARD_GENERATED_DIR,
     LEOPARD_PAGES_DIR,
     LEOPARD_PKG_DIR,
 )
 from lib.utils import removeIfExists
 
 PACKAGES = ["assets", "merchant", "toolkit", "schema"]
+SYNC_COMPARE_MODES = ["mtime", "hash"]
+COPY_MODES = ["all", "reachable"]
 
 
-class GitException(Exception):
-    pass
+def refresh_clroot(no_master_check, mode="pull", ref="master") -> str:
+    """
+    Brings the clroot files the conversion reads up to date, depending on
+    `mode`:
+
+    - pull: confirms the clroot checkout is on the master branch and pulls
+      the latest version
+    - archive: fetches `ref` and exports just the files the conversion reads
+      to lib/cache/clroot_export, leaving the checkout's working tree alone
+    - worktree: fetches `ref` and checks it out into a sparse worktree of
+      clroot in lib/cache/clroot_worktree, limited to those files
 
+    The rest of the run reads clroot from wherever the files ended up. The
+    commit used is recorded in lib/cache/clroot_revision.json and returned.
+    The git commands are run in the clroot directory rather than changing the
+    working directory, since other phases may be running at the same time.
+    """
+    if mode == "archive":
+        sha = export_clroot(ref)
+        sourceDir = EXPORT_DIR
+    elif mode == "worktree":
+        sha = checkout_clroot_worktree(ref)
+        sourceDir = WORKTREE_DIR
+    else:
+        pull_clroot(no_master_check)
+        sha = run_git(["rev-parse", "HEAD"]).strip()
+        sourceDir = CLROOT_DIR
 
-class NPMException(Exception):
-    pass
+    paths.use_clroot_source(sourceDir)
+    record_clroot_revision(mode, sha, sourceDir)
+    logging.warning(
+        "reading clroot {sha} from {dir}".format(sha=sha[:10], dir=sourceDir)
+    )
+    return sha
 
 
-def refresh_clroot(no_master_check) -> None:
+def pull_clroot(no_master_check) -> None:
     """
     Confirms clroot is on the master branch and pulls the latest version.
     """
-    prev_cwd = os.getcwd()
+    logging.warning("running git in {dir}".format(dir=CLROOT_DIR))
 
-    try:
-        logging.warning("changing directory to {dir}".format(dir=CLROOT_DIR))
-        os.chdir(CLROOT_DIR)
-        logging.warning("now in {dir}".format(dir=os.getcwd()))
-
-        if not no_master_check:
-            logging.warning("checking git is on master branch")
-            try:
-                output = subprocess.check_output(["git", "branch", "--show-current"])
-                if not output == b"master\n":
-                    raise GitException(
-                        "clroot git is not on master branch. please visit clroot directory, stash or commit any changes, and change to the master branch."
-                    )
-            except subprocess.CalledProcessError as e:
+    if not no_master_check:
+        logging.warning("checking git is on master branch")
+        try:
+            count("subprocesses spawned")
+            output = subprocess.check_output(
+                ["git", "branch", "--show-current"], cwd=CLROOT_DIR
+            )
+            if not output == b"master\n":
                 raise GitException(
-                    "git checkout master failed with error {e}".format(e=e)
+                    "clroot git is not on master branch. please visit clroot directory, stash or commit any changes, and change to the master branch."
                 )
+        except (OSError, subprocess.CalledProcessError) as e:
+            raise GitException(
+                "git checkout master failed with error {e}".format(e=e)
+            )
 
-        try:
-            subprocess.check_call(["git", "pull"])
-        except subprocess.CalledProcessError as e:
-            raise GitException("git pull failed with error {e}".format(e=e))
-    finally:
-        os.chdir(prev_cwd)
+    try:
+        count("subprocesses spawned")
+        subprocess.check_call(["git", "pull"], cwd=CLROOT_DIR)
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise GitException("git pull failed with error {e}".format(e=e))
 
 
-def clean_leopard(dryrun=True) -> None:
+def clean_leopard(dryrun=True, packages=True, pages=True) -> None:
     """
     Deletes existing packages from leopard in preperation for a clean copy.
     Currently we are copying in @assets, @merchant, @toolkit, and @schema.
+    Packages are left in place when `packages` is False, since sync_packages
+    updates them incrementally.
 
-    Also deletes the pages/demo directory to prepare for re-generating the
-    next.js pages.
+    Also deletes the pages/demo directory and the modules generated for it
+    (unless `pages` is False) to prepare for re-generating the next.js pages.
     """
     logging.warning("beginning clean (dryrun = {dryrun})".format(dryrun=dryrun))
-    for dir in [
-        "{dir}/{pkg}".format(dir=LEOPARD_PKG_DIR, pkg=pkg) for pkg in PACKAGES
-    ] + [LEOPARD_PAGES_DIR]:
+    dirs = []
+    if packages:
+        dirs += [
+            "{dir}/{pkg}".format(dir=LEOPARD_PKG_DIR, pkg=pkg) for pkg in PACKAGES
+        ]
+    if pages:
+        dirs += [LEOPARD_PAGES_DIR, LEOPARD_GENERATED_DIR]
+    for dir in dirs:
         removeIfExists(dir, dryrun=dryrun)
 
 
-def prep_leopard(dryrun=True) -> None:
+def prep_leopard(dryrun=True, keep_packages=False) -> None:
     """
     Deletes existing packages from leopard in preperation for a clean copy.
     Currently we are copying in @assets, @merchant, @toolkit, and @schema.
+    When `keep_packages` is set the packages are left for sync_packages.
 
-    Also deletes the pages/demo directory to prepare for re-generating the
-    next.js pages and re-makes a blank /demo folder.
+    The pages/demo directory is kept, since build_next_structure only rewrites
+    pages that changed and prunes stale ones; it is created if missing.
     """
-    clean_leopard(dryrun=dryrun)
+    clean_leopard(dryrun=dryrun, packages=not keep_packages, pages=False)
 
-    logging.warning("creating {dir}".format(dir=LEOPARD_PAGES_DIR))
-    if not dryrun:
-        os.mkdir(LEOPARD_PAGES_DIR)
+    if not os.path.isdir(LEOPARD_PAGES_DIR):
+        logging.warning("creating {dir}".format(dir=LEOPARD_PAGES_DIR))
+        if not dryrun:
+            os.makedirs(LEOPARD_PAGES_DIR)
 
 
-def copy2_with_logging(src, dst) -> None:
+def copy_packages(
+    dryrun=True, schema_only=False, link_mode="copy", workers=None, include=None
+) -> Dict[str, Dict[str, int]]:
     """
-    runs copy2, but first logs out what is being copied
+    Copies the required packages from clroot into leopard.
+    Currently we are copying in @assets, @merchant, @toolkit, and @schema.
+
+    Files are copied over a pool of `workers` threads, or hard linked/reflinked
+    depending on `link_mode` (see lib/copier.py).
+
+    When `include` is given, only those clroot files are copied (see
+    lib/reachable.py). Returns the size of every file left out, by path
+    relative to the package, for each package.
     """
-    logging.warning("copying {src} to {dst}".format(src=src, dst=dst))
-    shutil.copy2(src, dst)
+    excluded = {}
+    logging.warning(
+        "beginning copy (dryrun = {dryrun}, link_mode = {link_mode})".format(
+            dryrun=dryrun, link_mode=link_mode
+        )
+    )
+    if link_mode == "hardlink" and not dryrun:
+        logging.warning(
+            "hardlinked files share storage with clroot, so any edit to them outside this script is also made in clroot (the codemods copy the files they run over first)"
+        )
+
+    for pkg in ["schema"] if schema_only else PACKAGES:
+        clroot_dir = "{dir}/{pkg}".format(dir=paths.CLROOT_PKG_DIR, pkg=pkg)
+        leopard_dir = "{dir}/{pkg}".format(dir=LEOPARD_PKG_DIR, pkg=pkg)
+        logging.warning(
+            "copying {clroot_dir} to {leopard_dir}".format(
+                clroot_dir=clroot_dir, leopard_dir=leopard_dir
+            )
+        )
+        src_files = _list_files(clroot_dir)
+        if include is not None:
+            excluded[pkg] = {
+                rel_path: stat.st_size
+                for rel_path, stat in src_files.items()
+                if os.path.join(clroot_dir, rel_path) not in include
+            }
+            for rel_path in excluded[pkg]:
+                del src_files[rel_path]
+        files = [
+            (
+                os.path.join(clroot_dir, rel_path),
+                os.path.join(leopard_dir, rel_path),
+                src_files[rel_path].st_size,
+            )
+            for rel_path in sorted(src_files)
+        ]
+        if dryrun:
+            for src, dst, _ in files:
+                print("copying {src} to {dst}".format(src=src, dst=dst))
+            continue
+
+        os.makedirs(leopard_dir, exist_ok=True)
+        stats = copy_files(files, link_mode=link_mode, workers=workers, label=pkg)
+        log_copy_stats(pkg, stats)
 
+    return excluded
 
-def copy_packages(dryrun=True, schema_only=False) -> None:
+
+def _list_files(root) -> dict:
     """
-    Copies the required packages from clroot into leopard.
-    Currently we are copying in @assets, @merchant, @toolkit, and @schema.
+    Returns a dict mapping the path (relative to root) of every file under root
+    to its stat result. Symlinked directories are followed, as in copytree.
+    """
+    files = {}
+    if not os.path.isdir(root):
+        return files
+
+    for dirpath, _, filenames in os.walk(root, followlinks=True):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            files[os.path.relpath(path, root)] = os.stat(path)
+    return files
+
+
+def _file_hash(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _files_match(src, dst, src_stat, dst_stat, compare) -> bool:
+    """
+    Returns whether dst is already an up to date copy of src, comparing by size
+    and then either mtime (as preserved by copy2) or content hash.
+    """
+    if src_stat.st_size != dst_stat.st_size:
+        return False
+    if compare == "hash":
+        return _file_hash(src) == _file_hash(dst)
+    return src_stat.st_mtime_ns == dst_stat.st_mtime_ns
+
+
+def sync_package(
+    clroot_dir,
+    leopard_dir,
+    dryrun=True,
+    compare="mtime",
+    link_mode="copy",
+    workers=None,
+) -> dict:
+    """
+    Makes leopard_dir an exact copy of clroot_dir, only copying files that are
+    new or changed and deleting files that no longer exist in clroot. Returns
+    the counts of added, updated, removed, and unchanged files.
+    """
+    counts = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0}
+    src_files = _list_files(clroot_dir)
+    dst_files = _list_files(leopard_dir)
+    to_copy = []
+
+    for rel_path in sorted(src_files):
+        src = os.path.join(clroot_dir, rel_path)
+        dst = os.path.join(leopard_dir, rel_path)
+        if rel_path not in dst_files:
+            action = "added"
+        elif _files_match(src, dst, src_files[rel_path], dst_files[rel_path], compare):
+            counts["unchanged"] += 1
+            continue
+        else:
+            action = "updated"
+
+        counts[action] += 1
+        if dryrun:
+            print(
+                "{action}: copying {src} to {dst}".format(
+                    action=action, src=src, dst=dst
+                )
+            )
+            continue
+
+        to_copy.append((src, dst, src_files[rel_path].st_size))
+
+    if to_copy:
+        stats = copy_files(
+            to_copy, link_mode=link_mode, workers=workers, label=leopard_dir
+        )
+        log_copy_stats(leopard_dir, stats)
+
+    for rel_path in sorted(set(dst_files) - set(src_files)):
+        dst = os.path.join(leopard_dir, rel_path)
+        counts["removed"] += 1
+        if dryrun:
+            print("removed: removing {dst}".format(dst=dst))
+            continue
+
+        logging.warning("removing {dst}".format(dst=dst))
+        os.remove(dst)
+        count("files removed")
+
+    # clear out directories left empty by removed files
+    if not dryrun and os.path.isdir(leopard_dir):
+        for dirpath, _, _ in os.walk(leopard_dir, topdown=False):
+            rel_dir = os.path.relpath(dirpath, leopard_dir)
+            if (
+                dirpath != leopard_dir
+                and not os.listdir(dirpath)
+                and not os.path.isdir(os.path.join(clroot_dir, rel_dir))
+            ):
+                os.rmdir(dirpath)
+
+    return counts
+
+
+def sync_packages(
+    dryrun=True, schema_only=False, compare="mtime", link_mode="copy", workers=None
+) -> None:
     """
-    logging.warning("beginning copy (dryrun = {dryrun})".format(dryrun=dryrun))
+    Incrementally syncs the required packages from clroot into leopard, as an
+    alternative to prep_leopard's rmtree followed by copy_packages. Files whose
+    size and mtime (or hash, with compare="hash") match are left untouched, so
+    Next.js, TypeScript and jest caches stay valid for them.
+    """
+    logging.warning(
+        "beginning sync (dryrun = {dryrun}, compare = {compare})".format(
+            dryrun=dryrun, compare=compare
+        )
+    )
+    totals = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0}
     for pkg in ["schema"] if schema_only else PACKAGES:
-        clroot_dir = "{dir}/{pkg}".format(dir=CLROOT_PKG_DIR, pkg=pkg)
+        clroot_dir = "{dir}/{pkg}".format(dir=paths.CLROOT_PKG_DIR, pkg=pkg)
         leopard_dir = "{dir}/{pkg}".format(dir=LEOPARD_PKG_DIR, pkg=pkg)
         logging.warning(
-            "copying {clroot_dir} to {leopard_dir}".format(
+            "syncing {clroot_dir} to {leopard_dir}".format(
                 clroot_dir=clroot_dir, leopard_dir=leopard_dir
             )
         )
-        shutil.copytree(
+        counts = sync_package(
             clroot_dir,
             leopard_dir,
-            copy_function=lambda src, dst: print(
-                "copying {src} to {dst}".format(src=src, dst=dst)
-            )
-            if dryrun
-            else copy2_with_logging(src, dst),
+            dryrun=dryrun,
+            compare=compare,
+            link_mode=link_mode,
+            workers=workers,
         )
+        for action, number in counts.items():
+            totals[action] += number
+
+    logging.warning(
+        "sync {verb}: {added} added, {updated} updated, {removed} removed, {unchanged} unchanged".format(
+            verb="planned" if dryrun else "complete", **totals
+        )
+    )
 
 
-def update_npm_packages() -> None:
+def update_npm_packages(
+    ttl_hours=DEFAULT_TTL_HOURS,
+    registry=None,
+    resolver: Optional[VersionResolver] = None,
+) -> None:
     """
-    Runs the yarn commands required to update regularly updated @ContextLogic
-    packages.
+    Updates the regularly updated @ContextLogic packages to their latest
+    versions with a single yarn invocation, in the leopard directory.
+
+    The latest versions are recorded in lib/cache along with when they were
+    checked; for `ttl_hours` afterwards nothing is looked up or installed as
+    long as those versions are installed. `registry` points both the version
+    lookup and yarn at another registry, and `resolver` replaces the
+    `npm view` version lookup (see lib/npm.py).
     """
-    prev_cwd = os.getcwd()
+    outdated = outdated_packages(
+        LEOPARD_DIR,
+        NPM_PACKAGES,
+        ttl_hours=ttl_hours,
+        registry=registry,
+        resolver=resolver,
+    )
+    if not outdated:
+        return
+
+    command = ["yarn", "add", "--exact"]
+    command += [f"{pkg}@{version}" for pkg, version in outdated.items()]
+    if registry is not None:
+        command.append(f"--registry={registry}")
 
+    logging.warning(
+        "running {command} in {dir}".format(command=" ".join(command), dir=LEOPARD_DIR)
+    )
     try:
-        logging.warning("changing directory to {dir}".format(dir=LEOPARD_DIR))
-        os.chdir(LEOPARD_DIR)
-        logging.warning("now in {dir}".format(dir=os.getcwd()))
-
-        for pkg in [
-            "@ContextLogic/lego",
-            "@ContextLogic/zeus",
-            "@ContextLogic/leopardstrings",
-        ]:
-            logging.warning(f"updating {pkg}")
-            try:
-                subprocess.check_call(["yarn", "add", f"{pkg}@latest", "--exact"])
-            except subprocess.CalledProcessError as e:
-                raise NPMException(f"npm add {pkg}@latest failed with error {e}")
-    finally:
-        os.chdir(prev_cwd)
+        count("subprocesses spawned")
+        subprocess.check_call(command, cwd=LEOPARD_DIR)
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise NPMException(f"yarn add failed with error {e}")
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+from typing import Dict, List, NamedTuple, Optional
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+from lib.codemods import collect_codemod_files, run_leopard_mods
+from lib.paths import LEOPARD_PKG_DIR
+
+# what a shard writes to its output directory
+SHARD_MANIFEST = "manifest.json"
+SHARD_RESULTS = "results.jsonl"
+SHARD_PAGES_DIR = "pages"
+SHARD_PKG_DIR = "pkg"
+SHARD_CODEMODS = "codemods.json"
+
+
+class ShardException(Exception):
+    pass
+
+
+def shard_of(key: str, count: int) -> int:
+    """
+    Returns the shard (out of count) that owns key. The hash only depends on
+    the key, so every machine and python process agrees on it, unlike hash().
+    """
+    digest = hashlib.sha1(key.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % count
+
+
+class Shard(NamedTuple):
+    """
+    Shard `index` of `count`, owning the containers (by name) and pkg files
+    (by path relative to src/pkg) that hash to it.
+    """
+
+    index: int
+    count: int
+
+    def owns(self, key: str) -> bool:
+        return shard_of(key, self.count) == self.index
+
+    def __str__(self) -> str:
+        return f"{self.index}/{self.count}"
+
+
+def parse_shard(spec: str) -> Shard:
+    """
+    Parses an `i/N` shard spec, for argparse.
+    """
+    try:
+        index, count = (int(part) for part in spec.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/N, got {spec}")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"shard {spec} is out of range")
+    return Shard(index, count)
+
+
+def prepare_shard_dir(shard: Shard, outDir: str) -> None:
+    """
+    Empties outDir and records which shard it holds the output of.
+    """
+    if os.path.isdir(outDir):
+        shutil.rmtree(outDir)
+    os.makedirs(os.path.join(outDir, SHARD_PAGES_DIR))
+    with open(os.path.join(outDir, SHARD_MANIFEST), "w") as f:
+        json.dump({"shard": shard.index, "shards": shard.count}, f)
+
+
+def shard_files(
+    filesByParser: Dict[str, List[str]], shard: Shard
+) -> Dict[str, List[str]]:
+    return {
+        parser: [
+            path
+            for path in files
+            if shard.owns(os.path.relpath(path, LEOPARD_PKG_DIR))
+        ]
+        for parser, files in filesByParser.items()
+    }
+
+
+def export_shard_codemods(
+    outDir: str, filesByParser: Dict[str, List[str]], deletedImports: List[str]
+) -> None:
+    """
+    Copies the shard's files, as leopardMods left them, into outDir and
+    records them along with the files leopardMods wants deleted. Deleting
+    files needs the import graph of the whole tree, so it's left to the
+    merge.
+    """
+    relPaths = []
+    for files in filesByParser.values():
+        for path in files:
+            relPath = os.path.relpath(path, LEOPARD_PKG_DIR)
+            dst = os.path.join(outDir, SHARD_PKG_DIR, relPath)
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            shutil.copy2(path, dst)
+            relPaths.append(relPath)
+
+    with open(os.path.join(outDir, SHARD_CODEMODS), "w") as f:
+        json.dump({"files": sorted(relPaths), "deletedImports": deletedImports}, f)
+    logging.warning(
+        "exported {count} codemodded files to {dir}".format(
+            count=len(relPaths), dir=outDir
+        )
+    )
+
+
+def run_shard_codemods(shard: Shard, outDir: str, cpus: Optional[int] = None) -> None:
+    """
+    Runs leopardMods over the shard's pkg files and exports the result to
+    outDir.
+    """
+    filesByParser = shard_files(collect_codemod_files(), shard)
+    deletedImports = run_leopard_mods(filesByParser, cpus=cpus)
+    export_shard_codemods(outDir, filesByParser, deletedImports)
+
+
+def read_shard_manifest(outDir: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(outDir, SHARD_MANIFEST), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
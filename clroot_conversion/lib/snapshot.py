@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+from typing import Dict, List, NamedTuple, Optional
+
+import glob
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tarfile
+import time
+
+from lib.cache import CACHE_DIR
+from lib.clroot import clroot_source_sha
+from lib.instrument import count
+from lib.paths import (
+    LEOPARD_DIR,
+    LEOPARD_GENERATED_DIR,
+    LEOPARD_PAGES_DIR,
+    LEOPARD_PKG_DIR,
+)
+
+SNAPSHOT_DIR = "{dir}/snapshots".format(dir=CACHE_DIR)
+DEFAULT_MAX_SNAPSHOT_GB = 2.0
+# bump this whenever the snapshot layout changes
+SNAPSHOT_VERSION = 1
+
+_LIB_DIR = os.path.dirname(os.path.abspath(__file__))
+# everything that decides what the converter writes, makeLeopard.py included
+# since it decides which phases run, in what order and with what arguments
+_CONVERTER_SOURCES = [
+    "*.py",
+    "*.tmpl",
+    "codemods/*.ts",
+    "codemods/*.tsx",
+    "../makeLeopard.py",
+]
+
+
+class SnapshotLookup(NamedTuple):
+    """
+    The snapshot key for this run (None if the run can't be snapshotted) and
+    whether Leopard was restored from it.
+    """
+
+    key: Optional[str]
+    restored: bool
+
+
+def converter_hashes() -> Dict[str, str]:
+    """
+    Returns the content hash of every converter source file, by path relative
+    to lib, along with the jscodeshift version the codemods run with.
+    """
+    hashes = {}
+    for pattern in _CONVERTER_SOURCES:
+        for path in sorted(glob.glob(os.path.join(_LIB_DIR, pattern))):
+            with open(path, "rb") as f:
+                hashes[os.path.relpath(path, _LIB_DIR)] = hashlib.sha256(
+                    f.read()
+                ).hexdigest()
+
+    try:
+        with open(f"{LEOPARD_DIR}/node_modules/jscodeshift/package.json", "r") as f:
+            hashes["jscodeshift"] = json.load(f)["version"]
+    except (OSError, ValueError, KeyError):
+        pass
+    return hashes
+
+
+def snapshot_key(clrootSha: str, options: dict) -> str:
+    """
+    Returns the snapshot key for converting the given clroot commit with the
+    current converter and the given output-affecting options.
+    """
+    keyData = {
+        "version": SNAPSHOT_VERSION,
+        "clroot": clrootSha,
+        "converter": converter_hashes(),
+        "options": options,
+    }
+    return hashlib.sha256(json.dumps(keyData, sort_keys=True).encode()).hexdigest()
+
+
+def _snapshot_path(key: str) -> str:
+    return "{dir}/{key}.tar.gz".format(dir=SNAPSHOT_DIR, key=key)
+
+
+def _output_dirs(packages: List[str]) -> List[str]:
+    return [f"{LEOPARD_PKG_DIR}/{pkg}" for pkg in packages] + [
+        LEOPARD_PAGES_DIR,
+        LEOPARD_GENERATED_DIR,
+    ]
+
+
+def lookup_snapshot(packages: List[str], options: dict) -> SnapshotLookup:
+    """
+    Restores the converted packages and pages from the snapshot for this run,
+    if there is one, replacing whatever Leopard holds.
+    """
+    clrootSha = clroot_source_sha()
+    if clrootSha is None:
+        logging.warning("clroot doesn't match a commit, not snapshotting")
+        return SnapshotLookup(None, False)
+
+    key = snapshot_key(clrootSha, options)
+    path = _snapshot_path(key)
+    if not os.path.exists(path):
+        logging.warning(f"no snapshot for {key[:12]} (clroot {clrootSha[:10]})")
+        count("snapshot misses")
+        return SnapshotLookup(key, False)
+
+    start = time.perf_counter()
+    for directory in _output_dirs(packages):
+        if os.path.isdir(directory):
+            shutil.rmtree(directory)
+    # the "data" filter only exists (and is only needed) on newer pythons
+    extractArgs = {"filter": "data"} if hasattr(tarfile, "data_filter") else {}
+    with tarfile.open(path, "r:gz") as tar:
+        tar.extractall(LEOPARD_DIR, **extractArgs)
+    # the snapshot's mtime is when it was last used, for eviction
+    os.utime(path)
+    count("snapshot hits")
+    logging.warning(
+        "restored Leopard from snapshot {key} (clroot {sha}) in {seconds:.1f}s".format(
+            key=key[:12], sha=clrootSha[:10], seconds=time.perf_counter() - start
+        )
+    )
+    return SnapshotLookup(key, True)
+
+
+def evict_snapshots(maxBytes: int, keep: Optional[str] = None) -> int:
+    """
+    Deletes the least recently used snapshots until they take up at most
+    maxBytes, never deleting the snapshot for `keep`. Returns the number of
+    snapshots deleted.
+    """
+    snapshots = []
+    for path in glob.glob("{dir}/*.tar.gz".format(dir=SNAPSHOT_DIR)):
+        stat = os.stat(path)
+        snapshots.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in snapshots)
+
+    evicted = 0
+    for _, size, path in sorted(snapshots):
+        if total <= maxBytes:
+            break
+        if keep is not None and path == _snapshot_path(keep):
+            continue
+        logging.warning(f"evicting snapshot {path}")
+        os.remove(path)
+        total -= size
+        evicted += 1
+    return evicted
+
+
+def store_snapshot(lookup: SnapshotLookup, packages: List[str], maxBytes: int) -> None:
+    """
+    Snapshots the converted packages and pages under the lookup's key, unless
+    they were just restored from it, then evicts old snapshots to stay under
+    maxBytes.
+    """
+    if lookup.key is None or lookup.restored:
+        return
+
+    start = time.perf_counter()
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    path = _snapshot_path(lookup.key)
+    tmpPath = "{path}.{pid}.tmp".format(path=path, pid=os.getpid())
+    # fast compression: snapshots are written on every miss
+    with tarfile.open(tmpPath, "w:gz", compresslevel=1) as tar:
+        for directory in _output_dirs(packages):
+            if os.path.isdir(directory):
+                tar.add(directory, arcname=os.path.relpath(directory, LEOPARD_DIR))
+    os.replace(tmpPath, path)
+    logging.warning(
+        "stored snapshot {key} ({size:.1f}MB) in {seconds:.1f}s".format(
+            key=lookup.key[:12],
+            size=os.path.getsize(path) / 1024 / 1024,
+            seconds=time.perf_counter() - start,
+        )
+    )
+
+    evict_snapshots(maxBytes, keep=lookup.key)
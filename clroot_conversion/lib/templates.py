@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+from typing import Dict, Iterable
+
+import os
+from string import Template
+
+TEMPLATE_DIR = os.path.dirname(os.path.abspath(__file__))
+PAGE_PLACEHOLDERS = ("containerName", "packageName", "initialQuery")
+REQUIRED_PAGE_PLACEHOLDERS = ("containerName", "packageName")
+
+_templates: Dict[str, Template] = {}
+
+
+class TemplateError(Exception):
+    def __init__(self, templatePath, message):
+        self.templatePath = templatePath
+        self.message = message
+        super().__init__(f"{templatePath}: {message}")
+
+
+def _validate_template(
+    templatePath: str,
+    template: Template,
+    placeholders: Iterable[str],
+    required: Iterable[str],
+) -> None:
+    """
+    Checks that every placeholder in the template is one of `placeholders`,
+    that every `required` placeholder is used, and that there are no malformed
+    `$` sequences, so a bad template fails when it's registered instead of
+    partway through page generation.
+    """
+    used = set()
+    for match in template.pattern.finditer(template.template):
+        if match.group("invalid") is not None:
+            line = template.template.count("\n", 0, match.start("invalid")) + 1
+            raise TemplateError(templatePath, f"invalid placeholder on line {line}")
+
+        name = match.group("named") or match.group("braced")
+        if name is None:
+            continue
+        if name not in placeholders:
+            raise TemplateError(templatePath, f"unknown placeholder ${name}")
+        used.add(name)
+
+    missing = [name for name in required if name not in used]
+    if missing:
+        raise TemplateError(
+            templatePath, "missing placeholders {names}".format(names=missing)
+        )
+
+
+def register_template(
+    name: str,
+    templatePath: str,
+    placeholders: Iterable[str] = PAGE_PLACEHOLDERS,
+    required: Iterable[str] = REQUIRED_PAGE_PLACEHOLDERS,
+) -> Template:
+    """
+    Loads and validates the template at templatePath (relative to this lib
+    directory unless absolute) and registers it under the given name, so it
+    can be rendered for every page without re-reading it from disk.
+    """
+    if not os.path.isabs(templatePath):
+        templatePath = os.path.join(TEMPLATE_DIR, templatePath)
+
+    with open(templatePath, "r") as file:
+        template = Template(file.read())
+
+    _validate_template(templatePath, template, tuple(placeholders), tuple(required))
+    _templates[name] = template
+    return template
+
+
+def render_template(name: str, values: Dict[str, str]) -> str:
+    """
+    Renders the registered template with the given placeholder values.
+    """
+    try:
+        template = _templates[name]
+    except KeyError:
+        raise TemplateError(name, "template is not registered")
+
+    return template.substitute(values)
+
+
+register_template("page-with-data", "page-with-data.tsx.tmpl")
+register_template("page-without-data", "page-without-data.tsx.tmpl")
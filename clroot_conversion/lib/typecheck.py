@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+import hashlib
+import json
+import logging
+import os
+import re
+import subprocess
+import time
+
+from lib.cache import CACHE_DIR
+from lib.convert import ContainerPage
+from lib.importgraph import ImportGraph, scan_imports
+from lib.instrument import LOGS_DIR, count
+from lib.manifest import find_container_modules
+from lib.paths import (
+    LEOPARD_DIR,
+    LEOPARD_GENERATED_DIR,
+    LEOPARD_PAGES_DIR,
+    LEOPARD_PKG_DIR,
+)
+
+TYPECHECK_DIR = "{dir}/typecheck".format(dir=CACHE_DIR)
+TSCONFIG_PATH = "{dir}/tsconfig.json".format(dir=TYPECHECK_DIR)
+TSBUILDINFO_PATH = "{dir}/tsconfig.tsbuildinfo".format(dir=TYPECHECK_DIR)
+STATE_PATH = "{dir}/state.json".format(dir=TYPECHECK_DIR)
+# bump this whenever the saved state changes
+STATE_VERSION = 1
+
+TYPECHECK_EXTENSIONS = (".ts", ".tsx")
+
+# `path(line,col): error TS1234: message`, as printed with --pretty false
+_DIAGNOSTIC_RE = re.compile(
+    r"^(?P<path>.+?)\((?P<line>\d+),(?P<column>\d+)\): (?:error|warning) (?P<code>TS\d+): (?P<message>.*)$"
+)
+
+# `import { A, B as C } from "y"`, and `import type { ... }`
+_NAMED_IMPORT_RE = re.compile(
+    r"""\bimport\s+(?:type\s+)?\{([^}]*)\}\s*from\s*["']([^"'\n]+)["']"""
+)
+
+
+class TypecheckException(Exception):
+    pass
+
+
+class Diagnostic(NamedTuple):
+    path: str
+    line: int
+    column: int
+    code: str
+    message: str
+
+    def __str__(self) -> str:
+        return "{path}({line},{column}): {code} {message}".format(
+            path=os.path.relpath(self.path, LEOPARD_DIR),
+            line=self.line,
+            column=self.column,
+            code=self.code,
+            message=self.message,
+        )
+
+
+def _load_state() -> dict:
+    try:
+        with open(STATE_PATH, "r") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return {"files": {}, "failing": []}
+    if state.get("version") != STATE_VERSION:
+        return {"files": {}, "failing": []}
+    return state
+
+
+def _save_state(files: Dict[str, list], failing: Iterable[str]) -> None:
+    tmpPath = "{path}.{pid}.tmp".format(path=STATE_PATH, pid=os.getpid())
+    with open(tmpPath, "w") as f:
+        json.dump(
+            {"version": STATE_VERSION, "files": files, "failing": sorted(failing)}, f
+        )
+    os.replace(tmpPath, STATE_PATH)
+
+
+def _checked_roots(packages: List[str]) -> List[str]:
+    return [f"{LEOPARD_PKG_DIR}/{pkg}" for pkg in packages] + [
+        LEOPARD_PAGES_DIR,
+        LEOPARD_GENERATED_DIR,
+    ]
+
+
+def file_versions(packages: List[str], saved: Dict[str, list]) -> Dict[str, list]:
+    """
+    Returns the [mtime, size, content hash] of every .ts/.tsx file the
+    conversion writes: the packages, the pages and the modules generated for
+    them. Files whose mtime and size match `saved` aren't rehashed.
+    """
+    versions = {}
+    for root in _checked_roots(packages):
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if not filename.endswith(TYPECHECK_EXTENSIONS):
+                    continue
+                path = os.path.join(dirpath, filename)
+                stat = os.stat(path)
+                signature = [stat.st_mtime_ns, stat.st_size]
+                previous = saved.get(path)
+                if previous is not None and previous[:2] == signature:
+                    versions[path] = previous
+                    continue
+                with open(path, "rb") as f:
+                    digest = hashlib.sha256(f.read()).hexdigest()
+                versions[path] = signature + [digest]
+    return versions
+
+
+def _named_imports(path: str) -> Dict[str, List[str]]:
+    """
+    Returns the names the given file imports from each module with
+    `import { A, B as C } from "..."` declarations.
+    """
+    with open(path, "r", errors="replace") as f:
+        source = f.read()
+    names = {}
+    for imported, specifier in _NAMED_IMPORT_RE.findall(source):
+        names.setdefault(specifier, []).extend(
+            name.split()[0] for name in imported.split(",") if name.strip()
+        )
+    return names
+
+
+def _container_modules(
+    indexPath: str, graph: ImportGraph, cache: Dict[str, Optional[dict]]
+) -> Optional[Dict[str, Optional[str]]]:
+    """
+    Returns the file of each container a package's container index
+    re-exports, or None if indexPath isn't a container index.
+    """
+    if indexPath not in cache:
+        parts = os.path.relpath(indexPath, LEOPARD_PKG_DIR).split(os.sep)
+        if (
+            len(parts) == 3
+            and parts[1] == "container"
+            and parts[2].startswith("index.")
+            and os.path.exists(indexPath)
+        ):
+            cache[indexPath] = {
+                containerName: graph.resolve(specifier, importer=indexPath)
+                for containerName, specifier in find_container_modules(
+                    indexPath
+                ).items()
+            }
+        else:
+            cache[indexPath] = None
+    return cache[indexPath]
+
+
+def _page_dependencies(
+    path: str, graph: ImportGraph, containerModules: Dict[str, Optional[dict]]
+) -> Tuple[Set[str], Set[str]]:
+    """
+    Returns the files a page or generated module imports, and separately the
+    container indexes it imports containers from by name. Those stand for
+    the modules of the containers imported instead: an index imports every
+    container, so any container changing affects it, but only its own
+    changes affect the page. Pages live outside the pkg graph, so their
+    relative imports are resolved by hand.
+    """
+    namedImports = _named_imports(path)
+    dependencies = set()
+    indexes = set()
+    for specifier in scan_imports(path):
+        if specifier.startswith("./") or specifier.startswith("../"):
+            base = os.path.normpath(os.path.join(os.path.dirname(path), specifier))
+            dependencies.update(base + suffix for suffix in TYPECHECK_EXTENSIONS)
+            continue
+        target = graph.resolve(specifier)
+        if target is None:
+            continue
+        modules = _container_modules(target, graph, containerModules)
+        names = namedImports.get(specifier)
+        if modules is not None and names and all(map(modules.get, names)):
+            indexes.add(target)
+            dependencies.update(modules[name] for name in names)
+        else:
+            dependencies.add(target)
+    return (dependencies, indexes)
+
+
+def typecheck_scope(
+    versions: Dict[str, list],
+    state: dict,
+    graph: ImportGraph,
+) -> Tuple[Set[str], Set[str]]:
+    """
+    Returns the files that need checking, and the ones among them that were
+    created or changed since the last check: the changed files, every file
+    that (transitively) imports a changed or deleted one, and the files that
+    failed the last check, so their errors are reported until they're fixed.
+    """
+    saved = state["files"]
+    changed = {
+        path
+        for path, version in versions.items()
+        if path not in saved or saved[path][2] != version[2]
+    }
+    deleted = set(saved) - set(versions)
+
+    affected = changed | deleted
+    affected |= graph.dependents_closure(affected)
+    # the pages and generated modules are outside the graph. the pages can
+    # import the generated modules, so those are looked at first
+    outside = [
+        path for path in versions if not path.startswith(LEOPARD_PKG_DIR + os.sep)
+    ]
+    containerModules = {}
+    for path in sorted(
+        outside, key=lambda path: (path.startswith(LEOPARD_PAGES_DIR), path)
+    ):
+        dependencies, indexes = _page_dependencies(path, graph, containerModules)
+        if path in changed or dependencies & affected or indexes & (changed | deleted):
+            affected.add(path)
+
+    scope = {path for path in affected | set(state["failing"]) if path in versions}
+    return (scope, changed)
+
+
+def _ambient_declarations() -> List[str]:
+    """
+    Returns Leopard's .d.ts files, which declare modules and globals without
+    being imported, so every check needs them.
+    """
+    declarations = [
+        os.path.join(LEOPARD_DIR, filename)
+        for filename in sorted(os.listdir(LEOPARD_DIR))
+        if filename.endswith(".d.ts")
+    ]
+    for dirpath, dirnames, filenames in os.walk(os.path.join(LEOPARD_DIR, "src")):
+        dirnames.sort()
+        declarations += [
+            os.path.join(dirpath, filename)
+            for filename in sorted(filenames)
+            if filename.endswith(".d.ts")
+        ]
+    return declarations
+
+
+def write_tsconfig(files: Iterable[str]) -> None:
+    """
+    Writes a tsconfig extending Leopard's that only has the given files (and
+    the ambient declarations) as roots, checked incrementally against the
+    .tsbuildinfo in lib/cache/typecheck.
+    """
+    os.makedirs(TYPECHECK_DIR, exist_ok=True)
+    with open(TSCONFIG_PATH, "w") as f:
+        json.dump(
+            {
+                "extends": f"{LEOPARD_DIR}/tsconfig.json",
+                "compilerOptions": {
+                    "incremental": True,
+                    "noEmit": True,
+                    "tsBuildInfoFile": TSBUILDINFO_PATH,
+                },
+                "files": sorted(set(files) | set(_ambient_declarations())),
+                "include": [],
+            },
+            f,
+            indent=2,
+        )
+
+
+def run_tsc() -> List[Diagnostic]:
+    """
+    Runs tsc over the scoped tsconfig and returns its diagnostics.
+    """
+    command = ["npx", "tsc", "-p", TSCONFIG_PATH, "--pretty", "false"]
+    count("subprocesses spawned")
+    try:
+        result = subprocess.run(
+            command, stdout=subprocess.PIPE, cwd=LEOPARD_DIR, text=True
+        )
+    except OSError as e:
+        raise TypecheckException(f"tsc failed with error {e}")
+
+    diagnostics = []
+    for line in result.stdout.splitlines():
+        match = _DIAGNOSTIC_RE.match(line)
+        if match is not None:
+            diagnostics.append(
+                Diagnostic(
+                    path=os.path.normpath(os.path.join(LEOPARD_DIR, match["path"])),
+                    line=int(match["line"]),
+                    column=int(match["column"]),
+                    code=match["code"],
+                    message=match["message"],
+                )
+            )
+        elif line.startswith(" ") and diagnostics:
+            # the rest of a multi-line message
+            last = diagnostics[-1]
+            diagnostics[-1] = last._replace(message=last.message + "\n" + line)
+        elif line.strip():
+            logging.warning(f"tsc: {line}")
+
+    # 1 and 2 mean there were errors, anything else that tsc itself failed
+    if result.returncode not in (0, 1, 2) or (result.returncode and not diagnostics):
+        raise TypecheckException(f"tsc failed with exit code {result.returncode}")
+    return diagnostics
+
+
+def container_files(
+    graph: ImportGraph, pages: Optional[Dict[str, ContainerPage]]
+) -> Dict[str, Set[str]]:
+    """
+    Returns the files each container's page is built from: the container's
+    module and everything it imports, plus its page unless other containers
+    share it. Without the pages (when Leopard was restored from a snapshot)
+    only the containers' modules are known.
+    """
+    indexPath = f"{LEOPARD_PKG_DIR}/merchant/container/index.ts"
+    modules = find_container_modules(indexPath) if os.path.exists(indexPath) else {}
+
+    pagePaths = {}
+    if pages is not None:
+        for containerName, page in pages.items():
+            if page.pagePath is not None:
+                pagePaths.setdefault(page.pagePath, []).append(containerName)
+
+    files = {}
+    for containerName, specifier in modules.items():
+        module = graph.resolve(specifier, importer=indexPath)
+        files[containerName] = graph.reachable_from([module]) if module else set()
+    for pagePath, containerNames in pagePaths.items():
+        if len(containerNames) == 1:
+            files.setdefault(containerNames[0], set()).add(pagePath)
+    return files
+
+
+def _write_report(byContainer: Dict[str, List[Diagnostic]], checked: int) -> str:
+    os.makedirs(LOGS_DIR, exist_ok=True)
+    reportPath = "{dir}/typecheck_{uid}.json".format(
+        dir=LOGS_DIR, uid=round(time.time())
+    )
+    with open(reportPath, "w") as f:
+        json.dump(
+            {
+                "checked": checked,
+                "containers": {
+                    containerName: [diagnostic._asdict() for diagnostic in diagnostics]
+                    for containerName, diagnostics in sorted(byContainer.items())
+                },
+            },
+            f,
+            indent=2,
+        )
+    return reportPath
+
+
+def run_typecheck(
+    packages: List[str], pages: Optional[Dict[str, ContainerPage]] = None
+) -> Dict[str, List[Diagnostic]]:
+    """
+    Type checks the files this run created or changed (pages, copied or
+    synced package files and codemod edits alike, found by comparing their
+    content to the last check) and every file importing them, with an
+    incremental tsc over a tsconfig scoped to those files. The diagnostics
+    are logged grouped by the containers whose pages they break, and written
+    to lib/logs/typecheck_<timestamp>.json. Returns them by container, with
+    the ones in files no container uses under "".
+    """
+    state = _load_state()
+    versions = file_versions(packages, state["files"])
+    graph = ImportGraph(LEOPARD_PKG_DIR).update(
+        assumeExisting=set(state["files"]) - set(versions)
+    )
+    scope, changed = typecheck_scope(versions, state, graph)
+    if not scope:
+        logging.warning("typecheck: nothing changed since the last check")
+        return {}
+
+    logging.warning(
+        "typecheck: checking {scope} files ({changed} changed since the last check)".format(
+            scope=len(scope), changed=len(changed)
+        )
+    )
+    write_tsconfig(scope)
+    start = time.perf_counter()
+    diagnostics = run_tsc()
+    seconds = time.perf_counter() - start
+    count("files type checked", len(scope))
+    count("type errors", len(diagnostics))
+    _save_state(versions, {diagnostic.path for diagnostic in diagnostics})
+
+    containersByFile = {}
+    for containerName, files in container_files(graph, pages).items():
+        for path in files:
+            containersByFile.setdefault(path, []).append(containerName)
+    byContainer = {}
+    for diagnostic in diagnostics:
+        for containerName in containersByFile.get(diagnostic.path, [""]):
+            byContainer.setdefault(containerName, []).append(diagnostic)
+
+    for containerName, containerDiagnostics in sorted(byContainer.items()):
+        logging.warning(
+            "{name}: {errors} type errors".format(
+                name=containerName or "files outside any container",
+                errors=len(containerDiagnostics),
+            )
+        )
+        for diagnostic in containerDiagnostics:
+            logging.warning(f"  {diagnostic}")
+    logging.warning(
+        "typecheck: {errors} errors, {containers} containers affected, in {seconds:.1f}s; see {path}".format(
+            errors=len(diagnostics),
+            containers=len([name for name in byContainer if name]),
+            seconds=seconds,
+            path=_write_report(byContainer, len(scope)),
+        )
+    )
+    return byContainer
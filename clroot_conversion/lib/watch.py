@@ -0,0 +1,567 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import shutil
+import struct
+import time
+
+from lib import paths
+from lib.codemods import run_incremental_codemods
+from lib.convert import (
+    ContainerPage,
+    build_container_page,
+    build_handler_index,
+    extract_all_handlers,
+    find_container_names,
+    parseRoutesFile,
+)
+from lib.copier import copy_file
+from lib.importgraph import ImportGraph
+from lib.instrument import phase
+from lib.paths import LEOPARD_PAGES_DIR, LEOPARD_PKG_DIR
+from lib.routes import RouteTable
+
+DEFAULT_DEBOUNCE_SECONDS = 0.5
+DEFAULT_POLL_SECONDS = 1.0
+
+# inotify(7) event masks
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ISDIR = 0x40000000
+_WATCH_MASK = (
+    _IN_MODIFY
+    | _IN_CLOSE_WRITE
+    | _IN_MOVED_FROM
+    | _IN_MOVED_TO
+    | _IN_CREATE
+    | _IN_DELETE
+    | _IN_DELETE_SELF
+    | _IN_MOVE_SELF
+)
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class WatchUnavailable(Exception):
+    pass
+
+
+def _file_signatures(roots: List[str], files: List[str]) -> Dict[str, Tuple[int, int]]:
+    """
+    Returns the mtime and size of every file under roots, and of the given
+    single files that exist.
+    """
+    signatures = {}
+    candidates = list(files)
+    for root in roots:
+        for dirpath, _, filenames in os.walk(root):
+            candidates += [os.path.join(dirpath, name) for name in filenames]
+    for path in candidates:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        signatures[path] = (stat.st_mtime_ns, stat.st_size)
+    return signatures
+
+
+class InotifyWatcher:
+    """
+    Watches directory trees (and single files) for changes with inotify,
+    called through ctypes. Directories created under a watched tree are
+    watched as they appear.
+    """
+
+    def __init__(self, roots: List[str], files: List[str]):
+        libcName = ctypes.util.find_library("c")
+        try:
+            self._libc = ctypes.CDLL(libcName, use_errno=True)
+            self._libc.inotify_init1
+        except (OSError, AttributeError, TypeError) as e:
+            raise WatchUnavailable(f"inotify is not available: {e}")
+
+        self._fd = self._libc.inotify_init1(os.O_CLOEXEC)
+        if self._fd < 0:
+            raise WatchUnavailable(os.strerror(ctypes.get_errno()))
+        self._dirs: Dict[int, str] = {}
+        self._roots = roots
+        # single files are watched through their directory
+        self._files = set(files)
+        self._fileDirs = {os.path.dirname(path) for path in files}
+        self.overflowed = False
+
+        try:
+            for root in roots:
+                self._watch_tree(root)
+            for directory in self._fileDirs:
+                self._watch(directory)
+        except WatchUnavailable:
+            self.close()
+            raise
+
+    def _watch(self, directory: str) -> None:
+        wd = self._libc.inotify_add_watch(
+            self._fd, os.fsencode(directory), _WATCH_MASK
+        )
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error == errno.ENOSPC:
+                raise WatchUnavailable(
+                    "out of inotify watches (see fs.inotify.max_user_watches)"
+                )
+            if error != errno.ENOENT:
+                raise WatchUnavailable(f"{directory}: {os.strerror(error)}")
+            return
+        self._dirs[wd] = directory
+
+    def _watch_tree(self, root: str) -> List[str]:
+        """
+        Watches root and every directory under it, returning the files found
+        (which may have been written before the watch started).
+        """
+        found = []
+        for dirpath, _, filenames in os.walk(root):
+            self._watch(dirpath)
+            found += [os.path.join(dirpath, filename) for filename in filenames]
+        return found
+
+    def _read_events(self, timeout: Optional[float]) -> Set[str]:
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set()
+
+        changed = set()
+        data = os.read(self._fd, 1 << 16)
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+
+            if mask & _IN_Q_OVERFLOW:
+                # directories created since may have been missed too
+                self.overflowed = True
+                for root in self._roots:
+                    self._watch_tree(root)
+                continue
+            if mask & _IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+            directory = self._dirs.get(wd)
+            if directory is None or not name:
+                continue
+
+            path = os.path.join(directory, os.fsdecode(name))
+            if directory in self._fileDirs and path not in self._files:
+                continue
+            changed.add(path)
+            if mask & _IN_ISDIR and mask & (_IN_CREATE | _IN_MOVED_TO):
+                changed.update(self._watch_tree(path))
+        return changed
+
+    def wait(self, debounce: float) -> Set[str]:
+        """
+        Blocks until something changes, then keeps collecting changes until
+        none arrive for `debounce` seconds, so a burst of changes (e.g. a git
+        checkout) is returned as one batch of paths.
+        """
+        changed = set()
+        while not changed:
+            changed = self._read_events(None)
+        while True:
+            more = self._read_events(debounce)
+            if not more:
+                return changed
+            changed |= more
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+class PollingWatcher:
+    """
+    Watches directory trees (and single files) by comparing the mtime and size
+    of every file every `interval` seconds. Used where inotify isn't
+    available.
+    """
+
+    def __init__(self, roots: List[str], files: List[str], interval: float):
+        self._roots = roots
+        self._files = files
+        self._interval = interval
+        self.overflowed = False
+        self._snapshot = self._scan()
+
+    def _scan(self) -> Dict[str, Tuple[int, int]]:
+        return _file_signatures(self._roots, self._files)
+
+    def _changes(self) -> Set[str]:
+        snapshot = self._scan()
+        changed = {
+            path
+            for path in set(snapshot) | set(self._snapshot)
+            if snapshot.get(path) != self._snapshot.get(path)
+        }
+        self._snapshot = snapshot
+        return changed
+
+    def wait(self, debounce: float) -> Set[str]:
+        changed = set()
+        while not changed:
+            time.sleep(self._interval)
+            changed = self._changes()
+        while True:
+            time.sleep(max(debounce, self._interval))
+            more = self._changes()
+            if not more:
+                return changed
+            changed |= more
+
+    def close(self) -> None:
+        pass
+
+
+def make_watcher(
+    roots: List[str], files: List[str], poll: Optional[float] = None
+) -> "InotifyWatcher | PollingWatcher":
+    """
+    Returns an inotify watcher for the given trees and files, or a polling one
+    if `poll` is set or inotify isn't available.
+    """
+    if poll is None:
+        try:
+            return InotifyWatcher(roots, files)
+        except WatchUnavailable as e:
+            logging.warning(f"{e}, polling for changes instead")
+    return PollingWatcher(roots, files, poll or DEFAULT_POLL_SECONDS)
+
+
+def _is_under(path: str, root: str) -> bool:
+    return path == root or path.startswith(root + os.sep)
+
+
+class IncrementalBuild:
+    """
+    The state of a finished conversion run, kept in memory so a change in
+    clroot only redoes the work it affects: the route table, the container to
+    handler index, the page built for each container, Leopard's import graph,
+    the files the codemods removed, and the mtime and size of each package
+    file as last synced, to find the changes a watcher missed.
+    """
+
+    def __init__(
+        self,
+        packages: List[str],
+        routeTable: RouteTable,
+        handlerIndex: Dict[str, List[str]],
+        pages: Dict[str, ContainerPage],
+        removed: Set[str],
+        link_mode: str = "copy",
+        codemod_cpus: Optional[int] = None,
+    ):
+        self.packages = packages
+        self.routeTable = routeTable
+        self.handlerIndex = handlerIndex
+        self.pages = pages
+        self.removed = removed
+        self.link_mode = link_mode
+        self.codemod_cpus = codemod_cpus
+        self.graph = ImportGraph(LEOPARD_PKG_DIR).update(assumeExisting=removed)
+        self.synced = _file_signatures(self._package_roots(), [])
+
+    def _package_roots(self) -> List[str]:
+        return [os.path.join(paths.CLROOT_PKG_DIR, pkg) for pkg in self.packages]
+
+    def watched(self) -> Tuple[List[str], List[str]]:
+        """
+        Returns the clroot trees and single files the build depends on.
+        """
+        roots = self._package_roots()
+        roots.append(paths.CLROOT_HANDLERS_DIR)
+        files = [
+            os.path.join(paths.CLROOT_SOURCE_DIR, path)
+            for path in paths.CLROOT_URI_SPEC_PATHS
+        ]
+        return (roots, files)
+
+    def _sync_files(self, changed: Iterable[str]) -> List[str]:
+        """
+        Mirrors the changed clroot package paths into Leopard, copying files
+        that exist (including everything in new directories) and removing
+        ones that don't. Returns the Leopard paths of the copied files.
+        """
+        sources = set()
+        for src in changed:
+            if os.path.isdir(src):
+                for dirpath, _, filenames in os.walk(src):
+                    sources.update(os.path.join(dirpath, name) for name in filenames)
+            else:
+                sources.add(src)
+
+        copied = []
+        for src in sorted(sources):
+            dst = os.path.join(
+                LEOPARD_PKG_DIR, os.path.relpath(src, paths.CLROOT_PKG_DIR)
+            )
+            if os.path.isfile(src):
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                stat = os.stat(src)
+                copy_file(src, dst, stat.st_size, self.link_mode)
+                self.synced[src] = (stat.st_mtime_ns, stat.st_size)
+                copied.append(dst)
+                continue
+
+            for path in [path for path in self.synced if _is_under(path, src)]:
+                del self.synced[path]
+            if os.path.isdir(dst):
+                logging.warning(f"removing {dst}")
+                shutil.rmtree(dst)
+            elif os.path.lexists(dst):
+                logging.warning(f"removing {dst}")
+                os.remove(dst)
+        return copied
+
+    def _unsynced_files(self) -> Set[str]:
+        """
+        Returns the clroot package files created, changed or deleted since
+        they were last synced.
+        """
+        signatures = _file_signatures(self._package_roots(), [])
+        return {
+            path
+            for path in set(signatures) | set(self.synced)
+            if signatures.get(path) != self.synced.get(path)
+        }
+
+    def _rebuild_handler_index(self) -> Set[str]:
+        """
+        Rebuilds the handler index from scratch. Returns every container in
+        it before or after, since any of their handler files may have
+        changed.
+        """
+        handlerIndex = build_handler_index(paths.CLROOT_HANDLERS_DIR)
+        affected = set(self.handlerIndex) | set(handlerIndex)
+        self.handlerIndex = handlerIndex
+        return affected
+
+    def _reindex_handlers(self, changed: Iterable[str]) -> Set[str]:
+        """
+        Re-extracts the changed handler files and updates the index. Returns
+        the containers they declared before or after the change.
+        """
+        affected = set()
+        handlerPaths = set()
+        for path in changed:
+            if os.path.isdir(path):
+                for dirpath, _, filenames in os.walk(path):
+                    handlerPaths.update(
+                        os.path.join(dirpath, name)
+                        for name in filenames
+                        if name.endswith(".py")
+                    )
+            elif path.endswith(".py"):
+                handlerPaths.add(path)
+            else:
+                # a removed directory
+                handlerPaths.update(
+                    handlerPath
+                    for handlerPathList in self.handlerIndex.values()
+                    for handlerPath in handlerPathList
+                    if _is_under(handlerPath, path)
+                )
+
+        for containerName, handlerPathList in list(self.handlerIndex.items()):
+            if handlerPaths.intersection(handlerPathList):
+                affected.add(containerName)
+                remaining = [p for p in handlerPathList if p not in handlerPaths]
+                if remaining:
+                    self.handlerIndex[containerName] = remaining
+                else:
+                    del self.handlerIndex[containerName]
+
+        existing = sorted(path for path in handlerPaths if os.path.isfile(path))
+        for handlerPath, records in zip(existing, extract_all_handlers(existing)):
+            for containerName in dict.fromkeys(r.containerName for r in records):
+                affected.add(containerName)
+                handlerPathList = self.handlerIndex.setdefault(containerName, [])
+                handlerPathList.append(handlerPath)
+                handlerPathList.sort()
+        return affected
+
+    def _reparse_routes(self) -> Set[str]:
+        """
+        Rebuilds the route table. Returns the containers whose handler's route
+        changed.
+        """
+        routeTable = RouteTable()
+        for file in paths.CLROOT_URI_SPEC_PATHS:
+            parseRoutesFile(os.path.join(paths.CLROOT_SOURCE_DIR, file), routeTable)
+        routeTable.verify()
+
+        before = {
+            route.handlerName: (route.pattern, route.pagePath)
+            for route in self.routeTable.routes()
+        }
+        after = {
+            route.handlerName: (route.pattern, route.pagePath)
+            for route in routeTable.routes()
+        }
+        changedHandlers = {
+            name
+            for name in set(before) | set(after)
+            if before.get(name) != after.get(name)
+        }
+        self.routeTable = routeTable
+        return {
+            containerName
+            for containerName, page in self.pages.items()
+            if page.handlerName in changedHandlers
+        }
+
+    def _rebuild_pages(self, containerNames: Iterable[str]) -> Dict[str, int]:
+        counts = {"created": 0, "updated": 0, "unchanged": 0, "deleted": 0}
+        current = set(
+            find_container_names(
+                "{dir}/merchant/container/index.ts".format(dir=LEOPARD_PKG_DIR)
+            )
+        )
+        oldPagePaths = set()
+        for containerName in sorted(containerNames):
+            old = self.pages.pop(containerName, None)
+            if old is not None and old.pagePath is not None:
+                oldPagePaths.add(old.pagePath)
+            if containerName not in current:
+                continue
+
+            page = build_container_page(
+                containerName, self.routeTable, self.handlerIndex
+            )
+            self.pages[containerName] = page
+            if page.pagePath is not None:
+                counts[page.status] += 1
+
+        livePagePaths = {page.pagePath for page in self.pages.values()}
+        for pagePath in sorted(oldPagePaths - livePagePaths):
+            if os.path.exists(pagePath):
+                logging.warning(f"removing stale page {pagePath}")
+                os.remove(pagePath)
+                counts["deleted"] += 1
+            directory = os.path.dirname(pagePath)
+            while (
+                directory != LEOPARD_PAGES_DIR
+                and os.path.isdir(directory)
+                and not os.listdir(directory)
+            ):
+                os.rmdir(directory)
+                directory = os.path.dirname(directory)
+        return counts
+
+    def rebuild(self, changed: Set[str], resync: bool = False) -> None:
+        """
+        Redoes the parts of the build affected by the changed clroot paths.
+        With `resync`, for when the watcher may have missed changes, the
+        package files that changed since they were last synced are synced
+        too, and the handler index and route table are rebuilt from scratch.
+        """
+        _, specFiles = self.watched()
+        pkgChanges = {
+            path for path in changed if _is_under(path, paths.CLROOT_PKG_DIR)
+        }
+        handlerChanges = {
+            path for path in changed if _is_under(path, paths.CLROOT_HANDLERS_DIR)
+        }
+        routesChanged = any(path in specFiles for path in changed)
+        affected = set()
+        if resync:
+            with phase("resync"):
+                pkgChanges |= self._unsynced_files()
+            routesChanged = True
+
+        if pkgChanges:
+            with phase("sync"):
+                copied = self._sync_files(pkgChanges)
+            logging.warning(f"synced {len(pkgChanges)} changed package paths")
+            codemodFiles = [path for path in copied if path.endswith((".ts", ".tsx"))]
+            if codemodFiles:
+                with phase("codemods"):
+                    self.removed = run_incremental_codemods(
+                        codemodFiles, self.graph, self.removed, cpus=self.codemod_cpus
+                    )
+            # containers may have been added to or removed from the index
+            containerNames = set(
+                find_container_names(
+                    "{dir}/merchant/container/index.ts".format(dir=LEOPARD_PKG_DIR)
+                )
+            )
+            affected |= containerNames.symmetric_difference(self.pages)
+
+        if resync:
+            with phase("index_handlers"):
+                affected |= self._rebuild_handler_index()
+        elif handlerChanges:
+            with phase("index_handlers"):
+                affected |= self._reindex_handlers(handlerChanges)
+        if routesChanged:
+            with phase("parse_routes"):
+                affected |= self._reparse_routes()
+
+        if affected:
+            counts = self._rebuild_pages(affected)
+            logging.warning(
+                "PAGES: {created} created, {updated} updated, {unchanged} unchanged, {deleted} deleted".format(
+                    **counts
+                )
+            )
+
+
+def watch_clroot(
+    build: IncrementalBuild,
+    debounce: float = DEFAULT_DEBOUNCE_SECONDS,
+    poll: Optional[float] = None,
+) -> None:
+    """
+    Watches clroot's packages, handlers and uri_spec files and incrementally
+    rebuilds after each (debounced) batch of changes, until interrupted.
+    """
+    roots, files = build.watched()
+    watcher = make_watcher(roots, files, poll=poll)
+    logging.warning(
+        "watching {count} clroot directories and files for changes ({kind}), press ctrl-c to stop".format(
+            count=len(roots) + len(files), kind=type(watcher).__name__
+        )
+    )
+    try:
+        while True:
+            changed = watcher.wait(debounce)
+            resync = watcher.overflowed
+            if resync:
+                logging.warning(
+                    "inotify dropped events, resyncing the packages and re-reading all handlers and routes"
+                )
+                watcher.overflowed = False
+
+            start = time.perf_counter()
+            with phase("watch_rebuild"):
+                build.rebuild(changed, resync=resync)
+            logging.warning(
+                "rebuilt {count} changed paths in {seconds:.2f}s".format(
+                    count=len(changed), seconds=time.perf_counter() - start
+                )
+            )
+    finally:
+        watcher.close()
@@ -2,16 +2,77 @@
 from __future__ import annotations
 
 import argparse
+import logging
 
 from lib.setup import (
+    PACKAGES,
     clean_leopard,
     prep_leopard,
     refresh_clroot,
     copy_packages,
+    sync_packages,
     update_npm_packages,
+    SYNC_COMPARE_MODES,
+    COPY_MODES,
+)
+from lib.clroot import REFRESH_MODES
+from lib.copier import LINK_MODES
+from lib.npm import DEFAULT_TTL_HOURS
+from lib.cache import CACHE_DIR, configure_cache, log_cache_stats
+from lib.convert import build_next_structure, scan_clroot
+from lib.manifest import DEFAULT_PAGE_MODE, PAGE_MODES
+from lib.instrument import (
+    configure_instrumentation,
+    log_phase_summary,
+    phase,
+    write_trace,
 )
-from lib.convert import build_next_structure
 from lib.codemods import run_codemods
+from lib.merge import merge_shards
+from lib.reachable import clroot_container_index, copy_reachable_packages
+from lib.scheduler import Task, log_schedule, run_tasks
+from lib.shard import (
+    SHARD_PAGES_DIR,
+    SHARD_RESULTS,
+    parse_shard,
+    prepare_shard_dir,
+    run_shard_codemods,
+)
+from lib.snapshot import DEFAULT_MAX_SNAPSHOT_GB, lookup_snapshot, store_snapshot
+from lib.typecheck import run_typecheck
+from lib.watch import DEFAULT_DEBOUNCE_SECONDS, IncrementalBuild, watch_clroot
+
+PHASES = [
+    "clean_leopard",
+    "refresh_clroot",
+    "prep_leopard",
+    "copy_packages",
+    "sync_packages",
+    "copy_reachable_packages",
+    "update_npm_packages",
+    "scan_clroot",
+    "build_next_structure",
+    "run_codemods",
+    "merge_shards",
+    "lookup_snapshot",
+    "store_snapshot",
+    "typecheck",
+]
+
+
+def unless_restored(fn):
+    """
+    Wraps a task so it's skipped when Leopard was restored from a snapshot.
+    """
+
+    def run(results):
+        lookup = results.get("lookup_snapshot")
+        if lookup is not None and lookup.restored:
+            logging.warning("restored from snapshot, skipping")
+            return None
+        return fn(results)
+
+    return run
 
 
 def main(
@@ -23,40 +84,292 @@ def main(
     schema_only,
     skip_npm_refresh,
     no_master_check,
+    no_parse_cache,
+    purge_parse_cache,
+    jobs,
+    sync,
+    sync_compare,
+    link_mode,
+    copy_workers,
+    codemod_cpus,
+    profile,
+    serial,
+    npm_ttl,
+    npm_registry,
+    refresh_mode,
+    clroot_ref,
+    watch,
+    watch_debounce,
+    watch_poll,
+    shard,
+    shard_dir,
+    merge_shard_dirs,
+    no_snapshot_cache,
+    snapshot_cache_gb,
+    page_mode,
+    copy_mode,
+    typecheck,
 ) -> int:
-    if clean_only:
-        clean_leopard(dryrun=False)
-        if schema_only:
-            copy_packages(dryrun=False, schema_only=True)
-        return 0
+    configure_cache(enabled=not no_parse_cache, purge=purge_parse_cache)
+    configure_instrumentation(profile_phase=profile)
 
-    if schema_only:
-        copy_packages(dryrun=False, schema_only=True)
-        return 0
+    try:
+        if clean_only:
+            with phase("clean_leopard"):
+                clean_leopard(dryrun=False)
+            if schema_only:
+                with phase("copy_packages"):
+                    copy_packages(dryrun=False, schema_only=True)
+            return 0
 
-    if codemods_only:
-        run_codemods()
-        return 0
+        if schema_only:
+            with phase("copy_packages"):
+                copy_packages(dryrun=False, schema_only=True)
+            return 0
 
-    if not skip_refresh:
-        refresh_clroot(no_master_check=no_master_check)
+        if codemods_only:
+            with phase("run_codemods"):
+                run_codemods(cpus=codemod_cpus)
+            return 0
 
-    prep_leopard(dryrun=prep_dryrun)
-    if prep_dryrun:
-        return 0
+        tasks = []
+        if not skip_refresh:
+            tasks.append(
+                Task(
+                    "refresh_clroot",
+                    lambda results: refresh_clroot(
+                        no_master_check=no_master_check,
+                        mode=refresh_mode,
+                        ref=clroot_ref,
+                    ),
+                    outputs=("clroot",),
+                )
+            )
+        tasks.append(
+            Task(
+                "prep_leopard",
+                lambda results: prep_leopard(dryrun=prep_dryrun, keep_packages=sync),
+                outputs=("leopard_clean",),
+            )
+        )
 
-    copy_packages(dryrun=copy_dryrun)
-    if copy_dryrun:
-        return 0
+        # in the reachable copy mode, the packages are copied once the pages
+        # are built, since only what they import is copied
+        reachable = copy_mode == "reachable"
+        if not (prep_dryrun or reachable):
+            if sync:
+                tasks.append(
+                    Task(
+                        "sync_packages",
+                        unless_restored(
+                            lambda results: sync_packages(
+                                dryrun=copy_dryrun,
+                                compare=sync_compare,
+                                link_mode=link_mode,
+                                workers=copy_workers,
+                            )
+                        ),
+                        inputs=("clroot", "leopard_clean", "snapshot"),
+                        outputs=("leopard_pkg",),
+                    )
+                )
+            else:
+                tasks.append(
+                    Task(
+                        "copy_packages",
+                        unless_restored(
+                            lambda results: copy_packages(
+                                dryrun=copy_dryrun,
+                                link_mode=link_mode,
+                                workers=copy_workers,
+                            )
+                        ),
+                        inputs=("clroot", "leopard_clean", "snapshot"),
+                        outputs=("leopard_pkg",),
+                    )
+                )
 
-    if not skip_npm_refresh:
-        update_npm_packages()
+        if merge_shard_dirs and not (prep_dryrun or copy_dryrun):
+            tasks.append(
+                Task(
+                    "merge_shards",
+                    lambda results: merge_shards(merge_shard_dirs),
+                    inputs=("leopard_pkg",),
+                )
+            )
+        elif shard is not None and not (prep_dryrun or copy_dryrun):
+            if shard_dir is None:
+                shard_dir = "{dir}/shards/{index}_of_{count}".format(
+                    dir=CACHE_DIR, index=shard.index, count=shard.count
+                )
+            prepare_shard_dir(shard, shard_dir)
+            if not skip_npm_refresh:
+                tasks.append(
+                    Task(
+                        "update_npm_packages",
+                        lambda results: update_npm_packages(
+                            ttl_hours=npm_ttl, registry=npm_registry
+                        ),
+                        outputs=("node_modules",),
+                    )
+                )
+            tasks += [
+                Task(
+                    "scan_clroot",
+                    lambda results: scan_clroot(jobs=jobs),
+                    inputs=("clroot",),
+                    outputs=("clroot_scan",),
+                ),
+                Task(
+                    "build_next_structure",
+                    lambda results: build_next_structure(
+                        clrootScan=results["scan_clroot"],
+                        shard=shard,
+                        pagesDir=f"{shard_dir}/{SHARD_PAGES_DIR}",
+                        runLogPath=f"{shard_dir}/{SHARD_RESULTS}",
+                    ),
+                    inputs=("leopard_pkg", "clroot_scan"),
+                    outputs=("pages",),
+                ),
+                Task(
+                    "run_codemods",
+                    lambda results: run_shard_codemods(
+                        shard, shard_dir, cpus=codemod_cpus
+                    ),
+                    # the pages are built from the container index leopardMods
+                    # rewrites
+                    inputs=("leopard_pkg", "pages", "node_modules"),
+                ),
+            ]
+        elif not (prep_dryrun or copy_dryrun):
+            if not skip_npm_refresh:
+                tasks.append(
+                    Task(
+                        "update_npm_packages",
+                        lambda results: update_npm_packages(
+                            ttl_hours=npm_ttl, registry=npm_registry
+                        ),
+                        outputs=("node_modules",),
+                    )
+                )
+            # the output only depends on the clroot commit, the converter and
+            # these options, so it can be restored from an earlier run's
+            # snapshot instead of rebuilt
+            snapshotOptions = {
+                "packages": PACKAGES,
+                "pageMode": page_mode,
+                "copyMode": copy_mode,
+                "linkMode": link_mode,
+            }
+            if not (no_snapshot_cache or watch):
+                tasks.append(
+                    Task(
+                        "lookup_snapshot",
+                        lambda results: lookup_snapshot(PACKAGES, snapshotOptions),
+                        inputs=("clroot", "leopard_clean"),
+                        outputs=("snapshot",),
+                    )
+                )
+            tasks += [
+                Task(
+                    "scan_clroot",
+                    unless_restored(lambda results: scan_clroot(jobs=jobs)),
+                    inputs=("clroot", "snapshot"),
+                    outputs=("clroot_scan",),
+                ),
+                Task(
+                    "build_next_structure",
+                    unless_restored(
+                        lambda results: build_next_structure(
+                            clrootScan=results["scan_clroot"],
+                            pageMode=page_mode,
+                            containerIndexPath=clroot_container_index()
+                            if reachable
+                            else None,
+                        )
+                    ),
+                    inputs=(
+                        "leopard_clean" if reachable else "leopard_pkg",
+                        "clroot_scan",
+                    ),
+                    outputs=("pages",),
+                ),
+                Task(
+                    "run_codemods",
+                    unless_restored(lambda results: run_codemods(cpus=codemod_cpus)),
+                    inputs=("leopard_pkg", "pages", "node_modules"),
+                    outputs=("leopard_converted",),
+                ),
+            ]
+            if reachable:
+                tasks.append(
+                    Task(
+                        "copy_reachable_packages",
+                        unless_restored(
+                            lambda results: copy_reachable_packages(
+                                results["build_next_structure"],
+                                link_mode=link_mode,
+                                workers=copy_workers,
+                            )
+                        ),
+                        inputs=("pages", "snapshot"),
+                        outputs=("leopard_pkg",),
+                    )
+                )
+            if typecheck:
+                tasks.append(
+                    Task(
+                        "typecheck",
+                        lambda results: run_typecheck(
+                            PACKAGES, pages=results["build_next_structure"]
+                        ),
+                        inputs=("leopard_converted",),
+                    )
+                )
+            if not (no_snapshot_cache or watch):
+                tasks.append(
+                    Task(
+                        "store_snapshot",
+                        lambda results: store_snapshot(
+                            results["lookup_snapshot"],
+                            PACKAGES,
+                            maxBytes=int(snapshot_cache_gb * 1024**3),
+                        ),
+                        inputs=("leopard_converted",),
+                    )
+                )
 
-    build_next_structure()
+        results, timings = run_tasks(tasks, workers=1 if serial else None)
+        log_schedule(timings)
+        if prep_dryrun or copy_dryrun:
+            return 0
 
-    run_codemods()
+        log_cache_stats()
+        if shard is not None:
+            logging.warning(f"wrote shard {shard} output to {shard_dir}")
 
-    return 0
+        if watch:
+            routeTable, handlerIndex = results["scan_clroot"]
+            build = IncrementalBuild(
+                PACKAGES,
+                routeTable,
+                handlerIndex,
+                pages=results["build_next_structure"],
+                removed=results["run_codemods"],
+                link_mode=link_mode,
+                codemod_cpus=codemod_cpus,
+            )
+            try:
+                watch_clroot(build, debounce=watch_debounce, poll=watch_poll)
+            except KeyboardInterrupt:
+                logging.warning("stopped watching")
+
+        return 0
+    finally:
+        log_phase_summary()
+        tracePath = write_trace()
+        if tracePath is not None:
+            logging.warning(f"wrote phase timings to {tracePath}")
 
 
 if __name__ == "__main__":
@@ -69,6 +382,17 @@ if __name__ == "__main__":
         help="skip pulling the latest version of the clroot master branch",
         action="store_true",
     )
+    parser.add_argument(
+        "--refresh-mode",
+        help="how clroot is refreshed: pull the clroot checkout (default; it must be on master), fetch and export only the files the conversion reads with git archive, or check them out into a dedicated sparse worktree. archive and worktree never touch the clroot working tree",
+        choices=REFRESH_MODES,
+        default="pull",
+    )
+    parser.add_argument(
+        "--clroot-ref",
+        help="branch or commit to export or check out with --refresh-mode archive/worktree (default: %(default)s)",
+        default="master",
+    )
     parser.add_argument(
         "-p",
         "--prep-dryrun",
@@ -102,11 +426,189 @@ if __name__ == "__main__":
         help="skip refreshing @ContextLogic npm packages. This process takes a bit of time and only needs to be run daily, so skipping it is useful when repeatedly running the script for development purposes",
         action="store_true",
     )
+    parser.add_argument(
+        "--npm-ttl",
+        help="hours to trust the last lookup of the latest @ContextLogic package versions before asking the registry again (default %(default)s, 0 always checks)",
+        type=float,
+        default=DEFAULT_TTL_HOURS,
+    )
+    parser.add_argument(
+        "--npm-registry",
+        help="registry URL to look up and install the @ContextLogic packages from (default: npm's configured registry)",
+        default=None,
+    )
     parser.add_argument(
         "-g",
         "--no-master-check",
         help="skip the check that clroot is on the master branch",
         action="store_true",
     )
+    parser.add_argument(
+        "--no-parse-cache",
+        help="bypass the on-disk cache of parsed handler and route files, re-parsing every file",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--purge-parse-cache",
+        help="delete the on-disk cache of parsed handler and route files before running",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        help="number of processes to parse clroot handler files with (default 1)",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--sync",
+        help="incrementally sync the clroot packages into leopard instead of deleting and re-copying them, only copying new or changed files and removing deleted ones (can be combined with --copy-dryrun to print the planned operations)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--sync-compare",
+        help="how --sync decides a file is unchanged: matching size and mtime (default), or matching content hash",
+        choices=SYNC_COMPARE_MODES,
+        default="mtime",
+    )
+    parser.add_argument(
+        "--link-mode",
+        help="how package files are brought into leopard: a regular copy (default), a hard link to the clroot file, or a copy-on-write reflink. the codemods replace the hard links of the .ts/.tsx files with copies before rewriting them, so hardlink only saves copying the other files; editing a hard linked file by hand also changes clroot",
+        choices=LINK_MODES,
+        default="copy",
+    )
+    parser.add_argument(
+        "--copy-workers",
+        help="number of threads used to copy package files (default: python's ThreadPoolExecutor default)",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--codemod-cpus",
+        help="number of jscodeshift workers used to run the codemods (default: jscodeshift's default)",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--profile",
+        help="run the given phase under cProfile and dump its stats to lib/logs (phase timings are always written to lib/logs/trace_<timestamp>.json)",
+        choices=PHASES,
+        default=None,
+    )
+    parser.add_argument(
+        "--serial",
+        help="run the phases one at a time instead of overlapping the ones that don't depend on each other (clroot refresh, npm refresh, clroot parsing and package copying)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-w",
+        "--watch",
+        help="after the run, keep watching clroot's packages, handlers and uri_spec files and incrementally re-sync changed files and regenerate affected pages until interrupted",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--watch-debounce",
+        help="seconds without changes to wait before rebuilding, so a burst of changes (e.g. a git checkout) causes a single rebuild (default %(default)s)",
+        type=float,
+        default=DEFAULT_DEBOUNCE_SECONDS,
+    )
+    parser.add_argument(
+        "--watch-poll",
+        help="poll for changes every this many seconds instead of using inotify",
+        type=float,
+        default=None,
+    )
+    parser.add_argument(
+        "--shard",
+        help="only build the pages of shard i of N (e.g. 0/4) and only run leopardMods over its pkg files, writing both to --shard-dir instead of Leopard. containers and files are split between shards by a stable hash of their names; combine the shards with --merge-shards",
+        type=parse_shard,
+        default=None,
+    )
+    parser.add_argument(
+        "--shard-dir",
+        help="where --shard writes its output (default: lib/cache/shards/<i>_of_<N>)",
+        default=None,
+    )
+    parser.add_argument(
+        "--merge-shards",
+        help="instead of building pages and running the codemods, copy the packages and merge the output of every --shard run into Leopard, the same as an unsharded run would leave it",
+        dest="merge_shard_dirs",
+        metavar="SHARD_DIR",
+        nargs="+",
+        default=None,
+    )
+    parser.add_argument(
+        "--no-snapshot-cache",
+        help="always convert, instead of restoring the converted packages and pages from the snapshot of an earlier run with the same clroot commit, converter code and options (snapshots are kept in lib/cache/snapshots)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--snapshot-cache-gb",
+        help="size the snapshot cache is kept under, evicting the least recently used snapshots (default %(default)s)",
+        type=float,
+        default=DEFAULT_MAX_SNAPSHOT_GB,
+    )
+    parser.add_argument(
+        "--page-mode",
+        help="files: write a page per container; manifest: write a single catch-all page that lazily loads each container from a generated route manifest, so Next.js compiles one page instead of hundreds (default: %(default)s)",
+        choices=PAGE_MODES,
+        default=DEFAULT_PAGE_MODE,
+    )
+    parser.add_argument(
+        "--copy-mode",
+        help="all: copy the packages wholesale; reachable: build the pages first, then copy only the files the containers that got pages transitively import (plus .d.ts files), logging how many files and bytes were left out (default: %(default)s)",
+        choices=COPY_MODES,
+        default="all",
+    )
+    parser.add_argument(
+        "-t",
+        "--typecheck",
+        help="after converting, type check the files that changed since the last check and every file importing them, with an incremental tsc (its state is kept in lib/cache/typecheck), reporting the errors by container",
+        action="store_true",
+    )
     args = parser.parse_args()
+    if (args.shard is not None or args.merge_shard_dirs) and (
+        args.watch or args.clean_only or args.codemods_only or args.schema_only
+    ):
+        parser.error("--shard and --merge-shards need a full run")
+    if args.shard is not None and args.merge_shard_dirs:
+        parser.error("--shard and --merge-shards can't be combined")
+    if args.watch and (
+        args.prep_dryrun
+        or args.copy_dryrun
+        or args.clean_only
+        or args.codemods_only
+        or args.schema_only
+    ):
+        parser.error("--watch needs a full run")
+    if args.page_mode == "manifest" and (
+        args.watch or args.shard is not None or args.merge_shard_dirs
+    ):
+        parser.error("--page-mode manifest doesn't support --watch or sharding")
+    if args.copy_mode == "reachable" and (
+        args.sync
+        or args.watch
+        or args.shard is not None
+        or args.merge_shard_dirs
+        or args.prep_dryrun
+        or args.copy_dryrun
+        or args.clean_only
+        or args.codemods_only
+        or args.schema_only
+    ):
+        parser.error(
+            "--copy-mode reachable needs a full run, without --sync, --watch or sharding"
+        )
+    if args.typecheck and (
+        args.shard is not None
+        or args.merge_shard_dirs
+        or args.prep_dryrun
+        or args.copy_dryrun
+        or args.clean_only
+        or args.codemods_only
+        or args.schema_only
+    ):
+        parser.error("--typecheck needs a full, unsharded run")
+    if args.watch and args.refresh_mode != "pull":
+        parser.error("--watch only watches the clroot checkout (--refresh-mode pull)")
     raise SystemExit(main(**vars(args)))
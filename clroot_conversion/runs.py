@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+
+from lib.runlog import diff_runs, list_runs, log_run_summary, summarize_run
+
+
+def main(args) -> int:
+    runs = list_runs()
+
+    if args.command == "list":
+        for path in runs:
+            summary = summarize_run(path)
+            logging.warning(
+                "{path}: {pages}/{containers} pages, {errors} errors{finished}".format(
+                    path=path,
+                    pages=len(summary.pages()),
+                    containers=len(summary.containers),
+                    errors=len(summary.errors()),
+                    finished="" if summary.finish is not None else " (did not finish)",
+                )
+            )
+        return 0
+
+    needed = 1 if args.command == "show" else 2
+    given = args.runs
+    if len(given) < needed:
+        # default to the latest runs
+        if len(runs) < needed - len(given):
+            logging.warning(f"need {needed} run logs in lib/logs, found {len(runs)}")
+            return 1
+        given = given + runs[len(runs) - (needed - len(given)) :]
+    if len(given) != needed:
+        logging.warning(f"{args.command} takes at most {needed} run logs")
+        return 1
+
+    if args.command == "show":
+        log_run_summary(summarize_run(given[0]), slowest=args.slowest)
+        return 0
+
+    diff = diff_runs(
+        summarize_run(given[0]), summarize_run(given[1]), slowest=args.slowest
+    )
+    if args.json:
+        print(json.dumps(diff, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Inspects the run logs build_next_structure writes to lib/logs/run_<timestamp>_<pid>.jsonl. Run logs are streamed, so this stays cheap for large runs.",
+    )
+    parser.add_argument(
+        "command",
+        help="list: summarize every run log; show: summarize one run (default: the latest); diff: compare two runs (default: the latest two, or the one given against the latest)",
+        choices=["list", "show", "diff"],
+    )
+    parser.add_argument("runs", help="run log paths", nargs="*")
+    parser.add_argument(
+        "--slowest",
+        help="number of slowest containers to show",
+        type=int,
+        default=10,
+    )
+    parser.add_argument(
+        "--json",
+        help="also print the diff as JSON",
+        action="store_true",
+    )
+    args = parser.parse_args()
+
+    raise SystemExit(main(args))
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+import os
+import sys
+
+import pytest
+
+# the tests import the converter's modules the way makeLeopard.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.cache import configure_cache  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def no_parse_cache():
+    """
+    Keeps the tests from reading or writing lib/cache.
+    """
+    configure_cache(enabled=False)
+    yield
+    configure_cache(enabled=True)
+
+
+def write_files(root, files):
+    """
+    Writes each {relative path: contents} in files under root.
+    """
+    for relPath, contents in files.items():
+        path = os.path.join(str(root), relPath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(contents)
@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+from conftest import write_files
+from lib import cache
+
+
+def test_purge_only_removes_parsed_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, "CACHE_DIR", str(tmp_path))
+    write_files(
+        tmp_path,
+        {
+            "handlers/a.json": "[]",
+            "routes/b.json": "{}",
+            "snapshots/c.tar.gz": "",
+            "shards/0of2/results.jsonl": "",
+            "clroot_revision.json": "{}",
+        },
+    )
+
+    cache.configure_cache(enabled=False, purge=True)
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "clroot_revision.json",
+        "shards",
+        "snapshots",
+    ]
+    assert (tmp_path / "shards/0of2/results.jsonl").exists()
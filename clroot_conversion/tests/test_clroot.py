@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+import subprocess
+
+from conftest import write_files
+from lib import clroot, paths
+
+
+def _git(repo, *args):
+    return subprocess.check_output(
+        ["git", "-c", "user.name=test", "-c", "user.email=test@example.com"]
+        + list(args),
+        cwd=str(repo),
+        text=True,
+    ).strip()
+
+
+def test_clroot_source_sha_is_the_checked_out_commit(tmp_path, monkeypatch):
+    monkeypatch.setattr(paths, "CLROOT_DIR", str(tmp_path))
+    monkeypatch.setattr(paths, "CLROOT_SOURCE_DIR", str(tmp_path))
+    monkeypatch.setattr(clroot, "clroot_read_paths", lambda: ["pkg"])
+    _git(tmp_path, "init", "-q")
+    write_files(tmp_path, {"pkg/a.ts": "a"})
+    _git(tmp_path, "add", "-A")
+    _git(tmp_path, "commit", "-q", "-m", "first")
+    first = _git(tmp_path, "rev-parse", "HEAD")
+    write_files(tmp_path, {"pkg/a.ts": "b"})
+    _git(tmp_path, "commit", "-q", "-am", "second")
+
+    # as with --skip-refresh after checking out an older commit
+    _git(tmp_path, "checkout", "-q", first)
+    assert clroot.clroot_source_sha() == first
+
+    write_files(tmp_path, {"pkg/a.ts": "edited"})
+    assert clroot.clroot_source_sha() is None
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+import os
+
+from conftest import write_files
+from lib import codemods
+from lib.importgraph import scan_import_declarations
+
+
+def test_scan_import_declarations_skips_reexports_and_requires(tmp_path):
+    write_files(
+        tmp_path,
+        {
+            "a.ts": "\n".join(
+                [
+                    'import A from "./a";',
+                    "import {",
+                    "  B,",
+                    '} from "../b";',
+                    'import "./side";',
+                    'export { default } from "./reexport";',
+                    'export * from "./star";',
+                    'const c = require("./required");',
+                    'const d = import("./dynamic");',
+                    'import e = require("./equals");',
+                ]
+            )
+        },
+    )
+    assert scan_import_declarations(str(tmp_path / "a.ts")) == [
+        "./a",
+        "../b",
+        "./side",
+    ]
+
+
+def test_remove_deleted_files_only_follows_imports_of_deleted_files(
+    tmp_path, monkeypatch
+):
+    pkgDir = str(tmp_path / "pkg")
+    monkeypatch.setattr(codemods, "LEOPARD_PKG_DIR", pkgDir)
+    monkeypatch.setattr(codemods, "LOADABLE_DIR", f"{pkgDir}/toolkit/loadable")
+    write_files(
+        pkgDir,
+        {
+            "merchant/component/Deleted.tsx": "export default 1;",
+            "merchant/component/ImportsDeleted.tsx": 'import Deleted from "./Deleted";',
+            "merchant/container/ImportsImporter.tsx": 'import X from "@merchant/component/ImportsDeleted";',
+            "merchant/component/ReexportsDeleted.ts": 'export { default } from "./Deleted";',
+            "merchant/component/RequiresDeleted.ts": 'const d = require("./Deleted");',
+            "merchant/stores/UserStore.ts": "export default 1;",
+            "merchant/stores/index.ts": 'export { default as UserStore } from "./UserStore";',
+            "merchant/container/UsesStore.tsx": 'import UserStore from "../stores/UserStore";',
+            "merchant/container/UsesStoreIndex.tsx": 'import { UserStore } from "@merchant/stores";',
+            "toolkit/loadable/index.ts": "export default 1;",
+            "merchant/component/Lazy.tsx": 'import loadable from "@toolkit/loadable";',
+        },
+    )
+
+    removed = codemods.remove_deleted_files(["@merchant/component/Deleted"])
+
+    remaining = {
+        os.path.relpath(os.path.join(dirpath, filename), pkgDir)
+        for dirpath, _, filenames in os.walk(pkgDir)
+        for filename in filenames
+    }
+    assert remaining == {
+        "merchant/component/ReexportsDeleted.ts",
+        "merchant/component/RequiresDeleted.ts",
+        "merchant/stores/index.ts",
+        "merchant/container/UsesStore.tsx",
+        "merchant/container/UsesStoreIndex.tsx",
+        "merchant/component/Lazy.tsx",
+    }
+    assert {
+        f"{pkgDir}/merchant/component/Deleted.tsx",
+        f"{pkgDir}/merchant/component/ImportsDeleted.tsx",
+        f"{pkgDir}/merchant/container/ImportsImporter.tsx",
+        f"{pkgDir}/merchant/stores/UserStore.ts",
+        f"{pkgDir}/toolkit/loadable/index.ts",
+    } <= removed
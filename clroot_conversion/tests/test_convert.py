@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+import resource
+
+import pytest
+
+from conftest import write_files
+from lib import convert, instrument
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_extract_all_handlers_counts_worker_files(tmp_path, monkeypatch, jobs):
+    monkeypatch.setattr(convert, "_handlerRecordCache", {})
+    monkeypatch.setattr(instrument, "_counters", {})
+    write_files(
+        tmp_path,
+        {
+            "a.py": 'AHandler = Handler(container="AContainer", package="merchant")\n',
+            # python 2, read from its tokens
+            "b.py": 'print "b"\nBHandler = Handler(container="BContainer", package="merchant")\n',
+            "c.py": 'print "c"\nCHandler = Handler(container="CContainer", package="merchant")\n',
+        },
+    )
+    paths = [str(tmp_path / name) for name in ("a.py", "b.py", "c.py")]
+
+    records = convert.extract_all_handlers(paths, jobs=jobs)
+
+    assert [[record.containerName for record in file] for file in records] == [
+        ["AContainer"],
+        ["BContainer"],
+        ["CContainer"],
+    ]
+    assert instrument._counters["handler files parsed"] == 3
+    assert instrument._counters["handler files read from tokens"] == 2
+
+
+def test_extract_all_handlers_closes_mappings(tmp_path, monkeypatch):
+    monkeypatch.setattr(convert, "_handlerRecordCache", {})
+    handlerPaths = []
+    for index in range(300):
+        path = tmp_path / f"handler{index}.py"
+        path.write_text(
+            f'H{index} = Handler(container="C{index}Container", package="merchant")\n'
+        )
+        handlerPaths.append(str(path))
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (200, hard))
+    try:
+        records = convert.extract_all_handlers(handlerPaths)
+    finally:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+
+    assert [file[0].containerName for file in records] == [
+        f"C{index}Container" for index in range(300)
+    ]
+
+
+def test_large_handler_files_parse_in_part_or_whole(tmp_path, monkeypatch):
+    monkeypatch.setattr(convert, "_handlerRecordCache", {})
+    monkeypatch.setattr(instrument, "_counters", {})
+    monkeypatch.setattr(convert, "LARGE_HANDLER_FILE_BYTES", 10)
+    write_files(
+        tmp_path,
+        {
+            # python 2 outside the handler statement
+            "part.py": 'print "x"\nAHandler = Handler(container="AContainer", package="merchant")\n',
+            # the statement ends inside a multi-line string
+            "whole.py": 'DOC = """\nBHandler = Handler(container="BContainer",\n"""\n'
+            'CHandler = Handler(container="CContainer", package="merchant")\n',
+        },
+    )
+
+    records = convert.extract_all_handlers(
+        [str(tmp_path / "part.py"), str(tmp_path / "whole.py")]
+    )
+
+    assert [[record.containerName for record in file] for file in records] == [
+        ["AContainer"],
+        ["CContainer"],
+    ]
+    assert instrument._counters["large handler files parsed in part"] == 1
+    assert instrument._counters["large handler files parsed whole"] == 1
@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+import os
+
+import pytest
+
+from lib import copier
+
+
+@pytest.mark.parametrize("sendfileCopies", [True, False])
+def test_copy_file_falls_back_when_nothing_is_copied(
+    tmp_path, monkeypatch, sendfileCopies
+):
+    monkeypatch.setattr(copier, "_copyFileRangeSupported", True)
+    monkeypatch.setattr(os, "copy_file_range", lambda *args: 0, raising=False)
+    if not sendfileCopies:
+        monkeypatch.setattr(copier, "_sendfileSupported", True)
+        monkeypatch.setattr(os, "sendfile", lambda *args: 0, raising=False)
+    src = tmp_path / "src"
+    src.write_bytes(b"contents" * 1000)
+
+    copier.copy_file(str(src), str(tmp_path / "dst"), os.path.getsize(src))
+
+    assert (tmp_path / "dst").read_bytes() == b"contents" * 1000
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+import os
+import signal
+import threading
+import time
+
+import pytest
+
+from lib import instrument
+from lib.instrument import phase
+
+
+def _events(name):
+    return [event for event in instrument._events if event["name"] == name]
+
+
+def test_process_cpu_is_only_recorded_for_phases_without_overlap():
+    with phase("test_alone"):
+        sum(range(100000))
+    (alone,) = _events("test_alone")
+    assert alone["args"]["process_cpu_ms"] is not None
+
+    started = threading.Barrier(2)
+
+    def run(name):
+        with phase(name):
+            started.wait()
+
+    threads = [
+        threading.Thread(target=run, args=(name,))
+        for name in ("test_first", "test_second")
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for name in ("test_first", "test_second"):
+        (event,) = _events(name)
+        assert event["args"]["process_cpu_ms"] is None
+        assert instrument._summary[name]["overlapped"] == 1
+    assert instrument._openPhases == {}
+
+
+
+def test_nested_phases_are_closed_by_identity():
+    started = threading.Event()
+    release = threading.Event()
+
+    def other():
+        with phase("test_other"):
+            started.set()
+            release.wait()
+
+    thread = threading.Thread(target=other)
+    try:
+        with phase("test_outer"):
+            with phase("test_inner"):
+                pass
+            thread.start()
+            started.wait()
+    finally:
+        release.set()
+        thread.join()
+
+    (outer,) = _events("test_outer")
+    (inner,) = _events("test_inner")
+    assert outer["args"]["process_cpu_ms"] is None
+    assert inner["args"]["process_cpu_ms"] is not None
+    assert instrument._openPhases == {}
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork")
+def test_forked_children_dont_inherit_a_held_lock():
+    held = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with instrument._lock:
+            held.set()
+            release.wait()
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    try:
+        held.wait()
+        pid = os.fork()
+        if pid == 0:
+            instrument.count("test counter")
+            os._exit(0)
+        deadline = time.monotonic() + 10
+        while True:
+            finished, status = os.waitpid(pid, os.WNOHANG)
+            if finished or time.monotonic() > deadline:
+                break
+            time.sleep(0.01)
+        if not finished:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+    finally:
+        release.set()
+        thread.join()
+
+    assert finished and os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
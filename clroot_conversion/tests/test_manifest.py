@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+from conftest import write_files
+from lib.importgraph import ImportGraph
+from lib.manifest import find_container_modules
+
+
+def test_find_container_modules_aliases_relative_modules(tmp_path):
+    write_files(
+        tmp_path,
+        {
+            "pkg/merchant/container/index.ts": (
+                'export { default as FooContainer } from "./Foo";\n'
+                'export { default as BarContainer } from "../component/Bar";\n'
+                'export { default as BazContainer } from "@merchant/component/Baz";\n'
+                'export { default as OutContainer } from "../../../Out";\n'
+            ),
+            "pkg/merchant/container/Foo.tsx": "",
+            "pkg/merchant/component/Bar.tsx": "",
+            "pkg/merchant/component/Baz.tsx": "",
+        },
+    )
+    indexPath = str(tmp_path / "pkg/merchant/container/index.ts")
+
+    modules = find_container_modules(indexPath)
+
+    assert modules == {
+        "FooContainer": "@merchant/container/Foo",
+        "BarContainer": "@merchant/component/Bar",
+        "BazContainer": "@merchant/component/Baz",
+    }
+    # the aliases resolve to the same files wherever they're imported from
+    graph = ImportGraph(str(tmp_path / "pkg")).update()
+    assert {name: graph.resolve(module) for name, module in modules.items()} == {
+        "FooContainer": str(tmp_path / "pkg/merchant/container/Foo.tsx"),
+        "BarContainer": str(tmp_path / "pkg/merchant/component/Bar.tsx"),
+        "BazContainer": str(tmp_path / "pkg/merchant/component/Baz.tsx"),
+    }
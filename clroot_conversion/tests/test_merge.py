@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+import json
+
+import pytest
+
+from conftest import write_files
+from lib import clroot, merge, paths
+from lib.shard import SHARD_RESULTS, ShardException
+
+
+def _write_shard(shardDir, **start):
+    start.setdefault("clrootSha", "abc123")
+    start.setdefault("containers", 0)
+    events = [dict(start, event="start"), {"event": "finish"}]
+    write_files(
+        shardDir,
+        {SHARD_RESULTS: "".join(json.dumps(event) + "\n" for event in events)},
+    )
+    return str(shardDir)
+
+
+def test_clroot_tree_sha_changes_with_local_edits(tmp_path, monkeypatch):
+    monkeypatch.setattr(paths, "CLROOT_SOURCE_DIR", str(tmp_path))
+    monkeypatch.setattr(clroot, "clroot_read_paths", lambda: ["pkg", "handlers"])
+    write_files(tmp_path, {"pkg/a.ts": "a", "handlers/b.py": "b", "other/c": "c"})
+    before = clroot.clroot_tree_sha()
+
+    write_files(tmp_path, {"other/c": "edited"})
+    assert clroot.clroot_tree_sha() == before
+    write_files(tmp_path, {"pkg/a.ts": "edited"})
+    assert clroot.clroot_tree_sha() != before
+
+
+@pytest.mark.parametrize(
+    "trees, message",
+    [
+        ((None, "tree"), "didn't record"),
+        (("tree", "other"), "different clroot files$"),
+        (("other", "other"), "than this run's"),
+    ],
+)
+def test_merge_pages_refuses_shards_of_other_trees(tmp_path, trees, message):
+    shardDirs = [
+        _write_shard(tmp_path / f"shard{index}", clrootTree=tree)
+        for index, tree in enumerate(trees)
+    ]
+
+    with pytest.raises(ShardException, match=message):
+        merge._merge_pages(shardDirs, "tree")
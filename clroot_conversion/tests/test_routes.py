@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+import pytest
+
+from lib.routes import RouteTable, example_url, to_page_path
+
+
+@pytest.mark.parametrize(
+    "pattern, expected",
+    [
+        (r"/", ("/index", ())),
+        (r"^/orders/?$", ("/orders", ())),
+        (r"/product/(\d+)", ("/product/[param1]", ("param1",))),
+        (r"/product/(?P<id>[^/]+)/edit", ("/product/[id]/edit", ("id",))),
+        (
+            r"/a/(?P<first>\d+)/(\d+)",
+            ("/a/[first]/[param2]", ("first", "param2")),
+        ),
+        (r"/files/(.*)", ("/files/[[...param1]]", ("param1",))),
+        (r"/files/(.+)", ("/files/[...param1]", ("param1",))),
+        (r"/files/.*", ("/files/[[...path]]", ("path",))),
+        # a `.*` mid-path can't be a catch-all, so it's a single segment
+        (r"/files/.*/edit", ("/files/[path]/edit", ("path",))),
+        (r"/files/(.*)/edit", ("/files/[param1]/edit", ("param1",))),
+        # an unescaped `.` in literal text is a literal dot
+        (r"/robots.txt", ("/robots.txt", ())),
+        (r"^/foo/bar.json$", ("/foo/bar.json", ())),
+        (r"/foo/bar\.json", ("/foo/bar.json", ())),
+        (r"/files/./edit", (None, ())),
+        # groups mixed with literal text within a segment
+        (r"/sku/(\w+)-(\d+)", (None, ())),
+        (r"/v(\d+)/orders", (None, ())),
+        (r"/a/(\d+)?", (None, ())),
+        (r"orders", (None, ())),
+    ],
+)
+def test_to_page_path(pattern, expected):
+    assert to_page_path(pattern) == expected
+
+
+def test_unnamed_groups_share_the_name_at_their_level():
+    routes = RouteTable()
+    routes.add("A", r"/product/(\d+)")
+    edit = routes.add("B", r"/product/(\d+)/edit/(\d+)")
+    assert edit.pagePath == "/product/[param1]/edit/[param2]"
+
+
+def test_named_groups_keep_their_name():
+    routes = RouteTable()
+    routes.add("A", r"/product/(\d+)")
+    routes.add("B", r"/product/(\d+)/reviews")
+    routes.add("C", r"/product/(?P<id>\d+)/edit")
+    routes.add("D", r"/product/(\w+)/history")
+
+    assert {route.handlerName: route.pagePath for route in routes.routes()} == {
+        "A": "/product/[id]",
+        "B": "/product/[id]/reviews",
+        "C": "/product/[id]/edit",
+        "D": "/product/[id]/history",
+    }
+    assert routes.route_for_handler("A").params == ("id",)
+
+
+def test_different_named_groups_at_the_same_level_skip_the_later_route():
+    routes = RouteTable()
+    routes.add("A", r"/product/(?P<id>\d+)")
+    route = routes.add("B", r"/product/(?P<sku>\w+)/edit")
+    assert route.pagePath is None
+    assert routes.route_for_handler("A").pagePath == "/product/[id]"
+
+
+def test_page_path_collisions_skip_the_later_route():
+    routes = RouteTable()
+    first = routes.add("A", r"/product/(\d+)")
+    second = routes.add("B", r"/product/(\w+)")
+    assert first.pagePath == "/product/[param1]"
+    assert second.pagePath is None
+    assert routes.match("/product/abc") is None
+    assert routes.match("/product/1") == (first, {"param1": "1"})
+
+
+def test_a_handler_can_replace_its_own_route():
+    routes = RouteTable()
+    routes.add("A", r"/product/(\d+)")
+    route = routes.add("A", r"/product/(\w+)")
+    assert route.pagePath == "/product/[param1]"
+    assert routes.match("/product/abc") == (route, {"param1": "abc"})
+
+
+def test_match_prefers_static_then_dynamic_then_catch_all():
+    routes = RouteTable()
+    static = routes.add("Static", r"/files/new")
+    dynamic = routes.add("Dynamic", r"/files/(\d+)")
+    catchAll = routes.add("CatchAll", r"/files/(.*)")
+
+    assert routes.match("/files/new") == (static, {})
+    assert routes.match("/files/12/") == (dynamic, {"param1": "12"})
+    assert routes.match("/files/a/b?x=1") == (catchAll, {"param1": "a/b"})
+    assert routes.match("/other") is None
+
+
+@pytest.mark.parametrize(
+    "pattern, expected",
+    [
+        (r"^/orders/?$", "/orders"),
+        (r"/product/(?P<id>\d+)/edit", "/product/1/edit"),
+        (r"/re/(new|old)", "/re/new"),
+        (r"/files/(.*)", "/files/a"),
+        (r"/sku/([^/]+)/([A-Z]{2})", "/sku/a/AA"),
+        (r"/robots.txt", "/robots.txt"),
+        (r"/look(?=ahead)", None),
+    ],
+)
+def test_example_url(pattern, expected):
+    routes = RouteTable()
+    assert example_url(routes.add("A", pattern)) == expected
+
+
+def test_verify_reports_routes_served_by_another_page():
+    routes = RouteTable()
+    routes.add("Index", r"/")
+    routes.add("Segment", r"/files/([^/]+)")
+    routes.add("Raw", r"/files/(.+)/raw")
+    routes.add("Choice", r"/files/(new|old)/history")
+    routes.add("Robots", r"/robots.txt")
+    assert routes.verify() == []
+
+    # /product/1 is the example URL, and the static page serves it
+    routes.add("Static", r"/product/1")
+    dynamic = routes.add("Dynamic", r"/product/(\d+)")
+    assert routes.verify() == [dynamic]
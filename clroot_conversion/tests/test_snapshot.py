@@ -0,0 +1,8 @@
+#!/usr/bin/env python3
+from lib import snapshot
+
+
+def test_converter_hashes_cover_the_driver():
+    hashes = snapshot.converter_hashes()
+    assert "../makeLeopard.py" in hashes
+    assert "convert.py" in hashes
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+import pytest
+
+from conftest import write_files
+from lib import typecheck
+from lib.importgraph import ImportGraph
+
+
+@pytest.fixture
+def leopard(tmp_path, monkeypatch):
+    monkeypatch.setattr(typecheck, "LEOPARD_PKG_DIR", str(tmp_path / "pkg"))
+    monkeypatch.setattr(typecheck, "LEOPARD_PAGES_DIR", str(tmp_path / "pages"))
+    monkeypatch.setattr(typecheck, "LEOPARD_GENERATED_DIR", str(tmp_path / "gen"))
+    write_files(
+        tmp_path,
+        {
+            "pkg/merchant/container/index.ts": (
+                'export { default as FooContainer } from "@merchant/component/Foo";\n'
+                'export { default as BarContainer } from "@merchant/component/Bar";\n'
+            ),
+            "pkg/merchant/component/Foo.tsx": 'import { shared } from "./shared";\n',
+            "pkg/merchant/component/Bar.tsx": 'import { shared } from "./shared";\n',
+            "pkg/merchant/component/shared.ts": "export const shared = 1;\n",
+            "pages/foo.tsx": 'import { FooContainer } from "@merchant/container";\n',
+            "pages/bar.tsx": 'import { BarContainer as Bar } from "@merchant/container";\n',
+        },
+    )
+    return tmp_path
+
+
+def _scope_after(leopard, files):
+    versions = typecheck.file_versions(["merchant"], {})
+    state = {"files": versions, "failing": []}
+    write_files(leopard, files)
+    versions = typecheck.file_versions(["merchant"], versions)
+    graph = ImportGraph(str(leopard / "pkg")).update()
+    scope, _ = typecheck.typecheck_scope(versions, state, graph)
+    return {path for path in scope if path.startswith(str(leopard / "pages"))}
+
+
+def test_container_change_scopes_only_its_page(leopard):
+    assert _scope_after(
+        leopard, {"pkg/merchant/component/Foo.tsx": "export default 1;\n"}
+    ) == {str(leopard / "pages/foo.tsx")}
+
+
+@pytest.mark.parametrize(
+    "changed",
+    [
+        "pkg/merchant/component/shared.ts",
+        "pkg/merchant/container/index.ts",
+    ],
+)
+def test_shared_changes_scope_every_page(leopard, changed):
+    assert _scope_after(leopard, {changed: "// changed\n"}) == {
+        str(leopard / "pages/foo.tsx"),
+        str(leopard / "pages/bar.tsx"),
+    }
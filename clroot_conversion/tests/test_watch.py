@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+import os
+
+from conftest import write_files
+from lib import paths, watch
+from lib.routes import RouteTable
+
+
+def test_resync_catches_up_on_missed_changes(tmp_path, monkeypatch):
+    monkeypatch.setattr(paths, "CLROOT_SOURCE_DIR", str(tmp_path / "clroot"))
+    monkeypatch.setattr(paths, "CLROOT_PKG_DIR", str(tmp_path / "clroot/pkg"))
+    monkeypatch.setattr(
+        paths, "CLROOT_HANDLERS_DIR", str(tmp_path / "clroot/handlers")
+    )
+    monkeypatch.setattr(paths, "CLROOT_URI_SPEC_PATHS", [])
+    monkeypatch.setattr(watch, "LEOPARD_PKG_DIR", str(tmp_path / "leopard"))
+    files = {
+        "merchant/data.json": "{}",
+        "merchant/stale.json": "{}",
+        "merchant/container/index.ts": "",
+    }
+    write_files(tmp_path / "clroot/pkg", files)
+    write_files(tmp_path / "leopard", files)
+    write_files(
+        tmp_path / "clroot/handlers",
+        {
+            "a.py": 'AHandler = Handler(container="AContainer", package="merchant")\n',
+            "b.py": 'BHandler = Handler(container="BContainer", package="merchant")\n',
+        },
+    )
+    build = watch.IncrementalBuild(
+        ["merchant"],
+        RouteTable(),
+        {
+            "AContainer": [str(tmp_path / "clroot/handlers/a.py")],
+            "BContainer": [str(tmp_path / "clroot/handlers/b.py")],
+        },
+        pages={},
+        removed=set(),
+    )
+
+    # changes made while the watcher dropped their events
+    write_files(
+        tmp_path / "clroot/pkg",
+        {"merchant/data.json": '{"changed": true}', "merchant/new/added.json": "{}"},
+    )
+    os.remove(tmp_path / "clroot/pkg/merchant/stale.json")
+    os.remove(tmp_path / "clroot/handlers/b.py")
+    write_files(
+        tmp_path / "clroot/handlers",
+        {"c.py": 'CHandler = Handler(container="CContainer", package="merchant")\n'},
+    )
+    build.rebuild(set(), resync=True)
+
+    assert (tmp_path / "leopard/merchant/data.json").read_text() == '{"changed": true}'
+    assert (tmp_path / "leopard/merchant/new/added.json").exists()
+    assert not (tmp_path / "leopard/merchant/stale.json").exists()
+    assert build.handlerIndex == {
+        "AContainer": [str(tmp_path / "clroot/handlers/a.py")],
+        "CContainer": [str(tmp_path / "clroot/handlers/c.py")],
+    }
+    # everything missed was synced
+    assert build._unsynced_files() == set()